@@ -0,0 +1,107 @@
+"""Compare the lxml feed parser against the BeautifulSoup path it replaced.
+
+Run from the repository root: python -m benchmarks.feed_parser
+"""
+from timeit import timeit
+
+from bs4 import BeautifulSoup
+
+from twitchtools.feed import parse_feed
+
+CHANNEL_ID = "UCV6mNrW8CrmWtcxWfQXy11g"
+
+# Shape of a push notification from the pubsubhubbub hub
+PUSH_SAMPLE = f"""<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+ <link rel="hub" href="https://pubsubhubbub.appspot.com"/>
+ <link rel="self" href="https://www.youtube.com/xml/feeds/videos.xml?channel_id={CHANNEL_ID}"/>
+ <title>YouTube video feed</title>
+ <updated>2023-03-09T19:05:24.552394234+00:00</updated>
+ <entry>
+  <id>yt:video:dQw4w9WgXcQ</id>
+  <yt:videoId>dQw4w9WgXcQ</yt:videoId>
+  <yt:channelId>{CHANNEL_ID}</yt:channelId>
+  <title>Stream title</title>
+  <link rel="alternate" href="http://www.youtube.com/watch?v=dQw4w9WgXcQ"/>
+  <author>
+   <name>Channel Name</name>
+   <uri>http://www.youtube.com/channel/{CHANNEL_ID}</uri>
+  </author>
+  <published>2023-03-09T19:05:00+00:00</published>
+  <updated>2023-03-09T19:05:24.552394234+00:00</updated>
+ </entry>
+</feed>"""
+
+# Shape of a deleted video push notification
+DELETED_SAMPLE = f"""<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns:at="http://purl.org/atompub/tombstone/1.0" xmlns="http://www.w3.org/2005/Atom">
+ <at:deleted-entry ref="yt:video:dQw4w9WgXcQ" when="2023-03-09T19:05:24.552394234+00:00">
+  <link href="https://www.youtube.com/watch?v=dQw4w9WgXcQ"/>
+  <at:by>
+   <name>Channel Name</name>
+   <uri>https://www.youtube.com/channel/{CHANNEL_ID}</uri>
+  </at:by>
+ </at:deleted-entry>
+</feed>"""
+
+POLL_ENTRY = """ <entry>
+  <id>yt:video:vid{index:08d}</id>
+  <yt:videoId>vid{index:08d}</yt:videoId>
+  <yt:channelId>{channel_id}</yt:channelId>
+  <title>Video {index}</title>
+  <link rel="alternate" href="https://www.youtube.com/watch?v=vid{index:08d}"/>
+  <author>
+   <name>Channel Name</name>
+   <uri>https://www.youtube.com/channel/{channel_id}</uri>
+  </author>
+  <published>2023-03-0{day}T12:00:00+00:00</published>
+  <updated>2023-03-0{day}T12:30:00+00:00</updated>
+  <media:group>
+   <media:title>Video {index}</media:title>
+   <media:content url="https://www.youtube.com/v/vid{index:08d}?version=3" type="application/x-shockwave-flash" width="640" height="390"/>
+   <media:thumbnail url="https://i2.ytimg.com/vi/vid{index:08d}/hqdefault.jpg" width="480" height="360"/>
+   <media:description>{description}</media:description>
+   <media:community>
+    <media:starRating count="1234" average="5.00" min="1" max="5"/>
+    <media:statistics views="56789"/>
+   </media:community>
+  </media:group>
+ </entry>
+"""
+
+# Shape of the channel RSS feed read by catchup, which always holds the 15 most recent uploads
+POLL_SAMPLE = f"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns:media="http://search.yahoo.com/mrss/" xmlns="http://www.w3.org/2005/Atom">
+ <link rel="self" href="http://www.youtube.com/feeds/videos.xml?channel_id={CHANNEL_ID}"/>
+ <id>yt:channel:{CHANNEL_ID[2:]}</id>
+ <yt:channelId>{CHANNEL_ID[2:]}</yt:channelId>
+ <title>Channel Name</title>
+ <link rel="alternate" href="https://www.youtube.com/channel/{CHANNEL_ID}"/>
+ <author>
+  <name>Channel Name</name>
+  <uri>https://www.youtube.com/channel/{CHANNEL_ID}</uri>
+ </author>
+ <published>2015-01-01T00:00:00+00:00</published>
+{''.join(POLL_ENTRY.format(index=i, channel_id=CHANNEL_ID, day=i % 9 + 1, description="A video description. " * 40) for i in range(15))}</feed>"""
+
+
+def soup_video_ids(content: str) -> list[str]:
+    # The path used by parse_video_xml and get_recent_video_ids before the lxml parser
+    soup = BeautifulSoup(content, features="xml")
+    soup.find_all('name')[0].text
+    ids_search = soup.find_all("yt:videoid")
+    ids_search += soup.find_all("yt:videoId")
+    return [id.text for id in ids_search]
+
+
+def main(number: int = 500):
+    for name, sample in (("push", PUSH_SAMPLE), ("deleted", DELETED_SAMPLE), ("poll", POLL_SAMPLE)):
+        if name != "deleted":
+            assert soup_video_ids(sample) == parse_feed(sample).video_ids
+        soup_time = timeit(lambda: soup_video_ids(sample), number=number)
+        lxml_time = timeit(lambda: parse_feed(sample), number=number)
+        print(f"{name:8s} bs4 {soup_time/number*1e6:9.1f}us  lxml {lxml_time/number*1e6:9.1f}us  {soup_time/lxml_time:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
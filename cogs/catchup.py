@@ -1,10 +1,15 @@
+from time import time
 from typing import TYPE_CHECKING, Optional
 
 from disnake.ext import commands, tasks
+from munch import munchify
 
 from twitchtools import (AlertOrigin, ApplicationCustomContext, Callback,
                          PartialUser, PartialYoutubeUser, YoutubeCallback,
+                         RequestPriority, YoutubeVideoType,
                          has_manage_permissions)
+from twitchtools.catchup_scheduler import (TWITCH_INTERVALS, YOUTUBE_INTERVALS,
+                                           CatchupScheduler)
 from twitchtools.exceptions import (VideoNotFound, VideoNotStream,
                                     VideoStreamEnded)
 
@@ -16,6 +21,12 @@ class Catchup(commands.Cog):
     def __init__(self, bot):
         self.bot: TwitchCallBackBot = bot
         super().__init__()
+        # Cost and time of the last full youtube catchup, used to pace them within the daily quota
+        self.last_youtube_cost: int = 0
+        self.last_youtube_catchup: float = 0
+        # Each channel is only caught up when due, based on how likely it is to go live or end
+        self.twitch_schedule = CatchupScheduler(TWITCH_INTERVALS)
+        self.youtube_schedule = CatchupScheduler(YOUTUBE_INTERVALS)
         self.twitch_backup_checks.start()
         self.youtube_backup_checks.start()
 
@@ -23,16 +34,48 @@ class Catchup(commands.Cog):
         self.twitch_backup_checks.cancel()
         self.youtube_backup_checks.cancel()
 
-    @tasks.loop(seconds=1800)
+    # Checks which channels are due a catchup, the schedule decides how often each is actually checked
+    @tasks.loop(seconds=300)
     async def twitch_backup_checks(self):
-        await self.twitch_catchup()
-        self.bot.log.debug("Ran twitch catchup")
+        await self.bot.wait_until_ready()
+        await self.bot.wait_until_db_ready()
+        callbacks = await self.bot.db.get_all_callbacks()
+        caches = await self.bot.db.get_channel_caches(list(callbacks.keys()), projection={"is_live": True, "alert_cooldown": True})
+        due = self.twitch_schedule.due({s: caches.get(s, {}) for s in callbacks.keys()})
+        if not due:
+            return
+        await self.twitch_catchup({s: callbacks[s] for s in due})
+        self.twitch_schedule.record_poll(due)
+        self.bot.log.debug(f"Ran twitch catchup for {len(due)}/{len(callbacks)} streamers")
 
     # Youtube callbacks are extremely unreliable and need a higher frequency. Also stream ends are only triggered by catchup
-    @tasks.loop(seconds=600)
+    @tasks.loop(seconds=300)
     async def youtube_backup_checks(self):
-        await self.youtube_catchup()
-        self.bot.log.debug("Ran youtube catchup")
+        await self.bot.wait_until_ready()
+        await self.bot.wait_until_db_ready()
+        callbacks = await self.bot.db.get_all_yt_callbacks()
+        caches = await self.bot.db.get_yt_channel_caches(list(callbacks.keys()), projection={"is_live": True, "alert_cooldown": True})
+        due_ids = set(self.youtube_schedule.due({c.id: caches.get(c.id, {}) for c in callbacks.keys()}))
+        due = {c: callback for c, callback in callbacks.items() if c.id in due_ids}
+        if not due:
+            return
+        quota = self.bot.yapi.quota
+        interval = quota.required_interval(self.last_youtube_cost)
+        if time() - self.last_youtube_catchup < interval:
+            # Not enough quota left for full catchups this often, only check if live channels have ended
+            self.bot.log.debug(f"Youtube quota low ({quota.spent}/{quota.daily_limit}, projected {quota.projected}), checking live channels only")
+            live = {c: callback for c, callback in due.items() if caches.get(c.id, {}).get("is_live", False)}
+            if live:
+                await self.youtube_catchup(live, live_only=True)
+                self.youtube_schedule.record_poll([c.id for c in live.keys()])
+            return
+        spent = quota.spent
+        await self.youtube_catchup(due)
+        self.youtube_schedule.record_poll(list(due_ids))
+        # Spend goes back to 0 if the quota reset during catchup
+        self.last_youtube_cost = max(quota.spent - spent, 0)
+        self.last_youtube_catchup = time()
+        self.bot.log.debug(f"Ran youtube catchup for {len(due)}/{len(callbacks)} channels, costing {self.last_youtube_cost} quota units")
 
     @commands.slash_command()
     async def catchup(self, ctx: ApplicationCustomContext):
@@ -53,11 +96,12 @@ class Catchup(commands.Cog):
     @commands.cooldown(1, 10, commands.BucketType.guild)
     async def catchup_server(self, ctx: ApplicationCustomContext):
         await ctx.response.defer(ephemeral=True)
-        twitch_filtered_callbacks = {s: c for s, c in (await self.bot.db.get_all_callbacks()).items() if str(ctx.guild.id) in c.alert_roles.keys()}
-        await self.twitch_catchup(twitch_filtered_callbacks)
-        
-        youtube_filtered_callbacks = {s: c for s, c in (await self.bot.db.get_all_yt_callbacks()).items() if str(ctx.guild.id) in c.alert_roles.keys()}
-        await self.youtube_catchup(youtube_filtered_callbacks)
+        # Empty callbacks would fall back to catching up every streamer
+        if twitch_guild_callbacks := await self.bot.db.get_guild_callbacks(ctx.guild):
+            await self.twitch_catchup(twitch_guild_callbacks)
+
+        if youtube_guild_callbacks := await self.bot.db.get_guild_yt_callbacks(ctx.guild):
+            await self.youtube_catchup(youtube_guild_callbacks)
         self.bot.log.info(f"Finished manual server catchup for {ctx.guild.name}")
         await ctx.send(f"{self.bot.emotes.success} Finished server catchup!", ephemeral=True)
 
@@ -69,33 +113,36 @@ class Catchup(commands.Cog):
             return
 
         # Fetch all streamers, returning the currently live ones
-        streams = await self.bot.tapi.get_streams(user_ids=list(callbacks.keys()), origin=AlertOrigin.catchup)
-        # We only need the ID from them, as a string due to dict keys only being strings
-        online_stream_uids = [str(stream.user.id) for stream in streams]
+        streams = await self.bot.tapi.get_streams(user_ids=list(callbacks.keys()), origin=AlertOrigin.catchup, priority=RequestPriority.background)
+        # Keyed by ID as a string due to dict keys only being strings
+        online_streams = {str(stream.user.id): stream for stream in streams}
+        # Get all caches in one query, so the state manager only reads again for streamers that changed state
+        caches = await self.bot.db.get_channel_caches(list(callbacks.keys()), projection={"is_live": True})
 
         # Iterate through all callbacks and update all streamers
         for streamer_id, callback_info in callbacks.items():
-            if streamer_id in online_stream_uids:
-                stream = [s for s in streams if s.user.id ==
-                          int(streamer_id)][0]
+            if stream := online_streams.get(streamer_id, None):
                 # Update display name if needed
                 if callback_info.display_name != stream.user.display_name:
                     callback_info.display_name = stream.user.display_name
-                    await self.bot.db.write_callback(stream.user, callback_info)
-                self.bot.queue.put_nowait(stream)
+                    await self.bot.db.write_callback(stream.user, callback_info, buffered=True)
+                item = stream
             else:
-                self.bot.queue.put_nowait(PartialUser(
-                    streamer_id, callback_info.display_name.lower(), callback_info.display_name, origin=AlertOrigin.catchup))
+                item = PartialUser(streamer_id, callback_info.display_name.lower(), callback_info.display_name, origin=AlertOrigin.catchup)
+            item.channel_cache = caches.get(streamer_id, munchify({}))
+            self.bot.queue.put_nowait(item)
 
-    async def youtube_catchup(self, callbacks: Optional[dict[PartialYoutubeUser, YoutubeCallback]] = None):
+    async def youtube_catchup(self, callbacks: Optional[dict[PartialYoutubeUser, YoutubeCallback]] = None, live_only: bool = False):
+        """live_only skips looking for new streams, only checking whether live channels have ended"""
         await self.bot.wait_until_ready()
         await self.bot.wait_until_db_ready()
         callbacks = callbacks or await self.bot.db.get_all_yt_callbacks()
         if callbacks == {}:
             return
 
-        # Get all caches, saves multiple DB calls for same data
-        caches = {c: await self.bot.db.get_yt_channel_cache(c) for c in callbacks.keys()}
+        # Get all caches in one query, saves multiple DB calls for same data
+        found_caches = await self.bot.db.get_yt_channel_caches(list(callbacks.keys()), projection={"is_live": True, "video_id": True})
+        caches = {c: found_caches.get(c.id, munchify({})) for c in callbacks.keys()}
 
         # Offline -> online handling
 
@@ -104,9 +151,9 @@ class Catchup(commands.Cog):
         ) if not caches[c].get("is_live", False)]
         self.bot.log.debug(f"Channels not currently live: {non_live_channels}")
         # Fetch recent video IDs from each channel. No API cost. Only check non live channels. Returns dict[channel, list[video_id]]
-        recent_vids = await self.bot.yapi.get_recent_video_ids(non_live_channels)
+        recent_vids = await self.bot.yapi.get_recent_video_ids({c: callbacks[c] for c in non_live_channels}) if not live_only else {}
         self.bot.log.debug(f"Recent Video IDs for Channels: {recent_vids}")
-        # Returns dict containing each channel as key and video id as value. Return empty dict if none
+        # Returns dict containing each channel as key and its live video ids as value. Return empty dict if none
         new_live_channels = await self.bot.yapi.are_videos_live(recent_vids)
         self.bot.log.debug(f"New Live Channels: {new_live_channels}")
 
@@ -132,19 +179,23 @@ class Catchup(commands.Cog):
                     except (VideoNotFound, VideoNotStream, VideoStreamEnded):
                         continue
                     self.bot.queue.put_nowait(video)
-            else:
-                # Otherwise, check if channel is live, and fetch video that is live
-                if video_id := new_live_channels.get(channel, None):
-                    try:
-                        video = await self.bot.yapi.get_stream(video_id, origin=AlertOrigin.catchup)
-                    except (VideoNotFound, VideoNotStream, VideoStreamEnded):
-                        continue
+            elif not live_only:
+                # Otherwise, check if channel is live, and fetch the first candidate video that is live
+                if video_ids := new_live_channels.get(channel, None):
+                    video = None
+                    for video_id in video_ids:
+                        try:
+                            video = await self.bot.yapi.get_stream(video_id, origin=AlertOrigin.catchup)
+                        except (VideoNotFound, VideoNotStream, VideoStreamEnded):
+                            continue
+                        if video.type not in [YoutubeVideoType.scheduled_stream, YoutubeVideoType.scheduled_premiere]:
+                            break
                     if not video:
                         continue
                     # Update display name if needed
                     if callback_info.display_name != video.user.display_name:
                         callback_info.display_name = video.user.display_name
-                        await self.bot.db.write_yt_callback(video.user, callback_info)
+                        await self.bot.db.write_yt_callback(video.user, callback_info, buffered=True)
                     self.bot.queue.put_nowait(video)
                 else:
                     channel.origin = AlertOrigin.catchup
@@ -19,7 +19,7 @@ from munch import munchify
 
 from main import TwitchCallBackBot
 from twitchtools import (AlertOrigin, AlertType, ApplicationCustomContext,
-                         Callback, Confirm, PartialUser, PartialYoutubeUser,
+                         Callback, Confirm, PartialYoutubeUser,
                          PlatformChoice, SortableTextPaginator,
                          SubscriptionError, SubscriptionType, TextPaginator,
                          User, UserType, YoutubeCallback, YoutubeSubscription,
@@ -120,18 +120,18 @@ def DiscordTimezone(utc, format: TimestampOptions):
 
 # Autocompleters
 async def twitch_streamertitles_autocomplete(ctx: ApplicationCustomContext, user_input: str):
-    callbacks = await ctx.bot.db.get_all_title_callbacks()
-    return [alert_info['display_name'] for alert_info in callbacks.values() if str(ctx.guild.id) in alert_info['alert_roles'].keys() and alert_info['display_name'].lower().startswith(user_input)][:25]
+    callbacks = await ctx.bot.db.get_guild_title_callbacks(ctx.guild)
+    return [alert_info['display_name'] for alert_info in callbacks.values() if alert_info['display_name'].lower().startswith(user_input)][:25]
 
 
 async def youtube_streamer_autocomplete(ctx: ApplicationCustomContext, user_input: str):
-    callbacks = await ctx.bot.db.get_all_yt_callbacks()
-    return [alert_info['display_name'] for alert_info in callbacks.values() if str(ctx.guild.id) in alert_info['alert_roles'].keys() and alert_info['display_name'].lower().startswith(user_input)][:25]
+    callbacks = await ctx.bot.db.get_guild_yt_callbacks(ctx.guild)
+    return [alert_info['display_name'] for alert_info in callbacks.values() if alert_info['display_name'].lower().startswith(user_input)][:25]
 
 
 async def twitch_streamer_autocomplete(ctx: ApplicationCustomContext, user_input: str):
-    callbacks = await ctx.bot.db.get_all_callbacks()
-    return [alert_info['display_name'] for alert_info in callbacks.values() if str(ctx.guild.id) in alert_info['alert_roles'].keys() and alert_info['display_name'].lower().startswith(user_input)][:25]
+    callbacks = await ctx.bot.db.get_guild_callbacks(ctx.guild)
+    return [alert_info['display_name'] for alert_info in callbacks.values() if alert_info['display_name'].lower().startswith(user_input)][:25]
 
 
 class CommandsCog(commands.Cog):
@@ -198,6 +198,38 @@ class CommandsCog(commands.Cog):
         embed.add_field(name="__Bot__", value=botinfo, inline=False)
         systeminfo = f"**<:python:879586023116529715> Python Version:** {sys.version.split()[0]}\n**<:discordpy:879586265014607893> Disnake Version:** {disnake.__version__}\n**<:microprocessor:879591544070488074> Process Memory Usage:** {psutil.Process(getpid()).memory_info().rss/1048576:.2f}MB"
         embed.add_field(name="__System__", value=systeminfo, inline=False)
+        notif_stats = self.bot.web_server.notif_cache.stats
+        pipelineinfo = f"**📨 Webhook Dedup:** {notif_stats['size']} cached, {notif_stats['hits']} duplicates, {notif_stats['misses']} new"
+        if queue_cog := self.bot.get_cog("QueueHandler"):
+            backlog = sorted(queue_cog.backlog_sizes.items(), key=lambda i: i[1], reverse=True)
+            busiest = ', '.join(f"{key} ({size})" for key, size in backlog[:3]) or "None"
+            pipelineinfo += f"\n**📥 Queue:** {sum(size for _, size in backlog)} pending across {len(backlog)}/{queue_cog.worker_count} workers. Busiest: {busiest}"
+        limiter = self.bot.tapi.ratelimiter
+        pipelineinfo += f"\n**⏳ Helix Ratelimit:** {limiter.remaining}/{limiter.limit} remaining, {limiter.pending} waiting, {limiter.waited} delayed, {limiter.ratelimited} 429s"
+        twitch_flight, youtube_flight = self.bot.tapi.singleflight.stats, self.bot.yapi.singleflight.stats
+        pipelineinfo += f"\n**🛫 Shared Requests:** Twitch {twitch_flight['shared']}/{twitch_flight['calls'] + twitch_flight['shared']}, Youtube {youtube_flight['shared']}/{youtube_flight['calls'] + youtube_flight['shared']} saved"
+        user_stats = self.bot.tapi.user_cache.stats
+        pipelineinfo += f"\n**👤 User Cache:** {user_stats['size']} cached, {user_stats['hits']} hits, {user_stats['stale']} stale, {user_stats['misses']} misses"
+        websocket = self.bot.get_cog("EventSub Websocket")
+        if websocket and websocket.enabled:
+            state = f"Connected, {len(websocket.bound)} subscriptions bound" if websocket.connected else "Disconnected"
+            if websocket.unbound:
+                state += f", {websocket.unbound} over twitch's limits"
+            pipelineinfo += f"\n**🔌 Eventsub Websocket:** {state}, {websocket.reconnects} reconnects"
+        quota = self.bot.yapi.quota.stats
+        pipelineinfo += f"\n**📊 Youtube Quota:** {quota['spent']}/{quota['limit']} units spent, {quota['projected']} projected by reset {DiscordTimezone(time() + quota['reset_in'], TimestampOptions.relative)}"
+        video_stats = self.bot.yapi.video_cache.stats
+        pipelineinfo += f"\n**🎞️ Video Cache:** {video_stats['size']} cached, {video_stats['hits']} hits, {video_stats['misses']} misses"
+        if catchup := self.bot.get_cog("Catchup"):
+            twitch_schedule, youtube_schedule = catchup.twitch_schedule.stats, catchup.youtube_schedule.stats
+            pipelineinfo += f"\n**🗓️ Catchup Schedule:** Twitch {twitch_schedule['polled']} checked, {twitch_schedule['skipped']} skipped. Youtube {youtube_schedule['polled']} checked, {youtube_schedule['skipped']} skipped"
+        writes = self.bot.db.writes.stats
+        pipelineinfo += f"\n**💾 Write Buffer:** {writes['pending']} pending, {writes['buffered']} buffered writes sent as {writes['written']} in {writes['flushes']} bulk writes, {writes['retried']} retried, {writes['dropped']} dropped"
+        health = self.bot.db.health
+        pipelineinfo += f"\n**🗄️ Database:** {'Up' if health.up else 'Down'} since {DiscordTimezone(int(health.since), TimestampOptions.relative)}, {health.outages} outages, {health.failed_heartbeats}/{health.heartbeats + health.failed_heartbeats} heartbeats failed"
+        if recent := [f"{'Up' if up else 'Down'} {DiscordTimezone(int(at), TimestampOptions.relative)}" for at, up, _ in list(health.history)[-4:-1]]:
+            pipelineinfo += f" (previously {', '.join(reversed(recent))})"
+        embed.add_field(name="__Pipeline__", value=pipelineinfo, inline=False)
         embed.set_author(name=self.bot.user.name,
                          icon_url=self.bot.user.display_avatar.with_size(128))
         embed.set_footer(text=f"Client ID: {self.bot.user.id}")
@@ -486,21 +518,29 @@ class CommandsCog(commands.Cog):
 
         await self.bot.db.write_callback(streamer, callback)
 
-        if make_subscriptions:
+        if make_subscriptions and self.bot.eventsub_transport == "websocket":
             if not ctx.response.is_done():
                 await ctx.response.defer()
-            try:
-                sub1 = await self.bot.tapi.create_subscription(SubscriptionType.STREAM_ONLINE, streamer=streamer, secret=callback["secret"], alert_type=AlertType.status)
-                callback["online_id"] = sub1.id
-                sub2 = await self.bot.tapi.create_subscription(SubscriptionType.STREAM_OFFLINE, streamer=streamer, secret=callback["secret"], alert_type=AlertType.status)
-                callback["offline_id"] = sub2.id
-                # Don't create a title updates subscription if we can take it from title updates callback
-                if callback.get("title_id", None) is None:
-                    sub3 = await self.bot.tapi.create_subscription(SubscriptionType.CHANNEL_UPDATE, streamer=streamer, secret=callback["secret"], alert_type=AlertType.title)
-                    callback["title_id"] = sub3.id
-            except SubscriptionError as e:
+            await self.bind_websocket_subscriptions()
+        elif make_subscriptions:
+            if not ctx.response.is_done():
+                await ctx.response.defer()
+            wanted = [("online_id", SubscriptionType.STREAM_ONLINE, AlertType.status),
+                      ("offline_id", SubscriptionType.STREAM_OFFLINE, AlertType.status)]
+            # Don't create a title updates subscription if we can take it from title updates callback
+            if callback.get("title_id", None) is None:
+                wanted.append(("title_id", SubscriptionType.CHANNEL_UPDATE, AlertType.title))
+            # Created together, so their confirmations are waited on at the same time
+            results = await self.bot.tapi.create_subscriptions([(sub_type, streamer, callback["secret"], alert_type) for _, sub_type, alert_type in wanted])
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                for result in results:
+                    if not isinstance(result, Exception):
+                        await self.bot.tapi.delete_subscription(result)
                 await self.twitch_callback_deletion(ctx, streamer, callback, alert_type=AlertType.status)
-                raise SubscriptionError(str(e))
+                raise SubscriptionError(str(errors[0]))
+            for (field, _, _), subscription in zip(wanted, results):
+                callback[field] = subscription.id
 
         await self.bot.db.write_callback(streamer, callback)
 
@@ -628,7 +668,7 @@ class CommandsCog(commands.Cog):
 
         # Run catchup on streamer immediately
         if make_subscriptions:
-            if video_id := await self.bot.yapi.is_channel_live(channel):
+            if video_id := await self.bot.yapi.is_channel_live(channel, callback):
                 video = await self.bot.yapi.get_stream(video_id, origin=AlertOrigin.catchup)
                 self.bot.queue.put_nowait(video)
             else:
@@ -740,13 +780,14 @@ class CommandsCog(commands.Cog):
     async def streamers_list_twitch(self, ctx: ApplicationCustomContext):
         await ctx.response.defer()
         await self.bot.wait_until_db_ready()
-        callbacks = await self.bot.db.get_all_callbacks()
+        # Only this server's streamers, the empty list message has always said as much
+        callbacks = await self.bot.db.get_guild_callbacks(ctx.guild)
 
         if len(callbacks) == 0:
             return await ctx.send(f"{self.bot.emotes.error} No streamers configured for this server!")
-        for streamer_id, alert_info in dict(callbacks).items():
-            cache = await self.bot.db.get_channel_cache(PartialUser(streamer_id, alert_info["display_name"].lower(), alert_info["display_name"]))
-            callbacks[streamer_id]["last_live"] = cache.get(
+        caches = await self.bot.db.get_channel_caches(list(callbacks.keys()), projection={"alert_cooldown": True})
+        for streamer_id in callbacks.keys():
+            callbacks[streamer_id]["last_live"] = caches.get(streamer_id, {}).get(
                 "alert_cooldown", 0)
         view = SortableTextPaginator(ctx, callbacks, self.page_generator, sorting_options={
                                      "display_name": 0, "last_live": 1}, show_delete=True)
@@ -756,13 +797,14 @@ class CommandsCog(commands.Cog):
     async def streamers_list_youtube(self, ctx: ApplicationCustomContext):
         await ctx.response.defer()
         await self.bot.wait_until_db_ready()
-        callbacks = await self.bot.db.get_all_yt_callbacks()
+        # Only this server's streamers, the empty list message has always said as much
+        callbacks = await self.bot.db.get_guild_yt_callbacks(ctx.guild)
 
         if len(callbacks) == 0:
             return await ctx.send(f"{self.bot.emotes.error} No streamers configured for this server!")
-        for streamer, alert_info in dict(callbacks).items():
-            cache = await self.bot.db.get_yt_channel_cache(streamer)
-            callbacks[streamer]["last_live"] = cache.get(
+        caches = await self.bot.db.get_yt_channel_caches(list(callbacks.keys()), projection={"alert_cooldown": True})
+        for streamer in callbacks.keys():
+            callbacks[streamer]["last_live"] = caches.get(streamer.id, {}).get(
                 "alert_cooldown", 0)
         view = SortableTextPaginator(ctx, callbacks, self.page_generator, sorting_options={
                                      "display_name": 0, "last_live": 1}, show_delete=True)
@@ -887,7 +929,12 @@ class CommandsCog(commands.Cog):
             title_callback["alert_roles"][str(
                 ctx.guild.id)]["role_id"] = alert_role.id
 
-        if await self.bot.db.get_callback(streamer) is None:
+        if await self.bot.db.get_callback(streamer) is None and self.bot.eventsub_transport == "websocket":
+            await self.bot.db.write_title_callback(streamer, title_callback)
+            if not ctx.response.is_done():
+                await ctx.response.defer()
+            await self.bind_websocket_subscriptions()
+        elif await self.bot.db.get_callback(streamer) is None:
             title_callback["secret"] = self.bot.random_string_generator(21)
             await self.bot.db.write_title_callback(streamer, title_callback)
             if not ctx.response.is_done():
@@ -928,7 +975,7 @@ class CommandsCog(commands.Cog):
     @titlechanges_list.sub_command(name="twitch", description="List all the active title change alerts setup in this server")
     async def titlechanges_list_twitch(self, ctx: ApplicationCustomContext):
         await ctx.response.defer()
-        title_callbacks = await self.bot.db.get_all_title_callbacks()
+        title_callbacks = await self.bot.db.get_guild_title_callbacks(ctx.guild)
 
         if len(title_callbacks) == 0:
             return await ctx.send(f"{self.bot.emotes.error} No title changes configured for this server!")
@@ -1016,12 +1063,24 @@ class CommandsCog(commands.Cog):
                 await self.bot.db.delete_callback(streamer)
             elif alert_type.name == "title":
                 await self.bot.db.delete_title_callback(streamer)
+            await self.bind_websocket_subscriptions()
         else:
             if alert_type.name == "status":
                 await self.bot.db.write_callback(streamer, callback)
             elif alert_type.name == "title":
                 await self.bot.db.write_title_callback(streamer, callback)
 
+    async def bind_websocket_subscriptions(self):
+        """With the websocket transport, bind subscriptions for added streamers and unbind removed ones straight away"""
+        websocket = self.bot.get_cog("EventSub Websocket")
+        if websocket is None or not websocket.enabled:
+            return
+        try:
+            await websocket.bind()
+        except Exception as e:
+            # The websocket cog retries every few minutes, so this doesn't need to fail the command
+            self.bot.log.warning(f"[Twitch] Failed to bind websocket subscriptions: {e}")
+
     async def youtube_callback_deletion(self, ctx: ApplicationCustomContext, channel: YoutubeUser, callback: YoutubeCallback = None):
         await self.bot.wait_until_db_ready()
         callback = munchify(callback or await self.bot.db.get_yt_callback(channel))
@@ -1048,56 +1107,49 @@ class CommandsCog(commands.Cog):
     async def resubscribe(self, ctx: ApplicationCustomContext):
         pass
 
-    @resubscribe.sub_command(name="twitch", description="Owner Only: Resubscribe every setup twitch callback. Useful for domain changes")
-    async def resubscribe_twitch(self, ctx: ApplicationCustomContext):
+    @resubscribe.sub_command(name="twitch", description="Owner Only: Repair every setup twitch subscription. Useful for domain changes")
+    async def resubscribe_twitch(self, ctx: ApplicationCustomContext,
+                                 dry_run: bool = commands.Param(default=False, description="Only report what would be changed")):
         await ctx.response.defer()
-        self.bot.log.info("[Twitch] Running subscription recreation")
-        all_subs = await self.bot.tapi.get_subscriptions()
-        all_ids = [s.id for s in all_subs if s.type in [SubscriptionType.STREAM_ONLINE,
-                                                        SubscriptionType.STREAM_OFFLINE, SubscriptionType.CHANNEL_UPDATE]]
-        for subscription in all_subs:
-            if subscription.type in [SubscriptionType.STREAM_ONLINE, SubscriptionType.STREAM_OFFLINE, SubscriptionType.CHANNEL_UPDATE]:
-                await self.bot.tapi.delete_subscription(subscription.id)
-        async for streamer, callback_info in self.bot.db.async_get_all_callbacks():
-            await asyncio.sleep(0.2)
-            if callback_info.get("online_id", None) is not None and callback_info.get("online_id", None) not in all_ids:
-                self.bot.log.info(
-                    f"Deleting subscriptions for {streamer.display_name}")
-                await self.bot.tapi.delete_subscription(callback_info["online_id"])
-            self.bot.log.info(
-                f"Re-creating subscriptions for {streamer.display_name}")
-            if not callback_info.get("secret"):
-                self.bot.log.warning(
-                    f"Generating secret for {streamer.display_name} (This shouldn't be happening!)")
-                callback_info["secret"] = self.bot.random_string_generator(21)
-                await self.bot.db.write_callback(streamer, callback_info)
-            rj1 = await self.bot.tapi.create_subscription(SubscriptionType.STREAM_ONLINE, streamer=streamer, secret=callback_info["secret"], alert_type=AlertType.status)
-            callback_info["online_id"] = rj1.id
-            await asyncio.sleep(0.2)
-            if callback_info.get("offline_id", None) is not None and callback_info.get("offline_id", None) not in all_ids:
-                await self.bot.tapi.delete_subscription(callback_info["offline_id"])
-            rj2 = await self.bot.tapi.create_subscription(SubscriptionType.STREAM_OFFLINE, streamer=streamer, secret=callback_info["secret"], alert_type=AlertType.status)
-            callback_info["offline_id"] = rj2.id
-            await asyncio.sleep(0.2)
-            if callback_info.get("title_id", None) is not None and callback_info.get("title_id", None) not in all_ids:
-                await self.bot.tapi.delete_subscription(callback_info["title_id"])
-            rj3 = await self.bot.tapi.create_subscription(SubscriptionType.CHANNEL_UPDATE, streamer=streamer, secret=callback_info["secret"], alert_type=AlertType.title)
-            callback_info["title_id"] = rj3.id
-            await self.bot.db.write_callback(streamer, callback_info)
-
-        await ctx.send(f"{self.bot.emotes.success} Recreated live subscriptions!")
+        if self.bot.eventsub_transport == "websocket":
+            # Websocket subscriptions belong to the session, there are no webhook subscriptions to repair
+            websocket = self.bot.get_cog("EventSub Websocket")
+            if websocket is None or not websocket.connected:
+                return await ctx.send(f"{self.bot.emotes.error} Eventsub websocket is not connected!")
+            if not dry_run:
+                await websocket.bind()
+            return await ctx.send(f"{self.bot.emotes.success} {len(websocket.bound)} subscriptions bound to websocket session {websocket.session_id}")
+        reconciler = self.bot.get_cog("Subscription Reconciler")
+        if reconciler is None:
+            return await ctx.send(f"{self.bot.emotes.error} Subscription reconciler is not loaded!")
+        self.bot.log.info(f"[Twitch] Running subscription reconcile{' (dry run)' if dry_run else ''}")
+        # Manual runs also remove subscriptions pointing at old callback urls
+        report = await reconciler.reconcile(dry_run=dry_run, prune_foreign=True)
+        self.bot.log.info(f"[Twitch] Subscription reconcile: {report.summary()}")
+        details = '\n'.join(report.details(limit=10))[:1800]
+        message = f"{self.bot.emotes.success} {report.summary()}"
+        if details:
+            message += f"\n```diff\n{details}\n```"
+        await ctx.send(message)
 
     @resubscribe.sub_command(name="youtube", description="Owner Only: Resubscribe every setup youtube callback. Useful for domain changes")
     async def resubscribe_youtube(self, ctx: ApplicationCustomContext):
         await ctx.response.defer()
         self.bot.log.info("[Youtube] Running subscription recreation")
-        for channel, channel_data in (await self.bot.db.get_all_yt_callbacks()).items():
-            await self.bot.yapi.create_subscription(channel, channel_data["secret"], channel_data["subscription_id"])
+        callbacks = await self.bot.db.get_all_yt_callbacks()
+        results = await self.bot.yapi.create_subscriptions([(channel, channel_data["secret"], channel_data["subscription_id"]) for channel, channel_data in callbacks.items()])
+        failed = []
+        for channel, result in zip(callbacks.keys(), results):
+            if isinstance(result, Exception):
+                self.bot.log.warning(f"[Youtube] Failed to resubscribe {channel.display_name}: {result}")
+                failed.append(channel.display_name)
+                continue
             # Minus a day plus 100 seconds, ensures that the subscription never expires
             timestamp = datetime.utcnow().timestamp() + (LEASE_SECONDS - 86500)
             await self.bot.db.write_yt_callback_expiration(channel, timestamp)
-            await asyncio.sleep(0.25)
 
+        if failed:
+            return await ctx.send(f"{self.bot.emotes.error} Recreated {len(callbacks) - len(failed)}/{len(callbacks)} live subscriptions. Failed: {shorten(', '.join(failed), 1800)}")
         await ctx.send(f"{self.bot.emotes.success} Recreated live subscriptions!")
 
     @commands.slash_command(description="Get a youtube user/channel from their various unique identification. Only one option is required")
@@ -1,15 +1,19 @@
+import asyncio
 from asyncio import sleep
 from collections import deque
-from typing import TYPE_CHECKING, Deque, Generator, Optional, Union
+from copy import deepcopy
+from time import time
+from typing import TYPE_CHECKING, Callable, Generator, Optional, Union
 
 import motor.motor_asyncio
 from disnake import Guild, Role
 from disnake.ext import commands
-from munch import munchify
-from pymongo.errors import ServerSelectionTimeoutError
+from munch import munchify, unmunchify
+from pymongo import ReplaceOne, UpdateOne, monitoring
+from pymongo.errors import ConnectionFailure
 
-from twitchtools.enums import (Callback, ChannelCache, TitleCache,
-                               TitleCallback, YoutubeCallback,
+from twitchtools.enums import (Callback, ChannelCache, RequestPriority,
+                               TitleCache, TitleCallback, YoutubeCallback,
                                YoutubeChannelCache)
 from twitchtools.exceptions import DBConnectionError
 from twitchtools.user import PartialUser, PartialYoutubeUser, User
@@ -17,7 +21,262 @@ from twitchtools.video import YoutubeVideo
 
 if TYPE_CHECKING:
     from main import TwitchCallBackBot
-    from motor.core import AgnosticDatabase
+    from motor.core import AgnosticCursor, AgnosticDatabase
+
+# Callback documents are read and resolved into users this many at a time, the most helix accepts per request
+USER_BATCH_SIZE = 100
+# Buffered writes are flushed this many seconds after the first one, or once this many documents are waiting
+WRITE_WINDOW = 1.0
+WRITE_MAX_PENDING = 500
+# Flushes a buffered write is retried in after failing, before it is dropped
+WRITE_MAX_ATTEMPTS = 5
+# How many connection state changes are kept for /botstatus
+HEALTH_HISTORY = 20
+# How long a database call waits for a lost connection to come back before failing
+RECONNECT_WAIT = 5
+
+
+def _is_safe_key(key) -> bool:
+    # Keys that can't be addressed with a dotted path have their parent field set whole instead
+    return isinstance(key, str) and key != "" and "." not in key and not key.startswith("$")
+
+
+def _diff_fields(old: dict, new: dict, prefix: str, update: dict, unset_missing: bool):
+    for key, value in new.items():
+        path = f"{prefix}{key}"
+        if key not in old:
+            update["$set"][path] = value
+            continue
+        previous = old[key]
+        if previous == value:
+            continue
+        if isinstance(previous, dict) and isinstance(value, dict) and all(_is_safe_key(k) for k in [*previous.keys(), *value.keys()]):
+            _diff_fields(previous, value, f"{path}.", update, True)
+        elif isinstance(previous, list) and isinstance(value, list) and len(value) > len(previous) and value[:len(previous)] == previous:
+            update["$push"][path] = {"$each": value[len(previous):]}
+        else:
+            update["$set"][path] = value
+    if unset_missing:
+        for key in old.keys():
+            if key not in new:
+                update["$unset"][f"{prefix}{key}"] = ""
+
+
+def diff_document(old: dict, new: dict, unset_missing: bool = True) -> dict:
+    """The update operators that turn old into new, changing only the fields that differ.
+    Nested documents are diffed field by field, and lists that only grew are appended to.
+    With unset_missing false, top level fields missing from new are left alone, like a $set of the whole document"""
+    update = {"$set": {}, "$unset": {}, "$push": {}}
+    _diff_fields({k: v for k, v in old.items() if k != "_id"}, {k: v for k, v in new.items() if k != "_id"}, "", update, unset_missing)
+    return {operator: fields for operator, fields in update.items() if fields}
+
+
+class WriteCoalescer:
+    """Buffers document writes, flushing each collection's as one unordered bulk_write.
+    Writes to the same document are combined, with later fields winning, so only its final state is sent"""
+
+    def __init__(self, db: "DB", window: float = WRITE_WINDOW, max_pending: int = WRITE_MAX_PENDING):
+        self.db = db
+        self.window = window
+        self.max_pending = max_pending
+        # Collection: Document ID: (Fields, Replace)
+        self._pending: dict[str, dict[str, tuple[dict, bool]]] = {}
+        # Writes taken by the running flush, still visible to reads until they are written
+        self._flushing: dict[str, dict[str, tuple[dict, bool]]] = {}
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        # (Collection, Document ID): Failed flushes of the document's pending write
+        self._attempts: dict[tuple[str, str], int] = {}
+        self.buffered = 0
+        self.written = 0
+        self.flushes = 0
+        self.retried = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _combine(previous: Optional[tuple[dict, bool]], data: dict, replace: bool) -> tuple[dict, bool]:
+        if previous is None or replace:
+            return data, replace
+        return {**previous[0], **data}, previous[1]
+
+    @property
+    def pending_count(self) -> int:
+        return sum(len(documents) for documents in self._pending.values())
+
+    def add(self, collection: str, _id: str, data: dict, replace: bool):
+        documents = self._pending.setdefault(collection, {})
+        documents[_id] = self._combine(documents.get(_id, None), data, replace)
+        self.buffered += 1
+        self._schedule()
+
+    def _schedule(self):
+        if self.pending_count >= self.max_pending:
+            self.db.bot.loop.create_task(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = self.db.bot.loop.create_task(self._flush_after_window())
+
+    def get(self, collection: str, _id: str) -> Optional[tuple[dict, bool]]:
+        """The fields waiting to be written to a document, and whether they replace it"""
+        pending = self._flushing.get(collection, {}).get(_id, None)
+        if (newer := self._pending.get(collection, {}).get(_id, None)) is not None:
+            pending = self._combine(pending, *newer)
+        return pending
+
+    def ids(self, collection: str) -> set[str]:
+        return set(self._flushing.get(collection, {}).keys()) | set(self._pending.get(collection, {}).keys())
+
+    async def take(self, collection: str, _id: str) -> Optional[tuple[dict, bool]]:
+        """Remove and return the pending write for a document, waiting out a flush already writing it.
+        A write that failed in that flush is back in pending by then, so it is returned too"""
+        if _id in self._flushing.get(collection, {}):
+            async with self._lock:
+                pass
+        self._attempts.pop((collection, _id), None)
+        return self._pending.get(collection, {}).pop(_id, None)
+
+    async def discard(self, collection: str, _id: str):
+        """Drop pending writes for a document about to be deleted"""
+        await self.take(collection, _id)
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+            try:
+                for collection, documents in self._flushing.items():
+                    await self._flush_collection(collection, documents)
+            finally:
+                self._flushing = {}
+
+    async def _flush_collection(self, collection: str, documents: dict[str, tuple[dict, bool]]):
+        requests = [request for _id, (data, replace) in documents.items()
+                    if (request := self.db._write_request(collection, _id, data, replace)) is not None]
+        if requests:
+            try:
+                await self.db._db[collection].bulk_write(requests, ordered=False)
+            except Exception as e:
+                self.db.bot.log.error(f"[Database] Failed to write {len(requests)} buffered {collection} documents: {e}")
+                self._requeue(collection, documents)
+                return
+            self.written += len(requests)
+            self.flushes += 1
+        for _id, (data, replace) in documents.items():
+            self._attempts.pop((collection, _id), None)
+            self.db._written(collection, _id, data, replace)
+
+    def _requeue(self, collection: str, documents: dict[str, tuple[dict, bool]]):
+        """Put the writes of a failed flush back for the next one, under any newer writes to the same documents"""
+        pending = self._pending.setdefault(collection, {})
+        for _id, (data, replace) in documents.items():
+            # It isn't known which writes went through, so each is sent whole next time
+            self.db._snapshot(collection, _id, None)
+            attempts = self._attempts.get((collection, _id), 0) + 1
+            newer = pending.get(_id, None)
+            if newer is not None and newer[1]:
+                # Replaced by a newer write, nothing of this one would be sent anyway
+                self._attempts.pop((collection, _id), None)
+                continue
+            if attempts >= WRITE_MAX_ATTEMPTS:
+                self.db.bot.log.error(f"[Database] Dropping buffered write to {collection} {_id} after {attempts} failed attempts")
+                self._attempts.pop((collection, _id), None)
+                self.dropped += 1
+                continue
+            self._attempts[(collection, _id)] = attempts
+            pending[_id] = (data, replace) if newer is None else self._combine((data, replace), *newer)
+            self.retried += 1
+        if not pending:
+            del self._pending[collection]
+        self._schedule()
+
+    async def close(self):
+        """Flush until nothing is pending, for shutdown. Failed writes are retried until they are dropped"""
+        while self._pending:
+            await self.flush()
+            if self._pending:
+                await asyncio.sleep(self.window)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"pending": self.pending_count, "buffered": self.buffered, "written": self.written, "flushes": self.flushes,
+                "retried": self.retried, "dropped": self.dropped}
+
+
+class DBHealthMonitor(monitoring.ServerHeartbeatListener, monitoring.TopologyListener):
+    """Tracks whether a writable server is reachable from the driver's heartbeats and topology changes.
+    The driver calls these from its monitor threads, so state changes are handed to the event loop"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, on_change: Callable[[bool], None]):
+        self.loop = loop
+        self.on_change = on_change
+        self.up = False
+        self.since = time()
+        # Set while a writable server is reachable
+        self.ready = asyncio.Event()
+        # (Time, Up, Reason)
+        self.history: deque[tuple[float, bool, str]] = deque(maxlen=HEALTH_HISTORY)
+        self.outages = 0
+        self.heartbeats = 0
+        self.failed_heartbeats = 0
+        self.last_error: Optional[str] = None
+
+    def _call_soon(self, func: Callable, *args):
+        try:
+            self.loop.call_soon_threadsafe(func, *args)
+        except RuntimeError:
+            # Loop already closed during shutdown
+            pass
+
+    def started(self, event: monitoring.ServerHeartbeatStartedEvent):
+        pass
+
+    def succeeded(self, event: monitoring.ServerHeartbeatSucceededEvent):
+        self._call_soon(self._heartbeat, None)
+
+    def failed(self, event: monitoring.ServerHeartbeatFailedEvent):
+        self._call_soon(self._heartbeat, str(event.reply))
+
+    def opened(self, event: monitoring.TopologyOpenedEvent):
+        pass
+
+    def description_changed(self, event: monitoring.TopologyDescriptionChangedEvent):
+        description = event.new_description
+        if description.has_writable_server():
+            self._call_soon(self._set_state, True, f"{description.topology_type_name} topology writable")
+        else:
+            self._call_soon(self._set_state, False, f"No writable server in {description.topology_type_name} topology")
+
+    def closed(self, event: monitoring.TopologyClosedEvent):
+        self._call_soon(self._set_state, False, "Client closed")
+
+    def _heartbeat(self, error: Optional[str]):
+        if error is None:
+            self.heartbeats += 1
+        else:
+            self.failed_heartbeats += 1
+            self.last_error = error
+
+    def _set_state(self, up: bool, reason: str):
+        if up == self.up:
+            return
+        self.up = up
+        self.since = time()
+        self.history.append((self.since, up, reason))
+        if up:
+            self.ready.set()
+        else:
+            self.outages += 1
+            self.ready.clear()
+        self.on_change(up)
+
+    @property
+    def stats(self) -> dict[str, Union[bool, int, float, Optional[str]]]:
+        return {"up": self.up, "since": self.since, "outages": self.outages, "heartbeats": self.heartbeats,
+                "failed_heartbeats": self.failed_heartbeats, "last_error": self.last_error}
 
 
 class DB(commands.Cog, name="Database Cog"):
@@ -27,7 +286,21 @@ class DB(commands.Cog, name="Database Cog"):
         self._timeout: int = 5000
         self._uri: str = self.bot.db_connect_uri
         self.bot.db = self
-        self.trying_to_connect = False
+        self._registry_loaded = False
+        # Keeps the ready flag in line with the driver's view of the server, instead of checking on each call
+        self.health = DBHealthMonitor(self.bot.loop, self._health_changed)
+        # Write-through copies of the callback collections, keyed by broadcaster/channel id.
+        # These change rarely, and are read on every webhook
+        self._registry: dict[str, dict[str, dict]] = {
+            "callbacks": {}, "tcallbacks": {}, "yt_callbacks": {}}
+        # Guild ID: IDs of the streamers/channels with alerts in that guild, for each registry collection.
+        # Kept in sync with the guild_ids array on each callback document
+        self._guild_index: dict[str, dict[str, set[str]]] = {collection: {} for collection in self._registry.keys()}
+        # The last known database state of documents this process has read or written, keyed by (collection, id).
+        # Writes only send the fields that differ from it
+        self._snapshots: dict[tuple[str, str], dict] = {}
+        # Writes that can wait, mostly from catchup
+        self.writes = WriteCoalescer(self)
 
     @property
     def is_connected(self) -> bool:
@@ -37,7 +310,7 @@ class DB(commands.Cog, name="Database Cog"):
         self.bot.loop.create_task(self.connect())
 
     def cog_unload(self):
-        if self.is_connected:
+        if hasattr(self, "_mongo"):
             self.bot.log.info("[Database] Disconnecting")
             self.bot._db_ready.clear()
             self._mongo.close()
@@ -47,38 +320,165 @@ class DB(commands.Cog, name="Database Cog"):
         return f"twitchtools-{self.bot.user.id}"
 
     async def connect(self):
-        """Initialise the connection to the database"""
+        """Initialise the connection to the database. The driver reconnects by itself, so this only runs once"""
         await self.bot.wait_until_first_connect()
         self._mongo = motor.motor_asyncio.AsyncIOMotorClient(
-            self._uri, serverSelectionTimeoutMS=self._timeout)
+            self._uri, serverSelectionTimeoutMS=self._timeout, event_listeners=[self.health])
+        db_name = await self.get_db_name()
+        self._db: AgnosticDatabase = self._mongo[db_name]
         failed_attempts = 0
-        self.trying_to_connect = True
-        while not self.is_connected and not self.bot.is_closed():
+        while not self._registry_loaded and not self.bot.is_closed():
             try:
-                await self._mongo.server_info()
-                db_name = await self.get_db_name()
-                self._db: AgnosticDatabase = self._mongo[db_name]
-                self.bot._db_ready.set()
-                self.bot.log.info(f"[Database] Connected ({db_name})")
-            except ServerSelectionTimeoutError as e:
-                self.bot.log.error(f"[Database] Failed to connect! {e._message}")
+                # The driver only starts monitoring the server once an operation needs it
+                await self._load_registry()
+                self._registry_loaded = True
+            except ConnectionFailure as e:
+                self.bot.log.error(f"[Database] Failed to connect! {e}")
                 # Multiply exponentially with max wait of 2 minutes
                 await sleep(min((120, 2**failed_attempts)))
                 failed_attempts += 1
-        self.trying_to_connect = False
+        await self.health.ready.wait()
+        self.bot._db_ready.set()
+        self.bot.log.info(f"[Database] Connected ({db_name})")
+
+    def _health_changed(self, up: bool):
+        if not self._registry_loaded:
+            return
+        if up:
+            if self.health.outages:
+                self.bot.log.info("[Database] Connection restored")
+            self.bot._db_ready.set()
+        else:
+            self.bot.log.warning(f"[Database] Connection lost! {self.health.last_error}")
+            self.bot._db_ready.clear()
+
+    async def _load_registry(self):
+        for collection in self._registry.keys():
+            await self._db[collection].create_index("guild_ids")
+            self._registry[collection] = {d["_id"]: d async for d in self._db[collection].find({})}
+            await self._backfill_guild_ids(collection)
+            self._guild_index[collection] = {}
+            for _id, document in self._registry[collection].items():
+                self._snapshot(collection, _id, document)
+                self._index_guilds(collection, _id, [], document.get("guild_ids", []))
+        self.bot.log.info(
+            f"[Database] Loaded {', '.join(f'{len(r)} {c}' for c, r in self._registry.items())}")
+
+    async def _backfill_guild_ids(self, collection: str):
+        """Add the guild_ids array to callback documents written before it existed, or that were edited by hand"""
+        requests = []
+        for _id, document in self._registry[collection].items():
+            guild_ids = list(document.get("alert_roles", {}).keys())
+            if document.get("guild_ids", None) != guild_ids:
+                document["guild_ids"] = guild_ids
+                requests.append(UpdateOne({"_id": _id}, {"$set": {"guild_ids": guild_ids}}))
+        if requests:
+            await self._db[collection].bulk_write(requests, ordered=False)
+            self.bot.log.info(f"[Database] Backfilled guild_ids for {len(requests)} {collection}")
+
+    @staticmethod
+    def _with_guild_ids(callback: dict) -> dict:
+        if "alert_roles" in callback:
+            callback["guild_ids"] = list(callback["alert_roles"].keys())
+        return callback
+
+    def _index_guilds(self, collection: str, _id: str, old: list[str], new: list[str]):
+        index = self._guild_index[collection]
+        for guild_id in set(old) - set(new):
+            if ids := index.get(guild_id, None):
+                ids.discard(_id)
+                if not ids:
+                    del index[guild_id]
+        for guild_id in set(new) - set(old):
+            index.setdefault(guild_id, set()).add(_id)
+
+    def _registry_guild(self, collection: str, guild_id: Union[int, str]) -> list[dict]:
+        registry = self._registry[collection]
+        return [munchify(registry[_id]) for _id in self._guild_index[collection].get(str(guild_id), set()) if _id in registry]
+
+    def _registry_get(self, collection: str, _id: str):
+        if document := self._registry[collection].get(_id, None):
+            return munchify(document)
+        return None
+
+    def _registry_all(self, collection: str) -> list[dict]:
+        return [munchify(d) for d in self._registry[collection].values()]
+
+    def _registry_update(self, collection: str, _id: str, data: dict):
+        document = self._registry[collection].setdefault(_id, {"_id": _id})
+        old_guilds = document.get("guild_ids", [])
+        document.update(unmunchify(data))
+        self._index_guilds(collection, _id, old_guilds, document.get("guild_ids", []))
+
+    def _registry_replace(self, collection: str, _id: str, data: dict):
+        old_guilds = self._registry[collection].get(_id, {}).get("guild_ids", [])
+        self._registry[collection][_id] = {**unmunchify(data), "_id": _id}
+        self._index_guilds(collection, _id, old_guilds, self._registry[collection][_id].get("guild_ids", []))
+
+    def _registry_delete(self, collection: str, _id: str):
+        if document := self._registry[collection].pop(_id, None):
+            self._index_guilds(collection, _id, document.get("guild_ids", []), [])
+
+    def _snapshot(self, collection: str, _id: str, document: Optional[dict]):
+        if document is None:
+            self._snapshots.pop((collection, _id), None)
+        else:
+            self._snapshots[(collection, _id)] = deepcopy(unmunchify(document))
+
+    def _write_request(self, collection: str, _id: str, data: dict, replace: bool) -> Optional[Union[ReplaceOne, UpdateOne]]:
+        """The upsert sending only the fields changed since the document was last read or written, or None if nothing changed.
+        replace removes fields missing from data, otherwise they are left as they are.
+        Documents with nothing to diff against are sent whole"""
+        base = self._snapshots.get((collection, _id), None)
+        if base is None:
+            if replace:
+                return ReplaceOne({"_id": _id}, data, upsert=True)
+            return UpdateOne({"_id": _id}, {"$set": data}, upsert=True)
+        if update := diff_document(base, data, unset_missing=replace):
+            return UpdateOne({"_id": _id}, update, upsert=True)
+        return None
+
+    def _written(self, collection: str, _id: str, data: dict, replace: bool):
+        base = self._snapshots.get((collection, _id), None)
+        if replace or base is None:
+            self._snapshot(collection, _id, data)
+        else:
+            self._snapshot(collection, _id, {**base, **data})
+
+    async def _write(self, collection: str, _id: str, data: dict, replace: bool = False, buffered: bool = False):
+        """Upsert a document. Buffered writes are batched with others, and are seen by reads of the document until written"""
+        data = {k: v for k, v in unmunchify(data).items() if k != "_id"}
+        if buffered:
+            self.writes.add(collection, _id, data, replace)
+            return
+        # Buffered writes for the document are sent along with this one, so they can't land after it
+        if (pending := await self.writes.take(collection, _id)) is not None:
+            data, replace = self.writes._combine(pending, data, replace)
+        if (request := self._write_request(collection, _id, data, replace)) is not None:
+            await self._db[collection].bulk_write([request])
+        self._written(collection, _id, data, replace)
+
+    def _with_pending(self, collection: str, _id: str, document: Optional[dict]) -> Optional[dict]:
+        """A document as it will be once its buffered writes are flushed"""
+        if (pending := self.writes.get(collection, _id)) is None:
+            return document
+        data, replace = pending
+        if replace or document is None:
+            return {**deepcopy(data), "_id": _id}
+        return {**document, **deepcopy(data)}
 
     async def check_connect(self):
-        if not self.is_connected and not self.trying_to_connect:
-            self.bot.log.info(f"DB is not connected, reconnecting...")
-            await self.connect()
-            if not self.is_connected:
-                raise DBConnectionError
+        if self.is_connected:
+            return
+        # Every caller waits on the same event, and gives up if the connection doesn't come back quickly
+        try:
+            await asyncio.wait_for(self.bot._db_ready.wait(), RECONNECT_WAIT)
+        except asyncio.TimeoutError:
+            raise DBConnectionError
 
     async def write_access_token(self, token: str):
         await self.check_connect()
-        result = await self._db.token.update_one({"_id": "access_token"}, {"$set": {"token": token}})
-        if result.matched_count == 0:
-            await self._db.token.insert_one({"_id": "access_token", "token": token})
+        await self._write("token", "access_token", {"token": token})
 
     async def get_access_token(self) -> Optional[str]:
         await self.check_connect()
@@ -89,131 +489,154 @@ class DB(commands.Cog, name="Database Cog"):
 
     async def get_callback(self, broadcaster: PartialUser) -> Optional[Callback]:
         await self.check_connect()
-        callback = await self._db.callbacks.find_one({"_id": str(broadcaster.id)})
-        if callback:
-            return munchify(callback)
-        return None
+        return self._registry_get("callbacks", str(broadcaster.id))
 
     async def get_callback_by_id(self, broadcaster_id: Union[int, str]) -> Optional[Callback]:
         await self.check_connect()
-        callback = await self._db.callbacks.find_one({"_id": str(broadcaster_id)})
-        if callback:
-            return munchify(callback)
-        return None
-
-    async def write_callback(self, broadcaster: PartialUser, callback: Callback):
-        await self.check_connect()
-        callback = dict(callback)
-        result = await self._db.callbacks.update_one({"_id": str(broadcaster.id)}, {"$set": callback})
-        if result.matched_count == 0:
-            callback.update({"_id": str(broadcaster.id)})
-            await self._db.callbacks.insert_one(callback)
-
-    async def async_get_all_callbacks(self) -> Generator[tuple[User, Callback], None, None]:
-        await self.check_connect()
-        async for document in self._db.callbacks.find({"_id": {"$exists": True}}):
-            broadcaster = await self.bot.tapi.get_user(user_id=document["_id"])
+        return self._registry_get("callbacks", str(broadcaster_id))
+
+    async def write_callback(self, broadcaster: PartialUser, callback: Callback, buffered: bool = False):
+        await self.check_connect()
+        callback = self._with_guild_ids(dict(callback))
+        await self._write("callbacks", str(broadcaster.id), callback, buffered=buffered)
+        self._registry_update("callbacks", str(broadcaster.id), callback)
+
+    async def _resolve_callback_batches(self, cursor: "AgnosticCursor") -> Generator[tuple[Union[User, PartialUser], dict], None, None]:
+        """Yield each callback document with its broadcaster, looking up a full batch of users at once"""
+        batch = []
+        async for document in cursor.batch_size(USER_BATCH_SIZE):
+            batch.append(document)
+            if len(batch) == USER_BATCH_SIZE:
+                for broadcaster, document in await self._resolve_callback_users(batch):
+                    yield broadcaster, document
+                batch = []
+        if batch:
+            for broadcaster, document in await self._resolve_callback_users(batch):
+                yield broadcaster, document
+
+    async def _resolve_callback_users(self, documents: list[dict]) -> list[tuple[Union[User, PartialUser], dict]]:
+        users = {user.id: user for user in await self.bot.tapi.get_users(user_ids=[d["_id"] for d in documents], priority=RequestPriority.background)}
+        resolved = []
+        for document in documents:
+            broadcaster = users.get(int(document["_id"]), None)
+            if broadcaster is None:
+                # Helix no longer returns banned or deleted accounts, they still need their callbacks handled
+                display_name = document.get("display_name", document["_id"])
+                broadcaster = PartialUser(document["_id"], display_name.lower(), display_name)
+            resolved.append((broadcaster, document))
+        return resolved
+
+    async def async_get_all_callbacks(self) -> Generator[tuple[Union[User, PartialUser], Callback], None, None]:
+        await self.check_connect()
+        async for broadcaster, document in self._resolve_callback_batches(self._db.callbacks.find({"_id": {"$exists": True}})):
             yield broadcaster, munchify(document)
 
     async def get_all_callbacks(self) -> dict[str, Callback]:
         await self.check_connect()
-        cursor = self._db.callbacks.find({"_id": {"$exists": True}})
-        count = await self._db.callbacks.count_documents({})
-        documents = await cursor.to_list(length=count)
-        return {d["_id"]: munchify(d) for d in documents}
+        return {d["_id"]: d for d in self._registry_all("callbacks")}
+
+    async def get_guild_callbacks(self, guild: Guild) -> dict[str, Callback]:
+        await self.check_connect()
+        return {d["_id"]: d for d in self._registry_guild("callbacks", guild.id)}
 
     async def delete_callback(self, broadcaster: PartialUser):
         await self.check_connect()
+        self._registry_delete("callbacks", str(broadcaster.id))
+        await self.writes.discard("callbacks", str(broadcaster.id))
+        self._snapshot("callbacks", str(broadcaster.id), None)
         return await self._db.callbacks.find_one_and_delete({"_id": str(broadcaster.id)})
 
     async def get_title_callback(self, broadcaster: PartialUser) -> Optional[TitleCallback]:
         await self.check_connect()
-        callback = await self._db.tcallbacks.find_one({"_id": str(broadcaster.id)})
-        if callback:
-            return munchify(callback)
-        return None
+        return self._registry_get("tcallbacks", str(broadcaster.id))
 
     async def get_title_callback_by_id(self, broadcaster_id: Union[int, str]) -> Optional[TitleCallback]:
         await self.check_connect()
-        callback = await self._db.tcallbacks.find_one({"_id": str(broadcaster_id)})
-        if callback:
-            return munchify(callback)
-        return None
+        return self._registry_get("tcallbacks", str(broadcaster_id))
 
     async def write_title_callback(self, broadcaster: PartialUser, callback: TitleCallback):
         await self.check_connect()
-        callback = dict(callback)
-        #result = await self._db.tcallbacks.update_one({"_id": str(broadcaster.id)}, {"$set": callback})
-        result = await self._db.tcallbacks.replace_one({"_id": str(broadcaster.id)}, callback)
-        if result.matched_count == 0:
-            callback.update({"_id": str(broadcaster.id)})
-            await self._db.tcallbacks.insert_one(callback)
+        callback = self._with_guild_ids(dict(callback))
+        await self._write("tcallbacks", str(broadcaster.id), callback, replace=True)
+        self._registry_replace("tcallbacks", str(broadcaster.id), callback)
 
-    async def async_get_all_title_callbacks(self) -> Generator[tuple[User, TitleCallback], None, None]:
+    async def async_get_all_title_callbacks(self) -> Generator[tuple[Union[User, PartialUser], TitleCallback], None, None]:
         await self.check_connect()
-        async for document in self._db.tcallbacks.find({"_id": {"$exists": True}}):
-            broadcaster = await self.bot.tapi.get_user(user_id=document["_id"])
+        async for broadcaster, document in self._resolve_callback_batches(self._db.tcallbacks.find({"_id": {"$exists": True}})):
             yield broadcaster, munchify(document)
 
     async def get_all_title_callbacks(self) -> dict[str, TitleCallback]:
         await self.check_connect()
-        cursor = self._db.tcallbacks.find({"_id": {"$exists": True}})
-        count = await self._db.tcallbacks.count_documents({})
-        documents = await cursor.to_list(length=count)
-        return {d["_id"]: munchify(d) for d in documents}
+        return {d["_id"]: d for d in self._registry_all("tcallbacks")}
+
+    async def get_guild_title_callbacks(self, guild: Guild) -> dict[str, TitleCallback]:
+        await self.check_connect()
+        return {d["_id"]: d for d in self._registry_guild("tcallbacks", guild.id)}
 
     async def delete_title_callback(self, broadcaster: PartialUser):
         await self.check_connect()
+        self._registry_delete("tcallbacks", str(broadcaster.id))
+        await self.writes.discard("tcallbacks", str(broadcaster.id))
+        self._snapshot("tcallbacks", str(broadcaster.id), None)
         return await self._db.tcallbacks.find_one_and_delete({"_id": str(broadcaster.id)})
 
     async def get_channel_cache(self, broadcaster: PartialUser) -> ChannelCache:
         await self.check_connect()
         channel_cache = await self._db.ccache.find_one({"_id": str(broadcaster.id)})
+        self._snapshot("ccache", str(broadcaster.id), channel_cache)
+        channel_cache = self._with_pending("ccache", str(broadcaster.id), channel_cache)
         if channel_cache:
             return munchify(channel_cache)
         return munchify({})
 
-    async def write_channel_cache(self, broadcaster: PartialUser, data: Union[ChannelCache, dict]):
+    async def get_channel_caches(self, broadcaster_ids: Optional[list[Union[int, str]]] = None, projection: Optional[dict] = None) -> dict[str, ChannelCache]:
+        """Fetch the channel caches for the given broadcasters (or all of them) in a single query"""
         await self.check_connect()
-        datad = dict(data)
-        result = await self._db.ccache.replace_one({"_id": str(broadcaster.id)}, datad)
-        if result.matched_count == 0:
-            datad.update({"_id": str(broadcaster.id)})
-            await self._db.ccache.insert_one(datad)
+        query = {} if broadcaster_ids is None else {"_id": {"$in": [str(i) for i in broadcaster_ids]}}
+        caches = {d["_id"]: d async for d in self._db.ccache.find(query, projection)}
+        ids = self.writes.ids("ccache") if broadcaster_ids is None else self.writes.ids("ccache") & {str(i) for i in broadcaster_ids}
+        for _id in ids:
+            caches[_id] = self._with_pending("ccache", _id, caches.get(_id, None))
+        return {_id: munchify(d) for _id, d in caches.items()}
+
+    async def write_channel_cache(self, broadcaster: PartialUser, data: Union[ChannelCache, dict], buffered: bool = False):
+        await self.check_connect()
+        await self._write("ccache", str(broadcaster.id), dict(data), replace=True, buffered=buffered)
 
     async def delete_channel_cache(self, broadcaster: PartialUser):
         await self.check_connect()
+        await self.writes.discard("ccache", str(broadcaster.id))
+        self._snapshot("ccache", str(broadcaster.id), None)
         return await self._db.ccache.find_one_and_delete({"_id": str(broadcaster.id)})
 
     async def get_title_cache(self, broadcaster: PartialUser) -> TitleCache:
         await self.check_connect()
         title_cache = await self._db.tcache.find_one({"_id": str(broadcaster.id)})
+        self._snapshot("tcache", str(broadcaster.id), title_cache)
         if title_cache:
             return munchify(title_cache)
         return munchify({"title": "<no title>", "game": "<no game>"})
 
     async def write_title_cache(self, broadcaster: PartialUser, cache: TitleCache):
         await self.check_connect()
-        result = await self._db.tcache.update_one({"_id": str(broadcaster.id)}, {"$set": {"title": cache.title, "game": cache.game}})
-        if result.matched_count == 0:
-            await self._db.tcache.insert_one({"_id": str(broadcaster.id), "title": cache.title, "game": cache.game})
+        await self._write("tcache", str(broadcaster.id), {"title": cache.title, "game": cache.game})
 
     async def delete_title_cache(self, broadcaster: PartialUser):
         await self.check_connect()
+        self._snapshot("tcache", str(broadcaster.id), None)
         return await self._db.tcache.find_one_and_delete({"_id": str(broadcaster.id)})
 
-    async def get_notif_cache(self) -> Deque[str]:
+    async def get_notif_cache(self) -> list:
         await self.check_connect()
         notif_cache = await self._db.ncache.find_one({"_id": "notification_cache"})
+        self._snapshot("ncache", "notification_cache", notif_cache)
         if notif_cache:
-            return deque(notif_cache.get('cache', []), maxlen=10)
-        return deque([], maxlen=10)
+            return notif_cache.get('cache', [])
+        return []
 
-    async def write_notif_cache(self, notif_cache: Deque[str]):
+    async def write_notif_cache(self, notif_cache: list):
         await self.check_connect()
-        result = await self._db.ncache.update_one({"_id": "notification_cache"}, {"$set": {"cache": list(notif_cache)}})
-        if result.matched_count == 0:
-            await self._db.ncache.insert_one({"_id": "notification_cache", "cache": list(notif_cache)})
+        await self._write("ncache", "notification_cache", {"cache": notif_cache})
 
     async def get_manager_role(self, guild: Guild) -> Optional[TitleCache]:
         await self.check_connect()
@@ -224,35 +647,26 @@ class DB(commands.Cog, name="Database Cog"):
 
     async def write_manager_role(self, guild: Guild, role: Role):
         await self.check_connect()
-        result = await self._db.mrole.update_one({"_id": str(guild.id)}, {"$set": {"role_id": role.id}})
-        if result.matched_count == 0:
-            await self._db.mrole.insert_one({"_id": str(guild.id), "role_id": role.id})
+        await self._write("mrole", str(guild.id), {"role_id": role.id})
 
     async def delete_manager_role(self, guild: Guild):
         await self.check_connect()
+        self._snapshot("mrole", str(guild.id), None)
         return await self._db.mrole.find_one_and_delete({"_id": str(guild.id)})
 
     async def get_yt_callback(self, channel: PartialYoutubeUser) -> Optional[YoutubeCallback]:
         await self.check_connect()
-        yt_callback = await self._db.yt_callbacks.find_one({"_id": channel.id})
-        if yt_callback:
-            return munchify(yt_callback)
-        return None
+        return self._registry_get("yt_callbacks", channel.id)
 
     async def get_yt_callback_by_id(self, channel_id: str) -> Optional[YoutubeCallback]:
         await self.check_connect()
-        yt_callback = await self._db.yt_callbacks.find_one({"_id": channel_id})
-        if yt_callback:
-            return munchify(yt_callback)
-        return None
+        return self._registry_get("yt_callbacks", channel_id)
 
-    async def write_yt_callback(self, channel: PartialYoutubeUser, callback: YoutubeCallback):
+    async def write_yt_callback(self, channel: PartialYoutubeUser, callback: YoutubeCallback, buffered: bool = False):
         await self.check_connect()
-        callback = dict(callback)
-        result = await self._db.yt_callbacks.update_one({"_id": channel.id}, {"$set": callback})
-        if result.matched_count == 0:
-            callback.update({"_id": channel.id})
-            await self._db.yt_callbacks.insert_one(callback)
+        callback = self._with_guild_ids(dict(callback))
+        await self._write("yt_callbacks", channel.id, callback, buffered=buffered)
+        self._registry_update("yt_callbacks", channel.id, callback)
 
     async def write_yt_callback_expiration(self, channel: PartialYoutubeUser, timestamp: int):
         await self.check_connect()
@@ -263,62 +677,75 @@ class DB(commands.Cog, name="Database Cog"):
 
     async def get_all_yt_callbacks(self) -> dict[PartialYoutubeUser, YoutubeCallback]:
         await self.check_connect()
-        cursor = self._db.yt_callbacks.find({"_id": {"$exists": True}})
-        count = await self._db.yt_callbacks.count_documents({})
-        documents = await cursor.to_list(length=count)
-        return {PartialYoutubeUser(d["_id"], d["display_name"]): munchify(d) for d in documents}
+        return {PartialYoutubeUser(d["_id"], d["display_name"]): d for d in self._registry_all("yt_callbacks")}
+
+    async def get_guild_yt_callbacks(self, guild: Guild) -> dict[PartialYoutubeUser, YoutubeCallback]:
+        await self.check_connect()
+        return {PartialYoutubeUser(d["_id"], d["display_name"]): d for d in self._registry_guild("yt_callbacks", guild.id)}
 
     async def delete_yt_callback(self, channel: PartialYoutubeUser):
         await self.check_connect()
+        self._registry_delete("yt_callbacks", channel.id)
+        await self.writes.discard("yt_callbacks", channel.id)
+        self._snapshot("yt_callbacks", channel.id, None)
         await self._db.yt_callbacks.find_one_and_delete({"_id": channel.id})
 
     async def get_last_yt_vid(self, channel: PartialYoutubeUser) -> Optional[dict]:
         await self.check_connect()
         cache_data = await self._db.yt_cache.find_one({"_id": channel.id})
+        self._snapshot("yt_cache", channel.id, cache_data)
         if cache_data:
             return cache_data
         return None
 
     async def update_last_yt_vid(self, video: YoutubeVideo):
         await self.check_connect()
-        result = await self._db.yt_cache.replace_one({"_id": video.channel.id}, {"video_id": video.id, "publish_time": video.published_at.timestamp()})
-        if result.matched_count == 0:
-            await self._db.yt_cache.insert_one({"_id": video.channel.id, "video_id": video.id, "publish_time": video.published_at.timestamp()})
+        await self._write("yt_cache", video.channel.id, {"video_id": video.id, "publish_time": video.published_at.timestamp()}, replace=True)
 
     async def get_yt_channel_cache(self, channel: PartialYoutubeUser) -> YoutubeChannelCache:
         await self.check_connect()
         channel_cache = await self._db.yt_ccache.find_one({"_id": channel.id})
+        self._snapshot("yt_ccache", channel.id, channel_cache)
+        channel_cache = self._with_pending("yt_ccache", channel.id, channel_cache)
         if channel_cache:
             return munchify(channel_cache)
         return munchify({})
 
-    async def write_yt_channel_cache(self, channel: PartialYoutubeUser, data: Union[ChannelCache, dict]):
+    async def get_yt_channel_caches(self, channels: Optional[list[PartialYoutubeUser]] = None, projection: Optional[dict] = None) -> dict[str, YoutubeChannelCache]:
+        """Fetch the channel caches for the given channels (or all of them) in a single query"""
+        await self.check_connect()
+        query = {} if channels is None else {"_id": {"$in": [c.id for c in channels]}}
+        caches = {d["_id"]: d async for d in self._db.yt_ccache.find(query, projection)}
+        ids = self.writes.ids("yt_ccache") if channels is None else self.writes.ids("yt_ccache") & {c.id for c in channels}
+        for _id in ids:
+            caches[_id] = self._with_pending("yt_ccache", _id, caches.get(_id, None))
+        return {_id: munchify(d) for _id, d in caches.items()}
+
+    async def write_yt_channel_cache(self, channel: PartialYoutubeUser, data: Union[ChannelCache, dict], buffered: bool = False):
         await self.check_connect()
-        datad = dict(data)
-        result = await self._db.yt_ccache.replace_one({"_id": channel.id}, datad)
-        if result.matched_count == 0:
-            datad.update({"_id": channel.id})
-            await self._db.yt_ccache.insert_one(datad)
+        await self._write("yt_ccache", channel.id, dict(data), replace=True, buffered=buffered)
 
     async def delete_yt_channel_cache(self, channel: PartialYoutubeUser):
         await self.check_connect()
+        await self.writes.discard("yt_ccache", channel.id)
+        self._snapshot("yt_ccache", channel.id, None)
         return await self._db.yt_ccache.find_one_and_delete({"_id": channel.id})
 
     async def get_yt_title_cache(self, channel: PartialYoutubeUser) -> TitleCache:
         await self.check_connect()
         title_cache = await self._db.yt_tcache.find_one({"_id": channel.id})
+        self._snapshot("yt_tcache", channel.id, title_cache)
         if title_cache:
             return munchify(title_cache)
         return munchify({"title": "<no title>"})
 
     async def write_yt_title_cache(self, channel: PartialYoutubeUser, cache: TitleCache):
         await self.check_connect()
-        result = await self._db.yt_tcache.update_one({"_id": channel.id}, {"$set": {"title": cache.title}})
-        if result.matched_count == 0:
-            await self._db.yt_tcache.insert_one({"_id": channel.id, "title": cache.title})
+        await self._write("yt_tcache", channel.id, {"title": cache.title})
 
     async def delete_yt_title_cache(self, channel: PartialYoutubeUser):
         await self.check_connect()
+        self._snapshot("yt_tcache", channel.id, None)
         return await self._db.yt_tcache.find_one_and_delete({"_id": channel.id})
 
 def setup(bot):
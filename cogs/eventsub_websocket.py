@@ -0,0 +1,263 @@
+import asyncio
+import json
+from traceback import format_exception
+from typing import TYPE_CHECKING, Optional
+
+from aiohttp import ClientWebSocketResponse, WSMsgType
+from disnake.ext import commands, tasks
+
+from twitchtools import NotificationCache, PartialUser, SubscriptionType
+from twitchtools.exceptions import SubscriptionLimitExceeded
+
+if TYPE_CHECKING:
+    from main import TwitchCallBackBot
+
+EVENTSUB_WEBSOCKET_URL = "wss://eventsub.wss.twitch.tv/ws"
+# Twitch closes the connection if no subscription is created within 10 seconds of the welcome message
+WELCOME_TIMEOUT = 10
+# Extra time on top of the keepalive timeout before the connection is considered dead
+KEEPALIVE_GRACE = 5
+# Maximum subscriptions being created at the same time
+BIND_CONCURRENCY = 10
+# Twitch allows this many enabled subscriptions on each websocket session
+SESSION_SUBSCRIPTION_LIMIT = 300
+STATUS_TYPES = [SubscriptionType.STREAM_ONLINE, SubscriptionType.STREAM_OFFLINE]
+
+
+class ConnectionLost(Exception):
+    pass
+
+
+class EventSubWebsocket(commands.Cog, name="EventSub Websocket"):
+    """Receives twitch events over an eventsub websocket instead of the webhook server.
+
+    Only runs with eventsub_transport set to websocket. Subscriptions belong to a websocket session,
+    so they are re-bound for every callback whenever a new session is started"""
+
+    def __init__(self, bot):
+        self.bot: TwitchCallBackBot = bot
+        super().__init__()
+        self.url: str = self.bot.eventsub_websocket_url or EVENTSUB_WEBSOCKET_URL
+        self.enabled: bool = self.bot.eventsub_transport == "websocket"
+        self.ws: Optional[ClientWebSocketResponse] = None
+        self.session_id: Optional[str] = None
+        self.keepalive_timeout: int = 10
+        # (Broadcaster ID, type): Subscription ID, for subscriptions bound to the current session
+        self.bound: dict[tuple[str, SubscriptionType], str] = {}
+        self.notif_cache = NotificationCache()
+        self.reconnects = 0
+        # Subscriptions that couldn't be bound because a twitch limit was reached
+        self.unbound = 0
+        self._bind_lock = asyncio.Lock()
+        self._supervisor: Optional[asyncio.Task] = None
+        if self.enabled:
+            if not self.bot.tapi.user_access_token:
+                self.bot.log.critical("[Twitch] The websocket eventsub transport requires user_access_token to be set!")
+            self._supervisor = self.bot.loop.create_task(self.ensure_connection())
+            self.bind_new.start()
+
+    def cog_unload(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+        self.bind_new.cancel()
+        if self.ws is not None:
+            self.bot.loop.create_task(self.ws.close())
+
+    async def close(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+        if self.ws is not None and not self.ws.closed:
+            await self.ws.close()
+
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None and not self.ws.closed and self.session_id is not None
+
+    async def ensure_connection(self):
+        await self.bot.wait_until_ready()
+        await self.bot.wait_until_db_ready()
+        url = self.url
+        previous: Optional[ClientWebSocketResponse] = None
+        failures = 0
+        while True:
+            try:
+                url, previous = await self.run(url, previous)
+                failures = 0
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if isinstance(e, ConnectionLost):
+                    self.bot.log.warning(f"[Twitch] Eventsub websocket lost: {e}")
+                else:
+                    exc = ''.join(format_exception(type(e), e, e.__traceback__))
+                    self.bot.log.error(f"[Twitch] Eventsub websocket ran into an exception:\n{exc}")
+            # Subscriptions of a lost session are removed by twitch, so start over with a new one
+            if previous is not None and not previous.closed:
+                await previous.close()
+            url, previous = self.url, None
+            self.session_id = None
+            failures += 1
+            await asyncio.sleep(min(2 ** failures, 60))
+
+    async def receive(self, ws: ClientWebSocketResponse, timeout: float) -> dict:
+        try:
+            message = await ws.receive(timeout=timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionLost(f"No message received in {timeout} seconds")
+        if message.type in [WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR]:
+            raise ConnectionLost(f"Connection closed with code {ws.close_code}")
+        return json.loads(message.data)
+
+    async def run(self, url: str, previous: Optional[ClientWebSocketResponse] = None) -> tuple[str, ClientWebSocketResponse]:
+        """Connect and read messages until twitch asks to reconnect, returning the url to reconnect to and this connection.
+        previous is the connection being replaced after a reconnect message, and is closed once this one is welcomed"""
+        ws = await self.bot.aSession.ws_connect(url)
+        try:
+            welcome = await self.receive(ws, WELCOME_TIMEOUT)
+            if welcome["metadata"]["message_type"] != "session_welcome":
+                raise ConnectionLost(f"Expected a welcome message, got {welcome['metadata']['message_type']}")
+            session = welcome["payload"]["session"]
+            self.session_id = session["id"]
+            self.keepalive_timeout = session.get("keepalive_timeout_seconds", None) or self.keepalive_timeout
+            self.ws = ws
+            if previous is not None:
+                # Subscriptions carry over to the new session when twitch asks to reconnect
+                await previous.close()
+                self.reconnects += 1
+                self.bot.log.info(f"[Twitch] Eventsub websocket reconnected to session {self.session_id}")
+            else:
+                self.bound = {}
+                self.bot.log.info(f"[Twitch] Eventsub websocket connected with session {self.session_id}")
+                self.bot.loop.create_task(self.bind())
+
+            while True:
+                message = await self.receive(ws, self.keepalive_timeout + KEEPALIVE_GRACE)
+                if reconnect_url := await self.handle_message(message):
+                    return reconnect_url, ws
+        except BaseException:
+            if not ws.closed:
+                await ws.close()
+            raise
+
+    async def handle_message(self, message: dict) -> Optional[str]:
+        """Handle a message, returning the reconnect url if twitch asked to reconnect"""
+        metadata = message["metadata"]
+        message_type = metadata["message_type"]
+        if message_type == "session_keepalive":
+            return None
+        elif message_type == "notification":
+            if metadata["message_id"] in self.notif_cache:
+                self.bot.log.info("[Twitch] Websocket notification duplicate, ignoring")
+                return None
+            self.notif_cache.add(metadata["message_id"])
+            await self.handle_notification(message["payload"])
+        elif message_type == "session_reconnect":
+            self.bot.log.info("[Twitch] Eventsub websocket asked to reconnect")
+            return message["payload"]["session"]["reconnect_url"]
+        elif message_type == "revocation":
+            subscription = message["payload"]["subscription"]
+            self.bot.log.critical(
+                f"Websocket {subscription['type']} subscription revoked for {subscription['condition'].get('broadcaster_user_id')}: {subscription['status']}")
+            for key, subscription_id in list(self.bound.items()):
+                if subscription_id == subscription["id"]:
+                    del self.bound[key]
+        else:
+            self.bot.log.info(f"[Twitch] Unknown websocket message type {message_type}")
+        return None
+
+    async def handle_notification(self, payload: dict):
+        subscription_type = SubscriptionType(payload["subscription"]["type"])
+        event = payload["event"]
+        broadcaster_id = event["broadcaster_user_id"]
+        channel = PartialUser(broadcaster_id, event["broadcaster_user_login"], event["broadcaster_user_name"])
+        if subscription_type == SubscriptionType.CHANNEL_UPDATE:
+            if await self.bot.db.get_callback_by_id(broadcaster_id) is None and await self.bot.db.get_title_callback_by_id(broadcaster_id) is None:
+                return
+            self.bot.log.info(f"[Twitch] Title change notification for {channel.display_name}")
+            self.bot.queue.put_nowait(self.bot.tapi.get_event(payload))
+        elif subscription_type in STATUS_TYPES:
+            if await self.bot.db.get_callback_by_id(broadcaster_id) is None:
+                return
+            self.bot.log.info(f"[Twitch] Twitch notification for {channel.display_name}")
+            # Same shape as webhook notifications, so the enricher handles both
+            self.bot.raw_queue.put_nowait((channel, payload))
+
+    async def get_desired(self) -> list[tuple[str, SubscriptionType]]:
+        callbacks = await self.bot.db.get_all_callbacks()
+        desired = []
+        for broadcaster_id in callbacks.keys():
+            desired += [(broadcaster_id, t) for t in STATUS_TYPES + [SubscriptionType.CHANNEL_UPDATE]]
+        for broadcaster_id in (await self.bot.db.get_all_title_callbacks()).keys():
+            if broadcaster_id not in callbacks:
+                desired.append((broadcaster_id, SubscriptionType.CHANNEL_UPDATE))
+        return desired
+
+    async def bind(self):
+        """Create subscriptions on the current session for every callback missing one, and remove ones no longer needed.
+
+        Twitch allows SESSION_SUBSCRIPTION_LIMIT enabled subscriptions per session, and refuses new ones once the
+        token's max_total_cost is used up. Anything over either limit is left unbound and counted in unbound"""
+        async with self._bind_lock:
+            session_id = self.session_id
+            if session_id is None:
+                return
+            desired = await self.get_desired()
+            # Unbind first, to make room under the session limit
+            desired_keys = set(desired)
+            for key in [key for key in self.bound.keys() if key not in desired_keys]:
+                await self.bot.tapi.delete_websocket_subscription(self.bound.pop(key))
+
+            missing = [key for key in desired if key not in self.bound]
+            attempted = missing[:max(SESSION_SUBSCRIPTION_LIMIT - len(self.bound), 0)]
+            semaphore = asyncio.Semaphore(BIND_CONCURRENCY)
+            limit_reached = asyncio.Event()
+
+            async def create(broadcaster_id: str, subscription_type: SubscriptionType):
+                async with semaphore:
+                    # Once twitch refuses one, the rest would be refused too
+                    if limit_reached.is_set():
+                        raise SubscriptionLimitExceeded()
+                    try:
+                        return await self.bot.tapi.create_websocket_subscription(subscription_type, broadcaster_id, session_id)
+                    except SubscriptionLimitExceeded:
+                        limit_reached.set()
+                        raise
+            results = await asyncio.gather(*[create(*key) for key in attempted], return_exceptions=True)
+            created, failed = 0, 0
+            limited = len(missing) - len(attempted)
+            for key, result in zip(attempted, results):
+                if isinstance(result, SubscriptionLimitExceeded):
+                    limited += 1
+                elif isinstance(result, Exception):
+                    failed += 1
+                    self.bot.log.warning(f"[Twitch] Failed to bind {key[1].value} for {key[0]}: {result}")
+                else:
+                    self.bound[key] = result.id
+                    created += 1
+
+            self.unbound = limited
+            if limited:
+                self.bot.log.warning(
+                    f"[Twitch] {limited} subscriptions left unbound, over the limit of {SESSION_SUBSCRIPTION_LIMIT} per websocket session "
+                    f"or the token's max total cost ({self.bot.tapi.websocket_total_cost}/{self.bot.tapi.websocket_max_total_cost})")
+            if missing:
+                self.bot.log.info(f"[Twitch] Bound {created}/{len(missing)} subscriptions to websocket session {session_id}")
+
+    @tasks.loop(minutes=5)
+    async def bind_new(self):
+        # Picks up streamers added since the session started, and retries failed or revoked subscriptions
+        try:
+            await self.bind()
+        except Exception as e:
+            exc = ''.join(format_exception(type(e), e, e.__traceback__))
+            self.bot.log.error(f"[Twitch] Failed to bind websocket subscriptions:\n{exc}")
+
+    @bind_new.before_loop
+    async def before_bind_new(self):
+        await self.bot.wait_until_ready()
+        await self.bot.wait_until_db_ready()
+
+
+def setup(bot):
+    bot.add_cog(EventSubWebsocket(bot))
@@ -3,7 +3,7 @@ from typing import TYPE_CHECKING
 from disnake import Guild
 from disnake.ext import commands
 
-from twitchtools import YoutubeSubscription
+from twitchtools import PartialUser, YoutubeSubscription
 
 if TYPE_CHECKING:
     from main import TwitchCallBackBot
@@ -22,43 +22,44 @@ class CallbackCleanup(commands.Cog):
     async def on_guild_remove(self, guild: Guild):
         self.bot.log.info(f"Left guild {guild.name} :(")
         await self.bot.wait_until_db_ready()
-        async for streamer, callback_info in self.bot.db.async_get_all_callbacks():
-            if str(guild.id) in callback_info["alert_roles"].keys():
-                del callback_info["alert_roles"][str(guild.id)]
-                if callback_info["alert_roles"] == {}:
-                    self.bot.log.info(
-                        f"{callback_info['display_name']} is no longer enrolled in any alerts, purging callbacks and cache")
-                    await self.bot.tapi.delete_subscription(callback_info['offline_id'])
-                    await self.bot.tapi.delete_subscription(callback_info['online_id'])
-                    await self.bot.tapi.delete_subscription(callback_info['title_id'])
-                    await self.bot.db.delete_channel_cache(streamer)
-                    await self.bot.db.delete_callback(streamer)
-                else:
-                    await self.bot.db.write_callback(streamer, callback_info)
+        # Only this guild's callbacks are read, through the guild index. They are copies, so the loops can change and delete them
+        for broadcaster_id, callback_info in (await self.bot.db.get_guild_callbacks(guild)).items():
+            streamer = PartialUser(broadcaster_id, callback_info["display_name"].lower(), callback_info["display_name"])
+            del callback_info["alert_roles"][str(guild.id)]
+            if callback_info["alert_roles"] == {}:
+                self.bot.log.info(
+                    f"{callback_info['display_name']} is no longer enrolled in any alerts, purging callbacks and cache")
+                # Streamers added with the websocket transport have no webhook subscriptions
+                for field in ["offline_id", "online_id", "title_id"]:
+                    if subscription_id := callback_info.get(field, None):
+                        await self.bot.tapi.delete_subscription(subscription_id)
+                await self.bot.db.delete_channel_cache(streamer)
+                await self.bot.db.delete_callback(streamer)
+            else:
+                await self.bot.db.write_callback(streamer, callback_info)
 
-        for channel, callback_info in (await self.bot.db.get_all_yt_callbacks()).items():
-            if str(guild.id) in callback_info["alert_roles"].keys():
-                del callback_info["alert_roles"][str(guild.id)]
-                if callback_info["alert_roles"] == {}:
-                    self.bot.log.info(
-                        f"{callback_info['display_name']} is no longer enrolled in any alerts, purging callbacks and cache")
-                    subscription = YoutubeSubscription(callback_info["subscription_id"], channel, callback_info["secret"])
-                    await self.bot.yapi.delete_subscription(subscription)
-                    await self.bot.db.delete_yt_channel_cache(channel)
-                    await self.bot.db.delete_yt_callback(channel)
-                else:
-                    await self.bot.db.write_yt_callback(channel, callback_info)
+        for channel, callback_info in (await self.bot.db.get_guild_yt_callbacks(guild)).items():
+            del callback_info["alert_roles"][str(guild.id)]
+            if callback_info["alert_roles"] == {}:
+                self.bot.log.info(
+                    f"{callback_info['display_name']} is no longer enrolled in any alerts, purging callbacks and cache")
+                subscription = YoutubeSubscription(callback_info["subscription_id"], channel, callback_info["secret"])
+                await self.bot.yapi.delete_subscription(subscription)
+                await self.bot.db.delete_yt_channel_cache(channel)
+                await self.bot.db.delete_yt_callback(channel)
+            else:
+                await self.bot.db.write_yt_callback(channel, callback_info)
 
-        async for streamer, callback_info in self.bot.db.async_get_all_title_callbacks():
-            if str(guild.id) in callback_info["alert_roles"].keys():
-                    del callback_info["alert_roles"][str(guild.id)]
-                    if callback_info["alert_roles"] == {}:
-                        self.bot.log.info(
-                            f"{callback_info['display_name']} is no longer enrolled in any alerts, purging callbacks and cache")
-                        await self.bot.db.delete_title_cache(streamer)
-                        await self.bot.db.delete_title_callback(streamer)
-                    else:
-                        await self.bot.db.write_callback(streamer, callback_info)
+        for broadcaster_id, callback_info in (await self.bot.db.get_guild_title_callbacks(guild)).items():
+            streamer = PartialUser(broadcaster_id, callback_info["display_name"].lower(), callback_info["display_name"])
+            del callback_info["alert_roles"][str(guild.id)]
+            if callback_info["alert_roles"] == {}:
+                self.bot.log.info(
+                    f"{callback_info['display_name']} is no longer enrolled in any alerts, purging callbacks and cache")
+                await self.bot.db.delete_title_cache(streamer)
+                await self.bot.db.delete_title_callback(streamer)
+            else:
+                await self.bot.db.write_title_callback(streamer, callback_info)
 
         await self.bot.db.delete_manager_role(guild)
 
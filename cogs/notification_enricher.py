@@ -0,0 +1,100 @@
+import asyncio
+from traceback import format_exception
+from typing import TYPE_CHECKING
+
+from disnake.ext import commands
+
+from twitchtools import AlertOrigin, PartialUser, Stream
+
+if TYPE_CHECKING:
+    from main import TwitchCallBackBot
+
+# How long to wait for further notifications after the first one arrives, so they can share lookups
+BATCH_WINDOW = 0.2
+# Helix accepts up to 100 ids per users/streams request
+BATCH_SIZE = 100
+
+
+class NotificationEnricher(commands.Cog):
+    """Resolves raw stream.online/offline notifications into Stream or User objects for the queue.
+    The webserver acknowledges notifications immediately and leaves the Helix lookups to this cog"""
+
+    def __init__(self, bot):
+        self.bot: TwitchCallBackBot = bot
+        super().__init__()
+        self.bot.loop.create_task(self.ensure_enricher())
+
+    async def ensure_enricher(self):
+        while True:
+            self.enricher_task = self.bot.loop.create_task(self.enricher())
+            try:
+                await asyncio.gather(self.enricher_task, return_exceptions=False)
+            except Exception as e:
+                exc = ''.join(format_exception(type(e), e, e.__traceback__))
+                self.bot.log.error(f"Enricher ran into an exception:\n{exc}")
+
+    async def enricher(self):
+        self.bot.log.debug("Enricher Worker Started")
+        while not self.bot.is_closed():
+            batch: list[tuple[PartialUser, dict]] = [await self.bot.raw_queue.get()]
+            await asyncio.sleep(BATCH_WINDOW)
+            while len(batch) < BATCH_SIZE and not self.bot.raw_queue.empty():
+                batch.append(self.bot.raw_queue.get_nowait())
+            try:
+                await self.enrich(batch)
+            except Exception as e:
+                exc = ''.join(format_exception(type(e), e, e.__traceback__))
+                self.bot.log.error(f"Failed to enrich {len(batch)} notifications:\n{exc}")
+            finally:
+                for _ in batch:
+                    self.bot.raw_queue.task_done()
+
+    async def enrich(self, batch: list[tuple[PartialUser, dict]]):
+        # Live state is read from helix, so only the most recent notification per streamer matters
+        latest: dict[int, tuple[PartialUser, dict]] = {}
+        for channel, data in batch:
+            latest[channel.id] = (channel, data)
+        user_ids = list(latest.keys())
+        # Streamers with working notifications don't need catching up as often
+        if catchup := self.bot.get_cog("Catchup"):
+            for user_id in user_ids:
+                catchup.twitch_schedule.record_push(user_id)
+
+        try:
+            users = {user.id: user for user in await self.bot.tapi.get_users(user_ids=user_ids)}
+            streams = {stream.user.id: stream for stream in await self.bot.tapi.get_streams(user_ids=user_ids, origin=AlertOrigin.callback)}
+            self.bot.log.debug(f"Enriched {len(batch)} notifications for {len(latest)} streamers")
+        except Exception as e:
+            # The notifications were already acknowledged and won't be sent again, so they are queued from their own details
+            self.bot.log.warning(f"[Twitch] Failed to look up {len(latest)} notified streamers, using the notification details instead: {e}")
+            users = {}
+            streams = {user_id: self.stream_from_event(channel, data) for user_id, (channel, data) in latest.items()
+                       if data["subscription"]["type"] == "stream.online"}
+
+        for user_id, (channel, data) in latest.items():
+            # Fall back to the callback details if helix no longer returns the user
+            streamer = users.get(user_id, channel)
+            streamer.origin = AlertOrigin.callback
+            stream = streams.get(user_id, None)
+
+            live = stream is not None
+            if self.bot.web_server.allow_unverified_requests:
+                live = True if data["subscription"]["type"] == "stream.online" else False
+
+            if live:
+                self.bot.queue.put_nowait(stream)
+            else:
+                self.bot.queue.put_nowait(streamer)
+
+    @staticmethod
+    def stream_from_event(channel: PartialUser, data: dict) -> Stream:
+        """A stream built from a stream.online notification alone. The notification has no title or game"""
+        event = data["event"]
+        return Stream(id=event["id"], user_id=channel.id, user_login=channel.login, user_name=channel.display_name, game_id="", game_name="",
+                      type="live", title="", viewer_count=0, started_at=event["started_at"], language="",
+                      thumbnail_url=f"https://static-cdn.jtvnw.net/previews-ttv/live_user_{channel.login}-{{width}}x{{height}}.jpg",
+                      tag_ids=[], tags=[], is_mature=False, origin=AlertOrigin.callback)
+
+
+def setup(bot):
+    bot.add_cog(NotificationEnricher(bot))
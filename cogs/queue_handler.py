@@ -1,6 +1,7 @@
 import asyncio
+from collections import deque
 from traceback import format_exc, format_exception
-from typing import TYPE_CHECKING, Union
+from typing import TYPE_CHECKING, Deque, Union
 
 from disnake.ext import commands
 
@@ -12,16 +13,48 @@ if TYPE_CHECKING:
 
     from .state_manager import StreamStateManager
 
+QueueItem = Union[Stream, User, PartialUser, TitleEvent, YoutubeVideo, YoutubeUser, PartialYoutubeUser]
+
 
 class QueueHandler(commands.Cog):
     def __init__(self, bot):
         self.bot: TwitchCallBackBot = bot
         super().__init__()
+        # Items waiting to be processed, per streamer. Items with the same key are processed in order,
+        # different keys are processed concurrently by the worker pool
+        self.backlog: dict[str, Deque[QueueItem]] = {}
+        # Keys that have items and are not currently held by a worker
+        self.ready_keys: asyncio.Queue[str] = asyncio.Queue()
+        self.worker_count: int = self.bot.queue_workers
         # NEVER ASSIGN A TASK TO A VARIABLE AGAIN MYAAA.
         # Caused a bug that would cause this worker to get stuck with no errors
-        self.bot.loop.create_task(self.ensure_queue())
+        # (The supervisors are only kept so they can be cancelled on unload)
+        self._supervisors = [self.bot.loop.create_task(self.ensure_queue())]
+        for worker_id in range(self.worker_count):
+            self._supervisors.append(self.bot.loop.create_task(self.ensure_worker(worker_id)))
         self.status_cog: StreamStateManager = self.bot.get_cog("StreamStateManager")
 
+    def cog_unload(self):
+        for task in self._supervisors:
+            task.cancel()
+
+    @property
+    def backlog_sizes(self) -> dict[str, int]:
+        return {key: len(items) for key, items in self.backlog.items()}
+
+    def get_key(self, item: QueueItem) -> str:
+        if isinstance(item, Stream):
+            return f"twitch:{item.user.id}"
+        elif isinstance(item, (User, PartialUser)):
+            return f"twitch:{item.id}"
+        elif isinstance(item, TitleEvent):
+            return f"twitch:{item.broadcaster.id}"
+        elif isinstance(item, YoutubeVideo):
+            return f"youtube:{item.channel.id}"
+        elif isinstance(item, (YoutubeUser, PartialYoutubeUser)):
+            return f"youtube:{item.id}"
+        return f"{type(item).__name__}:{id(item)}"
+
     async def ensure_queue(self):
         while True:
             self.queue_task = self.bot.loop.create_task(self.queue_handler())
@@ -31,62 +64,101 @@ class QueueHandler(commands.Cog):
                 exc = ''.join(format_exception(type(e), e, e.__traceback__))
                 self.bot.log.error(f"Queue ran into an exception:\n{exc}")
 
+    async def ensure_worker(self, worker_id: int):
+        while True:
+            worker_task = self.bot.loop.create_task(self.queue_worker(worker_id))
+            try:
+                await asyncio.gather(worker_task, return_exceptions=False)
+            except Exception as e:
+                exc = ''.join(format_exception(type(e), e, e.__traceback__))
+                self.bot.log.error(f"Queue worker {worker_id} ran into an exception:\n{exc}")
+
     async def queue_handler(self):
-        self.bot.log.debug("Queue Worker Started")
+        """Sorts incoming items into the per streamer backlog"""
+        self.bot.log.debug("Queue Dispatcher Started")
         while not self.bot.is_closed():
-            item: Union[Stream, User, PartialUser, TitleEvent, YoutubeVideo, YoutubeUser, PartialYoutubeUser] = await self.bot.queue.get()
-            if isinstance(item, (Stream, YoutubeVideo)):
-                self.bot.log.debug(f"Recieved task with type {type(item).__name__} for {item.user.display_name}")
-            elif isinstance(item, (User, PartialUser, YoutubeUser, PartialYoutubeUser)):
-                self.bot.log.debug(f"Recieved task with type {type(item).__name__} for {item.display_name}")    
-            elif isinstance(item, TitleEvent):
-                self.bot.log.debug(f"Recieved task with type {type(item).__name__} for {item.broadcaster.display_name}")
+            item: QueueItem = await self.bot.queue.get()
+            key = self.get_key(item)
+            if key in self.backlog:
+                # A worker already holds or is waiting to take this key, it will get to this item in order
+                self.backlog[key].append(item)
+                if len(self.backlog[key]) > 1:
+                    self.bot.log.debug(f"Backlog for {key} is now {len(self.backlog[key])}")
             else:
-                self.bot.log.debug(f"Recieved task with type {type(item).__name__}")
+                self.backlog[key] = deque([item])
+                self.ready_keys.put_nowait(key)
+
+    async def queue_worker(self, worker_id: int):
+        self.bot.log.debug(f"Queue Worker {worker_id} Started")
+        while not self.bot.is_closed():
+            key = await self.ready_keys.get()
+            items = self.backlog[key]
+            item = items[0]
+            try:
+                await self.process_item(item)
+            except Exception:
+                self.bot.log.error(f"Queue worker {worker_id} failed to process {type(item).__name__} for {key}:\n{format_exc()}")
+            finally:
+                items.popleft()
+                self.bot.queue.task_done()
+                # Hand the key back rather than draining it here, so one busy streamer can't hold a worker.
+                # Also done when the worker is cancelled, so the streamer's later items aren't stuck behind it
+                if items:
+                    self.ready_keys.put_nowait(key)
+                else:
+                    del self.backlog[key]
+
+    async def process_item(self, item: QueueItem):
+        if isinstance(item, (Stream, YoutubeVideo)):
+            self.bot.log.debug(f"Recieved task with type {type(item).__name__} for {item.user.display_name}")
+        elif isinstance(item, (User, PartialUser, YoutubeUser, PartialYoutubeUser)):
+            self.bot.log.debug(f"Recieved task with type {type(item).__name__} for {item.display_name}")
+        elif isinstance(item, TitleEvent):
+            self.bot.log.debug(f"Recieved task with type {type(item).__name__} for {item.broadcaster.display_name}")
+        else:
+            self.bot.log.debug(f"Recieved task with type {type(item).__name__}")
+        if self.status_cog is None:
+            self.status_cog = self.bot.get_cog("StreamStateManager")
             if self.status_cog is None:
-                self.status_cog = self.bot.get_cog("StreamStatus")
-                if self.status_cog is None:
-                    self.bot.log.critical(
-                        "Unable to find status cog to dispatch events!")
-                    self.bot.queue.task_done()
-            if isinstance(item, Stream):  # Stream online
-                if self.status_cog:
-                    await self.status_cog.on_streamer_online(item)
-                self.bot.dispatch("streamer_online", item)
-
-            elif isinstance(item, (User, PartialUser)):  # Stream offline
-                if self.status_cog:
-                    await self.status_cog.on_streamer_offline(item)
-                self.bot.dispatch("streamer_offline", item)
-
-            elif isinstance(item, TitleEvent):  # Title Change
-                if self.status_cog:
-                    await self.status_cog.on_title_change(item)
-                self.bot.dispatch("title_change", item)
-            
-            elif isinstance(item, YoutubeVideo):
-                if self.status_cog:
-                    await self.status_cog.on_youtube_streamer_online(item)
-                self.bot.dispatch("youtube_streamer_online", item)
-
-            elif isinstance(item, (YoutubeUser, PartialYoutubeUser)):
-                if self.status_cog:
-                    await self.status_cog.on_youtube_streamer_offline(item)
-                self.bot.dispatch("youtube_streamer_offline", item)
+                self.bot.log.critical(
+                    "Unable to find status cog to dispatch events!")
+        if isinstance(item, Stream):  # Stream online
+            if self.status_cog:
+                await self.status_cog.on_streamer_online(item)
+            self.bot.dispatch("streamer_online", item)
 
-            else:
-                self.bot.log.warning(
-                    f"Recieved bad queue object with type \"{type(item).__name__}\"!")
-
-            if isinstance(item, (Stream, YoutubeVideo)):
-                self.bot.log.debug(f"Finished task with type {type(item).__name__} for {item.user.display_name}")
-            elif isinstance(item, (User, PartialUser, YoutubeUser, PartialYoutubeUser)):
-                self.bot.log.debug(f"Finished task with type {type(item).__name__} for {item.display_name}")    
-            elif isinstance(item, TitleEvent):
-                self.bot.log.debug(f"Finished task with type {type(item).__name__} for {item.broadcaster.display_name}")
-            else:
-                self.bot.log.debug(f"Finished task with type {type(item).__name__}")
-            self.bot.queue.task_done()
+        elif isinstance(item, (User, PartialUser)):  # Stream offline
+            if self.status_cog:
+                await self.status_cog.on_streamer_offline(item)
+            self.bot.dispatch("streamer_offline", item)
+
+        elif isinstance(item, TitleEvent):  # Title Change
+            if self.status_cog:
+                await self.status_cog.on_title_change(item)
+            self.bot.dispatch("title_change", item)
+
+        elif isinstance(item, YoutubeVideo):
+            if self.status_cog:
+                await self.status_cog.on_youtube_streamer_online(item)
+            self.bot.dispatch("youtube_streamer_online", item)
+
+        elif isinstance(item, (YoutubeUser, PartialYoutubeUser)):
+            if self.status_cog:
+                await self.status_cog.on_youtube_streamer_offline(item)
+            self.bot.dispatch("youtube_streamer_offline", item)
+
+        else:
+            self.bot.log.warning(
+                f"Recieved bad queue object with type \"{type(item).__name__}\"!")
+
+        if isinstance(item, (Stream, YoutubeVideo)):
+            self.bot.log.debug(f"Finished task with type {type(item).__name__} for {item.user.display_name}")
+        elif isinstance(item, (User, PartialUser, YoutubeUser, PartialYoutubeUser)):
+            self.bot.log.debug(f"Finished task with type {type(item).__name__} for {item.display_name}")
+        elif isinstance(item, TitleEvent):
+            self.bot.log.debug(f"Finished task with type {type(item).__name__} for {item.broadcaster.display_name}")
+        else:
+            self.bot.log.debug(f"Finished task with type {type(item).__name__}")
 
 
 def setup(bot):
@@ -1,5 +1,6 @@
+import asyncio
 from datetime import timedelta
-from time import time
+from time import perf_counter, time
 from typing import TYPE_CHECKING, Union
 
 import disnake
@@ -10,13 +11,16 @@ from disnake.utils import utcnow
 from twitchtools import (AlertOrigin, PartialUser, PartialYoutubeUser, Stream,
                          TitleEvent, User, YoutubeUser, YoutubeVideo,
                          YoutubeVideoType, human_timedelta, Callback, YoutubeCallback)
-from twitchtools.enums import ChannelCache, YoutubeChannelCache
+from twitchtools.enums import (CallbackAlertInfo, ChannelCache,
+                               YoutubeChannelCache)
 
 if TYPE_CHECKING:
     from main import TwitchCallBackBot
 
 TWITCH_PURPLE = 9520895 # Hex #9146FF
 YOUTUBE_RED = 16711680 # Hex FF0000
+# How many guilds are sent live alerts/channels at the same time
+FANOUT_CONCURRENCY = 10
 
 class StreamStateManager(commands.Cog):
     def __init__(self, bot):
@@ -86,6 +90,8 @@ class StreamStateManager(commands.Cog):
     async def on_streamer_offline(self, streamer: Union[User, PartialUser]):
         await self.bot.wait_until_ready()
         await self.bot.wait_until_db_ready()
+        # Catchup queues every streamer, most are already offline
+        if streamer.channel_cache is not None and not self.is_live(streamer.channel_cache): return
         channel_cache = await self.bot.db.get_channel_cache(streamer)
         callback = await self.bot.db.get_callback(streamer)
 
@@ -108,8 +114,8 @@ class StreamStateManager(commands.Cog):
         channel_cache.pop("last_game_update", None)
         channel_cache.pop("last_title_update", None)
 
-        # Update cache
-        await self.bot.db.write_channel_cache(streamer, channel_cache)
+        # Update cache. Catchup can set many streamers offline at once, so their writes are batched
+        await self.bot.db.write_channel_cache(streamer, channel_cache, buffered=streamer.origin == AlertOrigin.catchup)
 
     async def on_youtube_streamer_offline(self, channel: Union[YoutubeUser, PartialYoutubeUser]):
         await self.bot.wait_until_ready()
@@ -131,13 +137,15 @@ class StreamStateManager(commands.Cog):
         channel_cache.is_live = False
         channel_cache.pop("last_update", None)
 
-        # Update cache
-        await self.bot.db.write_yt_channel_cache(channel, channel_cache)
+        # Update cache. Catchup can set many channels offline at once, so their writes are batched
+        await self.bot.db.write_yt_channel_cache(channel, channel_cache, buffered=channel.origin == AlertOrigin.catchup)
 
     async def on_streamer_online(self, stream: Stream):
         await self.bot.wait_until_ready()
         await self.bot.wait_until_db_ready()
 
+        # Catchup queues every live streamer, most are already known to be live
+        if stream.channel_cache is not None and self.is_live(stream.channel_cache): return
         channel_cache = await self.bot.db.get_channel_cache(stream.user)
         callback = await self.bot.db.get_callback(stream.user)
         on_cooldown = self.on_cooldown(channel_cache.get("alert_cooldown", 0))
@@ -242,114 +250,141 @@ class StreamStateManager(commands.Cog):
             return True
 
     async def send_live_alerts_and_channels(self, item: Union[Stream, YoutubeVideo], embed: disnake.Embed, callback: Union[Callback, YoutubeCallback], channel_cache: Union[ChannelCache, YoutubeChannelCache]) -> tuple[list, list]:
-        SelfOverride, DefaultRole, OverrideRole = self.get_overwrites()
         on_cooldown = self.on_cooldown(channel_cache.get("alert_cooldown", 0))
 
-        live_channels = []
-        live_alerts = []
-        reuse_done = False
+        # Work out which guilds get alerts before fanning out, so that alert reuse
+        # is still only done once, by the first guild as it was when sent one by one
+        targets: list[tuple[disnake.Guild, CallbackAlertInfo]] = []
         for guild_id, alert_info in callback.alert_roles.items():
             guild = self.bot.get_guild(int(guild_id))
             if guild is None:
                 continue
-
-            user_escaped = item.user.display_name.replace('_', r'\_')
-
             if isinstance(item, YoutubeVideo):
                 if item.type == YoutubeVideoType.premiere and not alert_info.enable_premieres:
                     continue
-                message = f"{user_escaped} is live on Youtube!"
-                link = f"https://youtube.com/watch?v={item.id}"
-            else:
-                message = f"{user_escaped} is live on Twitch!"
-                link = f"https://twitch.tv/{item.user.username}"
-
-            # Format role mention
-            if alert_info.role_id == "everyone":
-                role_mention = f" {guild.default_role}"
-            elif alert_info.role_id == None:
-                role_mention = ""
-            else:
-                role = guild.get_role(alert_info.role_id)
-                role_mention = f" {role.mention}"
-
-            if not on_cooldown:  # Send live alert if not on alert cooldown, and append channel id and message id to channel cache
-                alert_channel_id = alert_info.get("notif_channel_id", None)
-                alert_channel = self.bot.get_channel(alert_channel_id)
-                if alert_channel is not None:
-                    try:
-                        live_alert = await alert_channel.send(alert_info.get("custom_message", message)+role_mention, embed=embed)
-                        live_alerts.append(
-                            {"channel": live_alert.channel.id, "message": live_alert.id})
-                    except disnake.Forbidden:
-                        pass
-                    except disnake.HTTPException:
-                        pass
-            elif not reuse_done:
-                self.bot.log.debug(
-                    f"Running alert reuse for {item.user.display_name}")
-                if channel_cache.get("reusable_alerts", None) is not None:
-                    for alert in channel_cache.reusable_alerts:
-                        alert_channel_id = alert.get("channel", None)
-                        alert_channel = self.bot.get_channel(alert_channel_id)
-                        if alert_channel is not None:
+            targets.append((guild, alert_info))
+
+        semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+        async def bounded(guild: disnake.Guild, alert_info: CallbackAlertInfo, reuse: bool) -> tuple[list, list]:
+            async with semaphore:
+                start = perf_counter()
+                try:
+                    return await self.send_guild_alert_and_channel(item, embed, guild, alert_info, channel_cache, on_cooldown, reuse)
+                finally:
+                    self.bot.log.debug(
+                        f"Sent alerts for {item.user.display_name} to {guild.name} in {(perf_counter()-start)*1000:.0f}ms")
+
+        # Results come back in the same order as the callback alert roles
+        results = await asyncio.gather(*[bounded(guild, alert_info, reuse=i == 0) for i, (guild, alert_info) in enumerate(targets)], return_exceptions=True)
+
+        live_channels = []
+        live_alerts = []
+        for (guild, _), result in zip(targets, results):
+            if isinstance(result, Exception):
+                self.bot.log.error(
+                    f"Failed sending alerts for {item.user.display_name} to {guild.name}: {type(result).__name__}: {result}")
+                continue
+            guild_channels, guild_alerts = result
+            live_channels += guild_channels
+            live_alerts += guild_alerts
+        return live_channels, live_alerts
+
+    async def send_guild_alert_and_channel(self, item: Union[Stream, YoutubeVideo], embed: disnake.Embed, guild: disnake.Guild, alert_info: CallbackAlertInfo,
+                                           channel_cache: Union[ChannelCache, YoutubeChannelCache], on_cooldown: bool, reuse: bool) -> tuple[list, list]:
+        SelfOverride, DefaultRole, OverrideRole = self.get_overwrites()
+
+        live_channels = []
+        live_alerts = []
+        user_escaped = item.user.display_name.replace('_', r'\_')
+
+        if isinstance(item, YoutubeVideo):
+            message = f"{user_escaped} is live on Youtube!"
+            link = f"https://youtube.com/watch?v={item.id}"
+        else:
+            message = f"{user_escaped} is live on Twitch!"
+            link = f"https://twitch.tv/{item.user.username}"
+
+        # Format role mention
+        if alert_info.role_id == "everyone":
+            role_mention = f" {guild.default_role}"
+        elif alert_info.role_id == None:
+            role_mention = ""
+        else:
+            role = guild.get_role(alert_info.role_id)
+            role_mention = f" {role.mention}"
+
+        if not on_cooldown:  # Send live alert if not on alert cooldown, and append channel id and message id to channel cache
+            alert_channel_id = alert_info.get("notif_channel_id", None)
+            alert_channel = self.bot.get_channel(alert_channel_id)
+            if alert_channel is not None:
+                try:
+                    live_alert = await alert_channel.send(alert_info.get("custom_message", message)+role_mention, embed=embed)
+                    live_alerts.append(
+                        {"channel": live_alert.channel.id, "message": live_alert.id})
+                except disnake.Forbidden:
+                    pass
+                except disnake.HTTPException:
+                    pass
+        elif reuse:
+            self.bot.log.debug(
+                f"Running alert reuse for {item.user.display_name}")
+            if channel_cache.get("reusable_alerts", None) is not None:
+                for alert in channel_cache.reusable_alerts:
+                    alert_channel_id = alert.get("channel", None)
+                    alert_channel = self.bot.get_channel(alert_channel_id)
+                    if alert_channel is not None:
+                        try:
+                            alert_message = await alert_channel.fetch_message(alert.get("message"))
+                        except disnake.NotFound:
+                            pass
+                        else:
                             try:
-                                alert_message = await alert_channel.fetch_message(alert.get("message"))
-                            except disnake.NotFound:
+                                live_alert = await alert_message.edit(content=alert_info.get("custom_message", message)+role_mention, embed=embed)
+                                live_alerts.append(
+                                    {"channel": live_alert.channel.id, "message": live_alert.id})
+                            except disnake.Forbidden:
+                                pass
+                            except disnake.HTTPException:
                                 pass
-                            else:
-                                try:
-                                    user_escaped = item.user.display_name.replace(
-                                        '_', r'\_')
-                                    live_alert = await alert_message.edit(content=alert_info.get("custom_message", message)+role_mention, embed=embed)
-                                    live_alerts.append(
-                                        {"channel": live_alert.channel.id, "message": live_alert.id})
-                                except disnake.Forbidden:
-                                    pass
-                                except disnake.HTTPException:
-                                    pass
-                # Since reuse is all done in the first iteration, don't waste time doing it again
-                reuse_done = True
-
-            match alert_info.mode:
-                case 0:  # Temporary live channel mode
-
-                    # Create channel overrides
-                    NewChannelOverrides = {self.bot.user: SelfOverride}
-                    if alert_info.role_id != "everyone":
-                        NewChannelOverrides[guild.default_role] = DefaultRole
-                    if alert_info.role_id is not None and alert_info.role_id != "everyone":
-                        NewChannelOverrides[role] = OverrideRole
-
-                    # Create temporary channel and add channel id to channel cache
-                    try:
-                        channel = await guild.create_text_channel(f"🔴{item.user.display_name.lower()}", overwrites=NewChannelOverrides, position=0)
-                        if channel:
-                            user_escaped = item.user.display_name.replace(
-                                '_', r'\_')
-                            await channel.send(f"{user_escaped} is live! {link}")
-                            live_channels.append(channel.id)
-                    except disnake.Forbidden:
-                        self.bot.log.warning(
-                            f"Error creating text channels for {item.user.display_name} in guild {guild.name}")
 
-                # Notification is already sent, nothing needed to be done
-                case 1:
-                    pass
+        match alert_info.mode:
+            case 0:  # Temporary live channel mode
 
-                # Permanent channel. Do the same as above, but modify the existing channel, instead of making a new one
-                case 2:
-                    channel = self.bot.get_channel(alert_info["channel_id"])
-                    if channel is not None:
-                        try:
-                            await channel.edit(name="🔴now-live")
-                            live_channels.append(channel.id)
-                        except disnake.Forbidden:
-                            self.bot.log.warning(
-                                f"Error updating channels for {item.user.display_name} in guild {channel.guild.name}")
-                    else:
+                # Create channel overrides
+                NewChannelOverrides = {self.bot.user: SelfOverride}
+                if alert_info.role_id != "everyone":
+                    NewChannelOverrides[guild.default_role] = DefaultRole
+                if alert_info.role_id is not None and alert_info.role_id != "everyone":
+                    NewChannelOverrides[role] = OverrideRole
+
+                # Create temporary channel and add channel id to channel cache
+                try:
+                    channel = await guild.create_text_channel(f"🔴{item.user.display_name.lower()}", overwrites=NewChannelOverrides, position=0)
+                    if channel:
+                        await channel.send(f"{user_escaped} is live! {link}")
+                        live_channels.append(channel.id)
+                except disnake.Forbidden:
+                    self.bot.log.warning(
+                        f"Error creating text channels for {item.user.display_name} in guild {guild.name}")
+
+            # Notification is already sent, nothing needed to be done
+            case 1:
+                pass
+
+            # Permanent channel. Do the same as above, but modify the existing channel, instead of making a new one
+            case 2:
+                channel = self.bot.get_channel(alert_info["channel_id"])
+                if channel is not None:
+                    try:
+                        await channel.edit(name="🔴now-live")
+                        live_channels.append(channel.id)
+                    except disnake.Forbidden:
                         self.bot.log.warning(
-                            f"Persistent channel not found for {item.user.display_name}")
+                            f"Error updating channels for {item.user.display_name} in guild {channel.guild.name}")
+                else:
+                    self.bot.log.warning(
+                        f"Persistent channel not found for {item.user.display_name}")
         return live_channels, live_alerts
 
     async def update_youtube_title(self, video: YoutubeVideo, channel_cache: YoutubeChannelCache):
@@ -0,0 +1,235 @@
+import asyncio
+from traceback import format_exception
+from typing import TYPE_CHECKING, Optional
+
+from disnake.ext import commands, tasks
+
+from twitchtools import (AlertType, PartialUser, RequestPriority, Subscription,
+                         SubscriptionIndex, SubscriptionMethod,
+                         SubscriptionStatus, SubscriptionType)
+
+if TYPE_CHECKING:
+    from main import TwitchCallBackBot
+
+# Subscriptions this bot creates, anything else on the client is left alone
+MANAGED_TYPES = [SubscriptionType.STREAM_ONLINE, SubscriptionType.STREAM_OFFLINE, SubscriptionType.CHANNEL_UPDATE]
+# Subscriptions in any other state will never deliver notifications, and are recreated
+HEALTHY_STATUSES = [SubscriptionStatus.enabled, SubscriptionStatus.verification_pending]
+# Maximum streamers being repaired at the same time. Creating a subscription waits for its confirmation
+RECONCILE_CONCURRENCY = 5
+# Callback document field holding the id of each subscription
+ID_FIELDS = {SubscriptionType.STREAM_ONLINE: "online_id", SubscriptionType.STREAM_OFFLINE: "offline_id", SubscriptionType.CHANNEL_UPDATE: "title_id"}
+
+
+class DesiredSubscription:
+    def __init__(self, streamer: PartialUser, type: SubscriptionType, alert_type: AlertType, secret: Optional[str], callback_url: str, stored_id: Optional[str]):
+        self.streamer = streamer
+        self.type = type
+        self.alert_type = alert_type
+        self.secret = secret
+        self.callback = f"{callback_url}/{alert_type.value}/{streamer.id}"
+        # The subscription id stored on the callback document
+        self.stored_id = stored_id
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} broadcaster_id={self.streamer.id} type={self.type.value}>"
+
+
+class ReconcileReport:
+    def __init__(self, dry_run: bool):
+        self.dry_run = dry_run
+        self.kept = 0
+        self.created: list[DesiredSubscription] = []
+        self.deleted: list[Subscription] = []
+        # Callback documents whose stored subscription ids were corrected
+        self.repaired: list[str] = []
+        self.failed: list[tuple[DesiredSubscription, str]] = []
+
+    @property
+    def changes(self) -> int:
+        return len(self.created) + len(self.deleted) + len(self.repaired)
+
+    def summary(self) -> str:
+        summary = f"{len(self.created)} created, {len(self.deleted)} deleted, {len(self.repaired)} callbacks repaired, {self.kept} already correct"
+        if self.failed:
+            summary += f", {len(self.failed)} failed"
+        return f"Dry run, nothing changed: {summary}" if self.dry_run else summary
+
+    def details(self, limit: int = 15) -> list[str]:
+        lines = []
+        lines += [f"+ {d.type.value} for {d.streamer.display_name}" for d in self.created[:limit]]
+        lines += [f"- {s.type.value} for {s.broadcaster_user_id} ({s.status.value}, {s.callback})" for s in self.deleted[:limit]]
+        lines += [f"! {d.type.value} for {d.streamer.display_name}: {error}" for d, error in self.failed[:limit]]
+        return lines
+
+
+class SubscriptionReconciler(commands.Cog, name="Subscription Reconciler"):
+    """Compares the eventsub subscriptions that should exist for every callback with the ones helix has,
+    and fixes only the differences"""
+
+    def __init__(self, bot):
+        self.bot: TwitchCallBackBot = bot
+        super().__init__()
+        self._lock = asyncio.Lock()
+        self.last_report: Optional[ReconcileReport] = None
+        # Only webhook subscriptions are reconciled, the websocket cog keeps its own subscriptions bound
+        self.enabled: bool = self.bot.eventsub_transport == "webhook"
+        if self.enabled:
+            self.scheduled_reconcile.start()
+
+    def cog_unload(self):
+        self.scheduled_reconcile.cancel()
+
+    @tasks.loop(hours=6)
+    async def scheduled_reconcile(self):
+        try:
+            # Subscriptions pointing somewhere else may belong to another deployment using the same client id
+            report = await self.reconcile(prune_foreign=False)
+        except Exception as e:
+            exc = ''.join(format_exception(type(e), e, e.__traceback__))
+            self.bot.log.error(f"[Twitch] Scheduled subscription reconcile failed:\n{exc}")
+            return
+        if report.changes or report.failed:
+            self.bot.log.info(f"[Twitch] Scheduled subscription reconcile: {report.summary()}")
+
+    @scheduled_reconcile.before_loop
+    async def before_scheduled_reconcile(self):
+        await self.bot.wait_until_ready()
+        await self.bot.wait_until_db_ready()
+
+    async def get_desired(self) -> dict[str, list[DesiredSubscription]]:
+        """Desired subscriptions for every streamer, keyed by broadcaster id"""
+        callback_url = self.bot.tapi.callback_url
+        desired: dict[str, list[DesiredSubscription]] = {}
+        callbacks = await self.bot.db.get_all_callbacks()
+        for broadcaster_id, callback in callbacks.items():
+            streamer = PartialUser(broadcaster_id, callback.display_name.lower(), callback.display_name)
+            desired[broadcaster_id] = [
+                DesiredSubscription(streamer, t, alert_type, callback.get("secret", None), callback_url, callback.get(ID_FIELDS[t], None))
+                for t, alert_type in [(SubscriptionType.STREAM_ONLINE, AlertType.status), (SubscriptionType.STREAM_OFFLINE, AlertType.status),
+                                      (SubscriptionType.CHANNEL_UPDATE, AlertType.title)]
+            ]
+        # Title callbacks only own their subscription when there is no status callback for the streamer
+        for broadcaster_id, title_callback in (await self.bot.db.get_all_title_callbacks()).items():
+            if broadcaster_id in callbacks:
+                continue
+            streamer = PartialUser(broadcaster_id, title_callback.display_name.lower(), title_callback.display_name)
+            desired[broadcaster_id] = [
+                DesiredSubscription(streamer, SubscriptionType.CHANNEL_UPDATE, AlertType.title, title_callback.get("secret", None), callback_url,
+                                    title_callback.get("subscription_id", None))
+            ]
+        return desired
+
+    async def reconcile(self, dry_run: bool = False, prune_foreign: bool = False) -> ReconcileReport:
+        """Create missing subscriptions, delete stale or broken ones, and correct the ids stored on callbacks.
+        prune_foreign also deletes managed subscriptions pointing at other callback urls, such as after a domain change"""
+        async with self._lock:
+            report = ReconcileReport(dry_run)
+            desired = await self.get_desired()
+            actual = SubscriptionIndex([s async for s in self.bot.tapi.iter_subscriptions(priority=RequestPriority.background)
+                                        if s.type in MANAGED_TYPES and s.method == SubscriptionMethod.webhook])
+
+            matched: set[str] = set()
+            missing: dict[str, list[DesiredSubscription]] = {}
+            found: dict[str, dict[SubscriptionType, Subscription]] = {}
+            for broadcaster_id, subscriptions in desired.items():
+                existing = actual.find(broadcaster_id=int(broadcaster_id))
+                for want in subscriptions:
+                    match = next((s for s in existing if s.type == want.type and s.callback == want.callback
+                                  and s.status in HEALTHY_STATUSES and s.id not in matched), None)
+                    if match is None:
+                        missing.setdefault(broadcaster_id, []).append(want)
+                    else:
+                        matched.add(match.id)
+                        found.setdefault(broadcaster_id, {})[want.type] = match
+                        report.kept += 1
+
+            for subscription in actual:
+                if subscription.id in matched:
+                    continue
+                if not prune_foreign and not subscription.callback.startswith(self.bot.tapi.callback_url):
+                    continue
+                report.deleted.append(subscription)
+
+            semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+
+            async def delete(subscription: Subscription):
+                async with semaphore:
+                    await self.bot.tapi.delete_subscription(subscription, priority=RequestPriority.background)
+
+            # Compared against the callbacks get_desired already loaded, so healthy streamers need no further reads
+            repairs = {broadcaster_id for broadcaster_id, subscriptions in desired.items()
+                       if self.needs_repair(subscriptions, found.get(broadcaster_id, {}))}
+
+            async def repair(broadcaster_id: str):
+                async with semaphore:
+                    await self.repair_streamer(broadcaster_id, found.get(broadcaster_id, {}), missing.get(broadcaster_id, []),
+                                               broadcaster_id in repairs, report)
+
+            if not dry_run:
+                results = await asyncio.gather(*[delete(s) for s in report.deleted], return_exceptions=True)
+                for subscription, result in zip(report.deleted, results):
+                    if isinstance(result, Exception):
+                        self.bot.log.warning(f"[Twitch] Failed to delete subscription {subscription.id}: {result}")
+                await asyncio.gather(*[repair(broadcaster_id) for broadcaster_id in missing.keys() | repairs])
+            else:
+                for broadcaster_id in desired.keys():
+                    report.created += missing.get(broadcaster_id, [])
+                    if broadcaster_id in repairs:
+                        report.repaired.append(broadcaster_id)
+
+            self.last_report = report
+            return report
+
+    async def get_stored_ids(self, broadcaster_id: str) -> tuple[Optional[dict], dict[SubscriptionType, Optional[str]]]:
+        """The callback document owning the streamer's subscriptions, and the subscription ids stored on it"""
+        if callback := await self.bot.db.get_callback_by_id(broadcaster_id):
+            return callback, {t: callback.get(field, None) for t, field in ID_FIELDS.items()}
+        if title_callback := await self.bot.db.get_title_callback_by_id(broadcaster_id):
+            return title_callback, {SubscriptionType.CHANNEL_UPDATE: title_callback.get("subscription_id", None)}
+        return None, {}
+
+    @staticmethod
+    def needs_repair(subscriptions: list[DesiredSubscription], found: dict[SubscriptionType, Subscription]) -> bool:
+        """Whether the ids stored on the callback differ from the subscriptions found for it"""
+        return any(want.stored_id != found[want.type].id for want in subscriptions if want.type in found)
+
+    async def repair_streamer(self, broadcaster_id: str, found: dict[SubscriptionType, Subscription], missing: list[DesiredSubscription], repaired: bool, report: ReconcileReport):
+        if not missing and not repaired:
+            return
+        ids = {t: subscription.id for t, subscription in found.items()}
+        # Every subscription of a streamer shares the secret stored on its callback
+        secret = next((want.secret for want in missing if want.secret), None)
+        new_secret = False
+        if missing and not secret:
+            self.bot.log.warning(f"Generating secret for {missing[0].streamer.display_name} (This shouldn't be happening!)")
+            secret = self.bot.random_string_generator(21)
+            new_secret = True
+        results = await self.bot.tapi.create_subscriptions([(want.type, want.streamer, secret, want.alert_type) for want in missing], priority=RequestPriority.background)
+        for want, result in zip(missing, results):
+            if isinstance(result, Exception):
+                report.failed.append((want, str(result)))
+                continue
+            ids[want.type] = result.id
+            report.created.append(want)
+        if repaired:
+            report.repaired.append(broadcaster_id)
+
+        # Re-read the callback, it may have been edited while subscriptions were being created
+        document, stored = await self.get_stored_ids(broadcaster_id)
+        if document is None or (not new_secret and all(stored.get(t, None) == i for t, i in ids.items())):
+            return
+        streamer = PartialUser(broadcaster_id, document["display_name"].lower(), document["display_name"])
+        if new_secret:
+            document["secret"] = secret
+        if SubscriptionType.STREAM_ONLINE in stored:
+            for t, subscription_id in ids.items():
+                document[ID_FIELDS[t]] = subscription_id
+            await self.bot.db.write_callback(streamer, document)
+        else:
+            document["subscription_id"] = ids.get(SubscriptionType.CHANNEL_UPDATE, None)
+            await self.bot.db.write_title_callback(streamer, document)
+
+
+def setup(bot):
+    bot.add_cog(SubscriptionReconciler(bot))
@@ -5,9 +5,9 @@ import hmac
 from typing import TYPE_CHECKING
 
 from aiohttp import web
+from disnake.ext import tasks
 
-from twitchtools import PartialUser, PartialYoutubeUser
-from twitchtools.enums import AlertOrigin
+from twitchtools import NotificationCache, PartialUser, PartialYoutubeUser
 
 if TYPE_CHECKING:
     from main import TwitchCallBackBot
@@ -26,18 +26,44 @@ class RecieverWebServer:
         # TO BE USED ONLY FOR DEBUGGING PURPOSES
         self.allow_unverified_requests: bool = False
 
+        # Message ids are deduplicated in memory, and only persisted periodically
+        self.notif_cache = NotificationCache()
+
     async def start(self):
         runner = web.AppRunner(self.web_server)
         await runner.setup()
         await web.TCPSite(runner, host=self.host, port=self.port).start()
         self.bot.log.info(f"[Webserver] Running on {self.host}:{self.port}")
+        if not self.persist_notif_cache.is_running():
+            self.persist_notif_cache.start()
         return self.web_server
 
+    @tasks.loop(seconds=60)
+    async def persist_notif_cache(self):
+        await self.save_notif_cache()
+
+    @persist_notif_cache.before_loop
+    async def load_notif_cache(self):
+        await self.bot.wait_until_db_ready()
+        self.notif_cache.load(await self.bot.db.get_notif_cache())
+
+    async def save_notif_cache(self):
+        if not self.notif_cache.dirty or not self.bot.db or not self.bot.db.is_connected:
+            return
+        self.notif_cache.dirty = False
+        try:
+            await self.bot.db.write_notif_cache(self.notif_cache.dump())
+        except Exception as e:
+            self.notif_cache.dirty = True
+            self.bot.log.error(f"[Webserver] Failed to persist notification cache: {e}")
+
     async def _info(self, request: web.Request):
         return web.Response(status=200, text=f"Twitch Tools webserver running here")
 
     async def _reciever(self, request: web.Request):
         await self.bot.wait_until_ready()
+        # Callback lookups are served from the DB registry, which is loaded once the DB is ready
+        await self.bot.wait_until_db_ready()
         channel_id = request.match_info["channel_id"]
         callback_type = request.match_info["callback_type"]
         self.bot.log.info(f"[Webserver] {request.method} {callback_type} for {channel_id}")
@@ -50,9 +76,6 @@ class RecieverWebServer:
     async def verify_request(self, request: web.Request, secret: str):
         if self.allow_unverified_requests:
             return True
-        # notif_cache = await get_notif_cache()
-        await self.bot.wait_until_db_ready()
-        notif_cache = await self.bot.db.get_notif_cache()
 
         try:
             message_id = request.headers["Twitch-Eventsub-Message-Id"]
@@ -61,7 +84,7 @@ class RecieverWebServer:
         except KeyError as e:
             self.bot.log.info(f"[Twitch] Request Denied. Missing Key {e}")
             return False
-        if message_id in notif_cache:
+        if message_id in self.notif_cache:
             return None
 
         hmac_message = message_id.encode("utf-8") + timestamp.encode("utf-8") + await request.read()
@@ -74,8 +97,7 @@ class RecieverWebServer:
             return False
         else:
             self.bot.log.debug(f"Received expected signature {signature}")
-        notif_cache.append(message_id)
-        await self.bot.db.write_notif_cache(notif_cache)
+        self.notif_cache.add(message_id)
         return True
 
     async def get_request(self, request: web.Request, callback_type: str, channel_id: str):
@@ -193,22 +215,14 @@ class RecieverWebServer:
         return web.Response(status=202)
 
     async def notification(self, channel: PartialUser, data: dict):
-        streamer = await self.bot.tapi.get_user(user_id=channel.id)
-        streamer.origin = AlertOrigin.callback
-        stream = await self.bot.tapi.get_stream(streamer, origin=AlertOrigin.callback)
-
-        live = stream is not None
-        if self.allow_unverified_requests:
-            live = True if data["subscription"]["type"] == "stream.online" else False
-
-        if live:
-            self.bot.queue.put_nowait(stream)
-        else:
-            self.bot.queue.put_nowait(streamer)
+        # Acknowledge straight away, user and stream lookups are done by the enricher
+        self.bot.raw_queue.put_nowait((channel, data))
 
         return web.Response(status=202)
 
     async def youtube_notification(self, channel: PartialYoutubeUser, data: str):
+        if catchup := self.bot.get_cog("Catchup"):
+            catchup.youtube_schedule.record_push(channel.id)
         video = await self.bot.yapi.parse_video_xml(channel, data)
 
         if video:
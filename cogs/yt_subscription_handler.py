@@ -1,4 +1,3 @@
-from asyncio import sleep
 from datetime import datetime, UTC
 from typing import TYPE_CHECKING
 
@@ -26,19 +25,21 @@ class YTSubscriptionHandler(commands.Cog, name="Youtube Subscription Handler"):
         await self.bot.wait_until_ready()
         await self.bot.wait_until_db_ready()
         self.bot.log.debug("[Youtube] Resubscribing youtube callbacks")
+        expiring: list[tuple[PartialYoutubeUser, YoutubeCallback]] = []
         for channel, channel_data in (await self.bot.db.get_all_yt_callbacks()).items():
             expiry_time = channel_data.get("expiry_time", 0)
             if expiry_time < datetime.now(UTC).timestamp():
                 self.bot.log.info(
                     f"[Youtube] Resubscribing YT channel {channel.display_name}")
-                await self.yt_subscribe(channel, channel_data)
-
-    async def yt_subscribe(self, channel: PartialYoutubeUser, channel_data: YoutubeCallback):
-        await self.bot.yapi.create_subscription(channel, channel_data.secret, channel_data.subscription_id)
-        # Minus a day plus 100 seconds, ensures that the subscription never expires
-        timestamp = datetime.now(UTC).timestamp() + (LEASE_SECONDS - 86500)
-        await self.bot.db.write_yt_callback_expiration(channel, timestamp)
-        await sleep(1)
+                expiring.append((channel, channel_data))
+        results = await self.bot.yapi.create_subscriptions([(channel, channel_data.secret, channel_data.subscription_id) for channel, channel_data in expiring])
+        for (channel, _), result in zip(expiring, results):
+            if isinstance(result, Exception):
+                self.bot.log.warning(f"[Youtube] Failed to resubscribe {channel.display_name}: {result}")
+                continue
+            # Minus a day plus 100 seconds, ensures that the subscription never expires
+            timestamp = datetime.now(UTC).timestamp() + (LEASE_SECONDS - 86500)
+            await self.bot.db.write_yt_callback_expiration(channel, timestamp)
 
 
 def setup(bot):
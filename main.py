@@ -7,7 +7,7 @@ from asyncio import Event, Queue
 from random import choice
 from string import ascii_letters
 from time import time
-from typing import Any, Type, TypeVar, Union
+from typing import Any, Optional, Type, TypeVar, Union
 
 import disnake
 from aiohttp import ClientSession
@@ -34,6 +34,8 @@ class TwitchCallBackBot(commands.InteractionBot):
         super().__init__(intents=intents, command_sync_flags=sync_flags, activity=disnake.Activity(
             type=disnake.ActivityType.listening, name="stream status"))
         self.queue = Queue(maxsize=0)
+        # Raw stream.online/offline notifications, resolved into queue items by the enricher
+        self.raw_queue = Queue(maxsize=0)
 
         self.log: logging.Logger = logging.getLogger("TwitchTools")
         self.log.setLevel(logging.INFO)
@@ -55,14 +57,26 @@ class TwitchCallBackBot(commands.InteractionBot):
         self.web_server = RecieverWebServer(
             self, host=config["webserver_host"], port=config["webserver_port"])
 
+        # How many streamers can have their events processed at the same time
+        self.queue_workers: int = config.get("queue_workers", 8)
+        # Either "webhook" (the webserver) or "websocket" to receive twitch events over an eventsub websocket
+        self.eventsub_transport: str = config.get("eventsub_transport", "webhook")
+        self.eventsub_websocket_url: Optional[str] = config.get("eventsub_websocket_url", None)
+
         self.db_connect_uri = config["mongodb_uri"]
         self._db_ready: Event = Event()
         self.db: DB
 
+        # Created before the extensions, which use them while loading
+        self.tapi = http_twitch(self, **config)
+        self.yapi = http_youtube(self, **config)
+
         # Mongo DB
         self.load_extension("cogs.database")
         # Functions for events
         self.load_extension("cogs.state_manager")
+        # Resolves raw webhook notifications into streams/users for the queue
+        self.load_extension("cogs.notification_enricher")
         # Receives and propogates events
         self.load_extension("cogs.queue_handler")
         # General commands cog
@@ -73,13 +87,15 @@ class TwitchCallBackBot(commands.InteractionBot):
         self.load_extension("cogs.guild_remove_cleanup")
         # Handles catching up state when events may not occur or are missed
         self.load_extension("cogs.catchup")
+        # Repairs twitch eventsub subscriptions that are missing or broken
+        self.load_extension("cogs.subscription_reconciler")
+        # Receives twitch events over an eventsub websocket, if enabled
+        self.load_extension("cogs.eventsub_websocket")
         # Resubscribes expired channel subscriptions
         self.load_extension("cogs.yt_subscription_handler")
         # Just garbage, maybe I will fix this one day
         self.load_extension("cogs.emotes_sync")
 
-        self.tapi = http_twitch(self, **config)
-        self.yapi = http_youtube(self, **config)
         self.token = config["bot_token"]
         self.colour = disnake.Colour.from_rgb(128, 0, 128)
         self.emotes = Emotes
@@ -100,6 +116,13 @@ class TwitchCallBackBot(commands.InteractionBot):
         await self._db_ready.wait()
 
     async def close(self):
+        self.web_server.persist_notif_cache.cancel()
+        await self.web_server.save_notif_cache()
+        if websocket := self.get_cog("EventSub Websocket"):
+            await websocket.close()
+        if self.db is not None and self.db.is_connected:
+            # Write anything still buffered before the connection goes
+            await self.db.writes.close()
         if not self.aSession.closed:
             await self.aSession.close()
         await self.tapi.close_session()
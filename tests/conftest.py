@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The bot is run from the repository root, so its packages are imported from there
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
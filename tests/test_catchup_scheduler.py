@@ -0,0 +1,50 @@
+import twitchtools.catchup_scheduler as catchup_scheduler
+from twitchtools.catchup_scheduler import (IDLE_WINDOW, PUSH_RELAX,
+                                           RECENT_WINDOW, TWITCH_INTERVALS,
+                                           CatchupScheduler, CatchupTier)
+
+NOW = 100 * 86400
+
+
+def scheduler(monkeypatch, now: list[float]) -> CatchupScheduler:
+    monkeypatch.setattr(catchup_scheduler, "time", lambda: now[0])
+    return CatchupScheduler(TWITCH_INTERVALS)
+
+
+def test_tiers_from_live_history(monkeypatch):
+    schedule = scheduler(monkeypatch, [NOW])
+    assert schedule.tier({"is_live": True}) == CatchupTier.live
+    assert schedule.tier({"alert_cooldown": NOW - RECENT_WINDOW + 1}) == CatchupTier.recent
+    assert schedule.tier({"alert_cooldown": NOW - IDLE_WINDOW + 1}) == CatchupTier.idle
+    assert schedule.tier({"alert_cooldown": NOW - IDLE_WINDOW - 1}) == CatchupTier.dormant
+    assert schedule.tier({}) == CatchupTier.dormant
+
+
+def test_everything_is_due_on_first_run(monkeypatch):
+    schedule = scheduler(monkeypatch, [NOW])
+    caches = {"1": {"is_live": True}, "2": {}}
+    assert schedule.due(caches) == ["1", "2"]
+    assert schedule.stats == {"tracked": 0, "polled": 2, "skipped": 0}
+
+
+def test_channels_are_due_after_their_tier_interval(monkeypatch):
+    now = [NOW]
+    schedule = scheduler(monkeypatch, now)
+    caches = {"live": {"is_live": True}, "dormant": {}}
+    schedule.record_poll(list(caches.keys()))
+    now[0] += TWITCH_INTERVALS[CatchupTier.live]
+    assert schedule.due(caches) == ["live"]
+    schedule.record_poll(["live"])
+    now[0] = NOW + TWITCH_INTERVALS[CatchupTier.dormant] - 1
+    assert schedule.due(caches) == ["live"]
+    now[0] += 1
+    assert schedule.due(caches) == ["live", "dormant"]
+    assert schedule.stats == {"tracked": 2, "polled": 4, "skipped": 2}
+
+
+def test_push_activity_relaxes_offline_channels_only(monkeypatch):
+    schedule = scheduler(monkeypatch, [NOW])
+    schedule.record_push("1")
+    assert schedule.interval("1", {}) == TWITCH_INTERVALS[CatchupTier.dormant] * PUSH_RELAX
+    assert schedule.interval("1", {"is_live": True}) == TWITCH_INTERVALS[CatchupTier.live]
+    assert schedule.interval("2", {}) == TWITCH_INTERVALS[CatchupTier.dormant]
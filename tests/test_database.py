@@ -0,0 +1,168 @@
+"""Tests the field diffing, write buffering and snapshot handling of the database cog against an in-memory collection"""
+import asyncio
+import logging
+
+from pymongo import ReplaceOne, UpdateOne
+
+import cogs.database as database
+from cogs.database import DB, diff_document
+from twitchtools.user import PartialUser, PartialYoutubeUser
+
+CALLBACK = {"display_name": "Streamer", "channels": {"10": {"alert_role": None}}, "alert_roles": {"100": {"mode": 0}}}
+
+
+class MockCollection:
+    def __init__(self):
+        self.requests: list = []
+        self.deleted: list = []
+        # Failures to raise from the next bulk_write calls
+        self.failures = 0
+
+    async def bulk_write(self, requests: list, ordered: bool = True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("write failed")
+        self.requests.extend(requests)
+
+    async def find_one_and_delete(self, query: dict):
+        self.deleted.append(query["_id"])
+
+
+class MockDatabase(dict):
+    def __missing__(self, collection: str) -> MockCollection:
+        self[collection] = MockCollection()
+        return self[collection]
+
+    def __getattr__(self, collection: str) -> MockCollection:
+        return self[collection]
+
+
+class MockBot:
+    db_connect_uri = "mongodb://localhost"
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.log = logging.getLogger("TwitchTools")
+        self._db_ready = asyncio.Event()
+        self._db_ready.set()
+
+
+def run(scenario):
+    async def main():
+        bot = MockBot()
+        db = DB(bot)
+        db._db = MockDatabase()
+        db._registry_loaded = True
+        await scenario(db)
+    asyncio.run(main())
+
+
+def test_diff_document_sets_only_changed_fields():
+    old = {"_id": "1", "title": "a", "game": "b", "alert_roles": {"100": {"mode": 0}}, "tags": ["x"]}
+    new = {"title": "c", "game": "b", "alert_roles": {"100": {"mode": 1}}, "tags": ["x", "y"]}
+    assert diff_document(old, new) == {"$set": {"title": "c", "alert_roles.100.mode": 1}, "$push": {"tags": {"$each": ["y"]}}}
+    assert diff_document(old, {**old}) == {}
+
+
+def test_diff_document_unset_missing():
+    old = {"_id": "1", "title": "a", "game": "b"}
+    assert diff_document(old, {"title": "a"}) == {"$unset": {"game": ""}}
+    assert diff_document(old, {"title": "a"}, unset_missing=False) == {}
+
+
+def test_diff_document_sets_unsafe_keys_whole():
+    old = {"channels": {"a.b": 1}}
+    new = {"channels": {"a.b": 2}}
+    assert diff_document(old, new) == {"$set": {"channels": {"a.b": 2}}}
+
+
+def test_write_without_snapshot_sends_whole_document():
+    async def scenario(db: DB):
+        broadcaster = PartialUser("1", "streamer", "Streamer")
+        await db.write_callback(broadcaster, CALLBACK)
+        await db.write_channel_cache(broadcaster, {"is_live": False})
+        assert db._db.callbacks.requests == [UpdateOne({"_id": "1"}, {"$set": {**CALLBACK, "guild_ids": ["100"]}}, upsert=True)]
+        assert db._db.ccache.requests == [ReplaceOne({"_id": "1"}, {"is_live": False}, upsert=True)]
+
+    run(scenario)
+
+
+def test_write_sends_only_changes_since_snapshot():
+    async def scenario(db: DB):
+        broadcaster = PartialUser("1", "streamer", "Streamer")
+        await db.write_callback(broadcaster, CALLBACK)
+        await db.write_callback(broadcaster, CALLBACK)
+        await db.write_callback(broadcaster, {**CALLBACK, "secret": "b"})
+        assert db._db.callbacks.requests[1:] == [UpdateOne({"_id": "1"}, {"$set": {"secret": "b"}}, upsert=True)]
+
+    run(scenario)
+
+
+def test_readding_after_delete_sends_whole_document():
+    async def scenario(db: DB):
+        broadcaster = PartialUser("1", "streamer", "Streamer")
+        channel = PartialYoutubeUser("UC1", "Channel")
+        await db.write_callback(broadcaster, {**CALLBACK, "secret": "a"})
+        await db.write_title_callback(broadcaster, CALLBACK)
+        await db.write_yt_callback(channel, CALLBACK)
+        await db.delete_callback(broadcaster)
+        await db.delete_title_callback(broadcaster)
+        await db.delete_yt_callback(channel)
+        await db.write_callback(broadcaster, {**CALLBACK, "secret": "b"})
+        await db.write_title_callback(broadcaster, CALLBACK)
+        await db.write_yt_callback(channel, CALLBACK)
+        document = {**CALLBACK, "guild_ids": ["100"]}
+        assert db._db.callbacks.requests[-1] == UpdateOne({"_id": "1"}, {"$set": {**document, "secret": "b"}}, upsert=True)
+        assert db._db.tcallbacks.requests[-1] == ReplaceOne({"_id": "1"}, document, upsert=True)
+        assert db._db.yt_callbacks.requests[-1] == UpdateOne({"_id": "UC1"}, {"$set": document}, upsert=True)
+
+    run(scenario)
+
+
+def test_buffered_writes_are_combined_and_visible_to_reads():
+    async def scenario(db: DB):
+        broadcaster = PartialUser("1", "streamer", "Streamer")
+        db.writes.window = 0
+        await db.write_channel_cache(broadcaster, {"is_live": True, "live_id": "5"}, buffered=True)
+        await db.write_channel_cache(broadcaster, {"is_live": False}, buffered=True)
+        assert db._with_pending("ccache", "1", None) == {"_id": "1", "is_live": False}
+        await db.writes.flush()
+        assert db._db.ccache.requests == [ReplaceOne({"_id": "1"}, {"is_live": False}, upsert=True)]
+        assert db.writes.stats["written"] == 1
+
+    run(scenario)
+
+
+def test_failed_flush_is_retried_under_newer_writes():
+    async def scenario(db: DB):
+        broadcaster = PartialUser("1", "streamer", "Streamer")
+        db.writes.window = 0
+        db._db.callbacks.failures = 1
+        await db.write_callback(broadcaster, CALLBACK, buffered=True)
+        await db.writes.flush()
+        assert db._db.callbacks.requests == []
+        await db.write_callback(broadcaster, {"secret": "b"}, buffered=True)
+        await db.writes.flush()
+        # The failed write is sent whole, with the newer field merged over it
+        assert db._db.callbacks.requests == [
+            UpdateOne({"_id": "1"}, {"$set": {**CALLBACK, "guild_ids": ["100"], "secret": "b"}}, upsert=True)]
+        assert db.writes.stats["retried"] == 1
+        assert db.writes.pending_count == 0
+
+    run(scenario)
+
+
+def test_failed_flush_is_dropped_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(database, "WRITE_MAX_ATTEMPTS", 2)
+
+    async def scenario(db: DB):
+        broadcaster = PartialUser("1", "streamer", "Streamer")
+        db.writes.window = 0
+        db._db.ccache.failures = 2
+        await db.write_channel_cache(broadcaster, {"is_live": True}, buffered=True)
+        await db.writes.close()
+        assert db._db.ccache.requests == []
+        assert db.writes.stats["dropped"] == 1
+        assert db.writes.pending_count == 0
+
+    run(scenario)
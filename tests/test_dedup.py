@@ -0,0 +1,53 @@
+import twitchtools.dedup as dedup
+from twitchtools.dedup import NotificationCache
+
+
+def test_seen_ids_are_found():
+    cache = NotificationCache()
+    assert "a" not in cache
+    cache.add("a")
+    assert "a" in cache
+    assert cache.stats == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_oldest_ids_are_evicted_past_maxlen():
+    cache = NotificationCache(maxlen=3)
+    for message_id in ["a", "b", "c", "d"]:
+        cache.add(message_id)
+    assert len(cache) == 3
+    assert "a" not in cache
+    assert "d" in cache
+
+
+def test_ids_expire_after_max_age(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dedup, "time", lambda: now[0])
+    cache = NotificationCache(max_age=600)
+    cache.add("a")
+    now[0] += 300
+    cache.add("b")
+    now[0] += 301
+    assert "a" not in cache
+    assert "b" in cache
+    assert len(cache) == 1
+
+
+def test_adding_a_seen_id_keeps_its_first_timestamp():
+    cache = NotificationCache()
+    cache.add("a", 1.0)
+    cache.add("a", 2.0)
+    assert cache._ring[0] == ("a", 1.0)
+    assert len(cache) == 1
+
+
+def test_dump_and_load_round_trip(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dedup, "time", lambda: now[0])
+    cache = NotificationCache()
+    cache.add("a")
+    cache.add("b")
+    restored = NotificationCache()
+    # Expired entries are dropped, and plain ids from before timestamps were saved count as just seen
+    restored.load([["old", 0], *cache.dump(), "c"])
+    assert restored.dump() == [["a", 1000.0], ["b", 1000.0], ["c", 1000.0]]
+    assert not restored.dirty
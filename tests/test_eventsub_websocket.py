@@ -0,0 +1,242 @@
+"""Runs the eventsub websocket client against a local mock of twitch's websocket and subscription endpoints"""
+import asyncio
+import json
+import logging
+import uuid
+from typing import Optional
+
+from aiohttp import ClientSession, web
+
+import cogs.eventsub_websocket as eventsub_websocket
+from twitchtools import http_twitch
+
+STREAMER = {"broadcaster_user_id": "1", "broadcaster_user_login": "streamer", "broadcaster_user_name": "Streamer"}
+
+
+def message(message_type: str, payload: dict, message_id: Optional[str] = None) -> str:
+    return json.dumps({"metadata": {"message_id": message_id or str(uuid.uuid4()), "message_type": message_type}, "payload": payload})
+
+
+async def keepalive_forever(ws: web.WebSocketResponse, session_id: str):
+    while not ws.closed:
+        await asyncio.sleep(0.5)
+        await ws.send_str(message("session_keepalive", {}))
+
+
+def subscription(subscription_type: str, broadcaster_id: str, session_id: str) -> dict:
+    return {"id": str(uuid.uuid4()), "status": "enabled", "type": subscription_type, "version": "1",
+            "condition": {"broadcaster_user_id": broadcaster_id}, "created_at": "2024-01-01T00:00:00Z",
+            "transport": {"method": "websocket", "session_id": session_id}, "cost": 1}
+
+
+class MockTwitch:
+    """Serves /ws, /ws-reconnect and /subscriptions. Each test sets the session handlers it needs"""
+
+    def __init__(self):
+        self.sessions = 0
+        self.created: list[tuple[str, str, str]] = []
+        # Subscriptions accepted before every further one gets a 429
+        self.max_subscriptions: Optional[int] = None
+        self.on_session = keepalive_forever
+        self.on_reconnect = keepalive_forever
+        self.port = 0
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/ws", self.websocket)
+        app.router.add_get("/ws-reconnect", self.reconnect_websocket)
+        app.router.add_post("/subscriptions", self.create_subscription)
+        app.router.add_delete("/subscriptions", self.delete_subscription)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    async def welcome(self, request: web.Request, session_id: str) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_str(message("session_welcome", {"session": {"id": session_id, "keepalive_timeout_seconds": 1}}))
+        return ws
+
+    async def websocket(self, request: web.Request):
+        self.sessions += 1
+        ws = await self.welcome(request, f"session-{self.sessions}")
+        await self.on_session(ws, f"session-{self.sessions}")
+        return ws
+
+    async def reconnect_websocket(self, request: web.Request):
+        # Reconnects keep the session, and with it the subscriptions
+        ws = await self.welcome(request, f"session-{self.sessions}")
+        await self.on_reconnect(ws, f"session-{self.sessions}")
+        return ws
+
+    async def create_subscription(self, request: web.Request):
+        data = await request.json()
+        if self.max_subscriptions is not None and len(self.created) >= self.max_subscriptions:
+            return web.json_response({"error": "Too Many Requests", "status": 429, "message": "websocket transport session limit exceeded"}, status=429)
+        session_id = data["transport"]["session_id"]
+        self.created.append((data["type"], data["condition"]["broadcaster_user_id"], session_id))
+        return web.json_response({"data": [subscription(data["type"], data["condition"]["broadcaster_user_id"], session_id)],
+                                  "total": len(self.created), "total_cost": len(self.created), "max_total_cost": 10}, status=202)
+
+    async def delete_subscription(self, request: web.Request):
+        return web.Response(status=204)
+
+
+class MockDB:
+    def __init__(self, callbacks: list[str], title_callbacks: list[str] = []):
+        self.callbacks = {i: {"display_name": i} for i in callbacks}
+        self.title_callbacks = {i: {"display_name": i} for i in title_callbacks}
+
+    async def get_all_callbacks(self):
+        return dict(self.callbacks)
+
+    async def get_all_title_callbacks(self):
+        return dict(self.title_callbacks)
+
+    async def get_callback_by_id(self, broadcaster_id: str):
+        return self.callbacks.get(broadcaster_id, None)
+
+    async def get_title_callback_by_id(self, broadcaster_id: str):
+        return self.title_callbacks.get(broadcaster_id, None)
+
+
+class MockBot:
+    eventsub_transport = "websocket"
+
+    def __init__(self, mock: MockTwitch, db: MockDB):
+        self.loop = asyncio.get_running_loop()
+        self.log = logging.getLogger("TwitchTools")
+        self.queue = asyncio.Queue()
+        self.raw_queue = asyncio.Queue()
+        self.db = db
+        self.eventsub_websocket_url = mock.url("/ws")
+        self.aSession = ClientSession()
+        self.tapi = http_twitch(self, "client_id", "client_secret", "https://localhost/callback",
+                                user_access_token="user_token", eventsub_subscriptions_url=mock.url("/subscriptions"))
+        self.tapi.session = self.aSession
+
+    def add_listener(self, func, name=None):
+        pass
+
+    async def wait_until_ready(self):
+        pass
+
+    async def wait_until_db_ready(self):
+        pass
+
+
+async def wait_for(predicate, timeout: float = 10):
+    async def poll():
+        while not predicate():
+            await asyncio.sleep(0.05)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def run(scenario, db: MockDB, setup=None):
+    async def main():
+        mock = MockTwitch()
+        if setup:
+            setup(mock)
+        await mock.start()
+        bot = MockBot(mock, db)
+        cog = eventsub_websocket.EventSubWebsocket(bot)
+        try:
+            await scenario(mock, bot, cog)
+        finally:
+            cog.cog_unload()
+            await asyncio.sleep(0)
+            await bot.aSession.close()
+            await mock.stop()
+    asyncio.run(main())
+
+
+def test_binds_callbacks_and_drops_duplicate_notifications():
+    async def on_session(ws: web.WebSocketResponse, session_id: str):
+        notification = {"subscription": subscription("stream.online", "1", session_id), "event": STREAMER}
+        await asyncio.sleep(0.3)
+        await ws.send_str(message("notification", notification, "duplicate"))
+        await ws.send_str(message("notification", notification, "duplicate"))
+        await ws.send_str(message("notification", {"subscription": subscription("channel.update", "1", session_id), "event": {
+            **STREAMER, "title": "title", "language": "en", "category_id": "1", "category_name": "game"}}))
+        await keepalive_forever(ws, session_id)
+
+    async def scenario(mock: MockTwitch, bot: MockBot, cog):
+        await wait_for(lambda: len(cog.bound) == 4 and bot.queue.qsize() == 1)
+        # Online, offline and title subscriptions for the streamer, and only a title subscription for the title callback
+        assert sorted((t, b) for t, b, _ in mock.created) == [
+            ("channel.update", "1"), ("channel.update", "2"), ("stream.offline", "1"), ("stream.online", "1")]
+        assert bot.raw_queue.qsize() == 1
+
+    run(scenario, MockDB(["1"], ["2"]), setup=lambda mock: setattr(mock, "on_session", on_session))
+
+
+def test_session_reconnect_keeps_subscriptions():
+    async def on_session(ws: web.WebSocketResponse, session_id: str):
+        await asyncio.sleep(0.5)
+        await ws.send_str(message("session_reconnect", {"session": {"id": session_id, "reconnect_url": reconnect_url[0]}}))
+        # Twitch closes the old connection a while after the new one is welcomed
+        await asyncio.sleep(5)
+
+    # Only known once the mock server is listening
+    reconnect_url = [""]
+
+    def setup(mock: MockTwitch):
+        mock.on_session = on_session
+
+    async def scenario(mock: MockTwitch, bot: MockBot, cog):
+        reconnect_url[0] = mock.url("/ws-reconnect")
+        await wait_for(lambda: cog.reconnects == 1)
+        await asyncio.sleep(0.3)
+        assert cog.connected
+        assert cog.session_id == "session-1"
+        assert mock.sessions == 1
+        # Subscriptions carried over, nothing was created again
+        assert len(mock.created) == 3
+        assert len(cog.bound) == 3
+
+    run(scenario, MockDB(["1"]), setup=setup)
+
+
+def test_keepalive_timeout_starts_new_session_and_rebinds(monkeypatch):
+    monkeypatch.setattr(eventsub_websocket, "KEEPALIVE_GRACE", 0)
+
+    async def silent(ws: web.WebSocketResponse, session_id: str):
+        if session_id == "session-1":
+            # No keepalives, so the client gives up after keepalive_timeout_seconds
+            await asyncio.sleep(10)
+        else:
+            await keepalive_forever(ws, session_id)
+
+    def setup(mock: MockTwitch):
+        mock.on_session = silent
+
+    async def scenario(mock: MockTwitch, bot: MockBot, cog):
+        await wait_for(lambda: cog.session_id == "session-2" and len(cog.bound) == 3, timeout=15)
+        # The lost session's subscriptions are gone, so every subscription is created again on the new one
+        assert [s for _, _, s in mock.created] == ["session-1"] * 3 + ["session-2"] * 3
+
+    run(scenario, MockDB(["1"]), setup=setup)
+
+
+def test_bind_stops_at_twitch_limits(monkeypatch):
+    monkeypatch.setattr(eventsub_websocket, "SESSION_SUBSCRIPTION_LIMIT", 8)
+
+    def setup(mock: MockTwitch):
+        mock.max_subscriptions = 5
+
+    async def scenario(mock: MockTwitch, bot: MockBot, cog):
+        # 4 streamers want 12 subscriptions. 4 are over the session limit and 3 more get a 429
+        await wait_for(lambda: cog.unbound > 0)
+        assert len(cog.bound) == 5
+        assert cog.unbound == 7
+        assert bot.tapi.websocket_total_cost == 5
+
+    run(scenario, MockDB(["1", "2", "3", "4"]), setup=setup)
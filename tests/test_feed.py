@@ -0,0 +1,68 @@
+from twitchtools.feed import parse_feed
+
+CHANNEL_FEED = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns:media="http://search.yahoo.com/mrss/" xmlns="http://www.w3.org/2005/Atom">
+ <title>Channel</title>
+ <author>
+  <name>Channel</name>
+  <uri>https://www.youtube.com/channel/UC1</uri>
+ </author>
+ <entry>
+  <id>yt:video:vid1</id>
+  <yt:videoId>vid1</yt:videoId>
+  <yt:channelId>UC1</yt:channelId>
+  <title>First</title>
+  <author><name>Channel</name></author>
+  <published>2024-01-02T00:00:00+00:00</published>
+  <updated>2024-01-02T01:00:00+00:00</updated>
+ </entry>
+ <entry>
+  <id>yt:video:vid2</id>
+  <yt:videoId>vid2</yt:videoId>
+  <yt:channelId>UC1</yt:channelId>
+  <published>2024-01-01T00:00:00+00:00</published>
+ </entry>
+</feed>"""
+
+DELETED_NOTIFICATION = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:at="http://purl.org/atompub/tombstone/1.0" xmlns="http://www.w3.org/2005/Atom">
+ <at:deleted-entry ref="yt:video:vid3" when="2024-01-03T00:00:00+00:00">
+  <link href="https://www.youtube.com/watch?v=vid3"/>
+ </at:deleted-entry>
+</feed>"""
+
+
+def test_parses_channel_feed():
+    feed = parse_feed(CHANNEL_FEED)
+    assert feed.author_name == "Channel"
+    assert feed.video_ids == ["vid1", "vid2"]
+    first = feed.entries[0]
+    assert first.channel_id == "UC1"
+    assert first.published_at.isoformat() == "2024-01-02T00:00:00+00:00"
+    assert first.updated_at.isoformat() == "2024-01-02T01:00:00+00:00"
+    assert feed.entries[1].updated_at is None
+
+
+def test_parses_bytes_like_text():
+    assert parse_feed(CHANNEL_FEED.encode("utf-8")).video_ids == ["vid1", "vid2"]
+
+
+def test_parses_deleted_entries():
+    feed = parse_feed(DELETED_NOTIFICATION)
+    assert feed.entries == []
+    assert [d.video_id for d in feed.deleted] == ["vid3"]
+    assert feed.deleted[0].deleted_at.isoformat() == "2024-01-03T00:00:00+00:00"
+
+
+def test_skips_entries_without_video_id():
+    feed = parse_feed(CHANNEL_FEED.replace("<yt:videoId>vid2</yt:videoId>", ""))
+    assert feed.video_ids == ["vid1"]
+
+
+def test_does_not_resolve_entities():
+    content = """<?xml version="1.0"?>
+<!DOCTYPE feed [<!ENTITY secret SYSTEM "file:///etc/passwd">]>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+ <entry><yt:videoId>&secret;</yt:videoId></entry>
+</feed>"""
+    assert "root" not in "".join(parse_feed(content).video_ids)
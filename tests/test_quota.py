@@ -0,0 +1,45 @@
+import twitchtools.quota as quota
+from twitchtools.quota import QuotaLedger
+
+
+def test_records_endpoint_costs():
+    ledger = QuotaLedger(daily_limit=1000)
+    ledger.record("videos")
+    ledger.record("search")
+    ledger.record("unknown")
+    ledger.record("videos", cost=5)
+    assert ledger.spent == 107
+    assert ledger.remaining == 893
+    assert ledger.calls == {"videos": 2, "search": 1, "unknown": 1}
+
+
+def test_spend_resets_at_midnight_pacific(monkeypatch):
+    ledger = QuotaLedger()
+    ledger.record("search")
+    reset_at = ledger._reset_at
+    monkeypatch.setattr(quota, "time", lambda: reset_at + 1)
+    assert ledger.remaining == ledger.daily_limit
+    assert ledger.calls == {}
+
+
+def test_projects_spend_to_reset(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(quota, "time", lambda: now[0])
+    ledger = QuotaLedger()
+    ledger._reset_at = 7200
+    now[0] = 3600
+    ledger.record("videos", cost=100)
+    # 100 units in the first hour, and an hour until the reset
+    assert ledger.projected == 200
+
+
+def test_required_interval_spreads_cost_over_remaining_budget(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(quota, "time", lambda: now[0])
+    ledger = QuotaLedger(daily_limit=1000)
+    ledger._reset_at = 3600
+    assert ledger.required_interval(0) == 0
+    # 100 units a run fits 10 runs in the hour left
+    assert ledger.required_interval(100) == 360
+    ledger.record("videos", cost=1000)
+    assert ledger.required_interval(100) == float("inf")
@@ -0,0 +1,78 @@
+import asyncio
+from time import time
+
+from twitchtools.enums import RequestPriority
+from twitchtools.ratelimit import HelixRatelimiter
+
+
+def headers(limit: int, remaining: int, reset_in: float) -> dict[str, str]:
+    return {"Ratelimit-Limit": str(limit), "Ratelimit-Remaining": str(remaining), "Ratelimit-Reset": str(time() + reset_in)}
+
+
+def test_takes_tokens_without_waiting():
+    async def main():
+        limiter = HelixRatelimiter(limit=10, reserve=2)
+        for _ in range(5):
+            await limiter.acquire(RequestPriority.background)
+        assert limiter.remaining == 5
+        assert limiter.waited == 0
+    asyncio.run(main())
+
+
+def test_reserve_is_kept_for_interactive_requests():
+    async def main():
+        limiter = HelixRatelimiter(reserve=2)
+        limiter.update(headers(800, 2, 30))
+        background = asyncio.ensure_future(limiter.acquire(RequestPriority.background))
+        await asyncio.sleep(0)
+        assert not background.done()
+        # Interactive requests can still use the reserve, even with background requests waiting for a token
+        await asyncio.wait_for(limiter.acquire(RequestPriority.interactive), 1)
+        assert limiter.remaining == 1
+        background.cancel()
+    asyncio.run(main())
+
+
+def test_waiters_are_woken_in_priority_order():
+    async def main():
+        limiter = HelixRatelimiter(reserve=0)
+        limiter.update(headers(800, 0, 30))
+        order = []
+
+        async def request(name: str, priority: RequestPriority):
+            await limiter.acquire(priority)
+            order.append(name)
+
+        tasks = [asyncio.ensure_future(request("background", RequestPriority.background)),
+                 asyncio.ensure_future(request("interactive", RequestPriority.interactive))]
+        await asyncio.sleep(0)
+        # The next response refills the bucket
+        limiter.update(headers(800, 2, 30))
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        assert order == ["interactive", "background"]
+        assert limiter.waited == 2
+    asyncio.run(main())
+
+
+def test_waiters_are_woken_at_reset():
+    async def main():
+        limiter = HelixRatelimiter(reserve=0)
+        limiter.update(headers(800, 0, 0.2))
+        await asyncio.wait_for(limiter.acquire(RequestPriority.background), 2)
+        # A new period started, with one token taken
+        assert limiter.remaining == 799
+    asyncio.run(main())
+
+
+def test_retry_after_empties_the_bucket():
+    limiter = HelixRatelimiter()
+    retry_after = limiter.retry_after(headers(800, 10, 5))
+    assert 4 < retry_after <= 5
+    assert limiter.remaining == 0
+    assert limiter.ratelimited == 1
+
+
+def test_ignores_responses_without_ratelimit_headers():
+    limiter = HelixRatelimiter(limit=800)
+    limiter.update({})
+    assert limiter.limit == 800
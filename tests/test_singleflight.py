@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from twitchtools.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*[flight.do("key", fetch) for _ in range(5)])
+        assert results == ["result"] * 5
+        assert len(calls) == 1
+        assert flight.stats == {"calls": 1, "shared": 4, "in_flight": 0}
+        # Finished calls aren't reused
+        await flight.do("key", fetch)
+        assert len(calls) == 2
+    asyncio.run(main())
+
+
+def test_different_keys_run_separately():
+    async def main():
+        flight = SingleFlight()
+
+        async def fetch(value: str):
+            await asyncio.sleep(0.01)
+            return value
+
+        assert await asyncio.gather(flight.do("a", lambda: fetch("a")), flight.do("b", lambda: fetch("b"))) == ["a", "b"]
+        assert flight.calls == 2
+    asyncio.run(main())
+
+
+def test_exceptions_are_shared():
+    async def main():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        results = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert flight.stats["in_flight"] == 0
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    async def main():
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "result"
+
+        first = asyncio.ensure_future(flight.do("key", fetch))
+        second = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "result"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+from twitchtools.enums import SubscriptionType
+from twitchtools.subscription import Subscription, SubscriptionIndex
+
+
+def subscription(subscription_id: str, type: str, broadcaster_id: str) -> Subscription:
+    return Subscription(id=subscription_id, status="enabled", type=type, version=1, condition={"broadcaster_user_id": broadcaster_id},
+                        created_at="2024-01-01T00:00:00Z", transport={"method": "webhook", "callback": "https://example.com"}, cost=1)
+
+
+def test_find_by_type_and_broadcaster():
+    index = SubscriptionIndex([subscription("a", "stream.online", "1"), subscription("b", "stream.offline", "1"),
+                               subscription("c", "stream.online", "2")])
+    assert len(index) == 3
+    assert "a" in index
+    assert {s.id for s in index.find(broadcaster_id=1)} == {"a", "b"}
+    assert {s.id for s in index.find(broadcaster_id="1", type=SubscriptionType.STREAM_ONLINE)} == {"a"}
+    assert {s.id for s in index.find(type=SubscriptionType.STREAM_ONLINE)} == {"a", "c"}
+    assert {s.id for s in index.find()} == {"a", "b", "c"}
+    assert index.find(broadcaster_id=3) == []
+
+
+def test_remove_clears_every_index():
+    index = SubscriptionIndex([subscription("a", "stream.online", "1")])
+    assert index.remove("a").id == "a"
+    assert index.remove("a") is None
+    assert index.get("a") is None
+    assert index.find(broadcaster_id=1) == []
+    assert index.find(type=SubscriptionType.STREAM_ONLINE) == []
+
+
+def test_can_remove_while_iterating():
+    index = SubscriptionIndex([subscription("a", "stream.online", "1"), subscription("b", "stream.online", "2")])
+    for s in index:
+        index.remove(s.id)
+    assert len(index) == 0
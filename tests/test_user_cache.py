@@ -0,0 +1,61 @@
+import twitchtools.user_cache as user_cache
+from twitchtools.user import User
+from twitchtools.user_cache import UserCache
+
+
+def user(user_id: int, login: str) -> User:
+    return User(id=user_id, login=login, display_name=login.title(), type="", broadcaster_type="", description="",
+                profile_image_url="", offline_image_url="", view_count=0, created_at="2024-01-01T00:00:00Z")
+
+
+def test_lookup_by_id_and_login():
+    cache = UserCache()
+    cache.put([user(1, "streamer")])
+    assert cache.get(user_id=1)[0].login == "streamer"
+    assert cache.get(user_id="1")[0].login == "streamer"
+    assert cache.get(login="Streamer")[0].id == 1
+    assert cache.get(user_id=2) == (None, False)
+    assert cache.stats == {"size": 1, "hits": 3, "stale": 0, "misses": 1}
+
+
+def test_returns_copies():
+    cache = UserCache()
+    cache.put([user(1, "streamer")])
+    found, _ = cache.get(user_id=1)
+    found.origin = "changed"
+    assert cache.get(user_id=1)[0].origin is None
+
+
+def test_stale_then_expired(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(user_cache, "time", lambda: now[0])
+    cache = UserCache(ttl=60, max_age=300)
+    cache.put([user(1, "streamer")])
+    assert cache.get(user_id=1)[1] is False
+    now[0] += 61
+    found, stale = cache.get(user_id=1)
+    assert found is not None and stale
+    now[0] += 240
+    assert cache.get(user_id=1) == (None, False)
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = UserCache(maxsize=2)
+    cache.put([user(1, "one"), user(2, "two")])
+    cache.get(user_id=1)
+    cache.put([user(3, "three")])
+    assert cache.get(user_id=2) == (None, False)
+    assert cache.get(login="two") == (None, False)
+    assert cache.get(user_id=1)[0] is not None
+    assert cache.get(user_id=3)[0] is not None
+
+
+def test_renamed_user_keeps_only_new_login():
+    cache = UserCache()
+    cache.put([user(1, "old")])
+    cache.put([user(1, "new")])
+    assert cache.get(login="old") == (None, False)
+    assert cache.get(login="new")[0].id == 1
+    cache.invalidate(1)
+    assert len(cache) == 0
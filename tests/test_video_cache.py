@@ -0,0 +1,49 @@
+import twitchtools.video_cache as video_cache
+from twitchtools.video_cache import MISSING_TTL, VideoCache
+
+PARTS = ["liveStreamingDetails", "snippet"]
+
+
+def test_parts_expire_on_their_own_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(video_cache, "time", lambda: now[0])
+    cache = VideoCache()
+    assert cache.missing_parts("v", PARTS) == set(PARTS)
+    cache.put({"id": "v", "liveStreamingDetails": {"actualStartTime": "x"}, "snippet": {"title": "t"}}, PARTS)
+    assert cache.missing_parts("v", PARTS) == set()
+    now[0] += 31
+    # Live state is only kept briefly, the title for longer
+    assert cache.missing_parts("v", PARTS) == {"liveStreamingDetails"}
+    now[0] += 270
+    assert cache.missing_parts("v", PARTS) == set(PARTS)
+    assert cache.stats == {"size": 1, "hits": 1, "misses": 3}
+
+
+def test_get_returns_item_with_absent_parts_left_out():
+    cache = VideoCache()
+    cache.put({"id": "v", "snippet": {"title": "t"}}, PARTS)
+    assert cache.get("v", PARTS) == {"id": "v", "snippet": {"title": "t"}}
+    assert cache.get("v", ["status"]) is None
+    assert cache.get("other", PARTS) is None
+
+
+def test_missing_videos_are_remembered(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(video_cache, "time", lambda: now[0])
+    cache = VideoCache()
+    cache.put({"id": "v"}, PARTS)
+    cache.put_missing("v")
+    assert cache.is_missing("v")
+    assert cache.get("v", PARTS) is None
+    now[0] += MISSING_TTL + 1
+    assert not cache.is_missing("v")
+
+
+def test_least_recently_used_is_evicted():
+    cache = VideoCache(maxsize=2)
+    cache.put({"id": "a"}, PARTS)
+    cache.put({"id": "b"}, PARTS)
+    cache.get("a", PARTS)
+    cache.put({"id": "c"}, PARTS)
+    assert cache.get("b", PARTS) is None
+    assert cache.get("a", PARTS) is not None
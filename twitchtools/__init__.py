@@ -1,16 +1,21 @@
 from .api_twitch import *
 from .api_youtube import *
 from .asset import *
+from .catchup_scheduler import CatchupScheduler, CatchupTier
 from .checks import *
 from .connection_state import CustomConnectionState
 from .custom_context import ApplicationCustomContext
 from .custom_sync import _sync_application_commands
+from .dedup import NotificationCache
 from .enums import *
 from .exceptions import *
+from .feed import DeletedEntry, FeedEntry, YoutubeFeed, parse_feed
 from .files import *
-from .ratelimit import Ratelimit
+from .ratelimit import HelixRatelimiter, Ratelimit
+from .singleflight import SingleFlight
 from .stream import *
 from .subscription import *
 from .timedelta import human_timedelta
 from .user import *
+from .user_cache import UserCache
 from .views import Confirm, TextPaginator, SortableTextPaginator
@@ -1,21 +1,37 @@
 from __future__ import annotations
 
 import asyncio
-from typing import TYPE_CHECKING, List, Optional, Union
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional, Union
+from urllib.parse import urlencode
 
 from aiohttp import ClientSession
 from aiohttp.client_reqrep import ClientResponse
 
-from .enums import AlertOrigin, AlertType, SubscriptionType
+from .enums import (AlertOrigin, AlertType, RequestPriority,
+                    SubscriptionStatus, SubscriptionType)
 from .exceptions import *
+from .ratelimit import HelixRatelimiter
+from .singleflight import SingleFlight
+from .subscription_manager import SubscriptionManager
 from .stream import Stream
-from .subscription import Subscription, SubscriptionEvent, TitleEvent
+from .subscription import (Subscription, SubscriptionEvent, SubscriptionIndex,
+                           TitleEvent)
 from .user import PartialUser, User
+from .user_cache import UserCache
 from .video import Video
 
 if TYPE_CHECKING:
     from main import TwitchCallBackBot
 
+# Helix accepts up to 100 ids per request for users and streams
+HELIX_PAGE_SIZE = 100
+# Maximum concurrent page requests for bulk lookups
+BULK_CONCURRENCY = 8
+# How many times a request is retried after being ratelimited
+RATELIMIT_RETRIES = 3
+# How long stale users are collected before being refreshed together
+USER_REFRESH_DELAY = 1
+
 
 class http_twitch:
     def __init__(self, bot, client_id, client_secret, callback_url, **kwargs):
@@ -27,10 +43,25 @@ class http_twitch:
             self.client_secret: str = client_secret
             self.access_token: str | None = None
             self.callback_url: str = callback_url
+            # Only needed for websocket eventsub subscriptions, which can't use an app access token
+            self.user_access_token: Optional[str] = kwargs.get("user_access_token", None) or None
         except KeyError:
             raise BadAuthorization
         self.bot.add_listener(self._make_session, 'on_connect')
         self.bot.add_listener(self._fetch_access_token, 'on_connect')
+        self._bulk_semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+        self.ratelimiter = HelixRatelimiter()
+        self.user_cache = UserCache()
+        self.singleflight = SingleFlight()
+        self.subscriptions = SubscriptionManager(bot, "subscription_confirmation")
+        self._stale_user_ids: set[int] = set()
+        self._user_refresh_task: Optional[asyncio.Task] = None
+        # Overridable so websocket subscriptions can be made against a mock server
+        self.eventsub_url: str = kwargs.get("eventsub_subscriptions_url", None) or f"{self.base}/eventsub/subscriptions"
+        # Cost of the websocket subscriptions made with the user token, from the last creation response.
+        # Subscriptions for broadcasters that haven't authorized the token each cost 1
+        self.websocket_total_cost: int = 0
+        self.websocket_max_total_cost: Optional[int] = None
 
     async def _fetch_access_token(self):
         await self.bot.wait_until_db_ready()
@@ -40,6 +71,10 @@ class http_twitch:
     def headers(self) -> dict:
         return {"Authorization": f"Bearer {self.access_token}", "Client-Id": self.client_id}
 
+    @property
+    def user_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.user_access_token}", "Client-Id": self.client_id}
+
     async def _make_session(self):
         self.session: ClientSession = ClientSession()
 
@@ -47,24 +82,47 @@ class http_twitch:
         if not self.session.closed:
             await self.session.close()
 
-    async def _request(self, url, method="get", **kwargs) -> ClientResponse:
-        response = await self.session.request(method=method, url=url, headers=self.headers, **kwargs)
-        if response.status == 401:  # Refresh access token
-            reauth = await self.session.post(url=f"{self.oauth2_base}/token", data={
-                "client_id": self.client_id,
-                "client_secret": self.client_secret,
-                "grant_type": "client_credentials"
-            })
-            if reauth.status in [401, 400]:
-                reauth_data = await reauth.json()
-                raise BadAuthorization(reauth_data["message"])
+    async def _reauth(self):
+        reauth = await self.session.post(url=f"{self.oauth2_base}/token", data={
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "grant_type": "client_credentials"
+        })
+        if reauth.status in [401, 400]:
             reauth_data = await reauth.json()
-            try:
-                self.access_token = reauth_data["access_token"]
-            except KeyError:
-                raise BadAuthorization(f"Error obtaining access token: Status code {reauth.status}. {reauth_data.get('message', 'No message available')}")
-            await self.bot.db.write_access_token(reauth_data["access_token"])
+            raise BadAuthorization(reauth_data["message"])
+        reauth_data = await reauth.json()
+        try:
+            self.access_token = reauth_data["access_token"]
+        except KeyError:
+            raise BadAuthorization(f"Error obtaining access token: Status code {reauth.status}. {reauth_data.get('message', 'No message available')}")
+        await self.bot.db.write_access_token(reauth_data["access_token"])
+
+    async def _request(self, url, method="get", priority: RequestPriority = RequestPriority.interactive, **kwargs) -> ClientResponse:
+        # Identical concurrent lookups share one request
+        if method.lower() == "get" and not kwargs:
+            return await self.singleflight.do(url, lambda: self._send_request(url, method, priority))
+        return await self._send_request(url, method, priority, **kwargs)
+
+    async def _send_request(self, url, method="get", priority: RequestPriority = RequestPriority.interactive, **kwargs) -> ClientResponse:
+        for attempt in range(RATELIMIT_RETRIES + 1):
+            await self.ratelimiter.acquire(priority)
             response = await self.session.request(method=method, url=url, headers=self.headers, **kwargs)
+            if response.status == 401:  # Refresh access token
+                response.release()
+                await self._reauth()
+                await self.ratelimiter.acquire(priority)
+                response = await self.session.request(method=method, url=url, headers=self.headers, **kwargs)
+            self.ratelimiter.update(response.headers)
+            if response.status != 429 or attempt == RATELIMIT_RETRIES:
+                # Read the body now so every caller sharing this response can read it
+                await response.read()
+                return response
+            retry_after = self.ratelimiter.retry_after(response.headers)
+            # Hand the connection back to the pool, the throttled response is never read
+            response.release()
+            self.bot.log.warning(f"[Twitch] Ratelimited on {method.upper()} {url.split('?')[0]}, retrying in {retry_after:.2f}s")
+            await asyncio.sleep(retry_after)
         return response
 
     def chunks(self, lst, n):
@@ -72,35 +130,77 @@ class http_twitch:
         for i in range(0, len(lst), n):
             yield lst[i:i + n]
 
-    async def get_users(self, users: List[PartialUser] = [], user_ids: List[int] = [], user_logins: List[str] = []) -> List[User]:
+    async def _get_pages(self, endpoint: str, queries: List[str], set_first: bool = False, priority: RequestPriority = RequestPriority.interactive) -> List[dict]:
+        """Request the endpoint with full pages of queries concurrently, returning the combined data"""
+        async def fetch_page(chunk: List[str]) -> List[dict]:
+            async with self._bulk_semaphore:
+                first = f"first={HELIX_PAGE_SIZE}&" if set_first else ""
+                r = await self._request(f"{self.base}/{endpoint}?{first}{'&'.join(chunk)}", priority=priority)
+                return (await r.json()).get("data", [])
+        pages = await asyncio.gather(*[fetch_page(chunk) for chunk in self.chunks(queries, HELIX_PAGE_SIZE)])
+        return [data for page in pages for data in page]
+
+    async def get_users(self, users: List[PartialUser] = [], user_ids: List[int] = [], user_logins: List[str] = [], priority: RequestPriority = RequestPriority.interactive, cache: bool = True) -> List[User]:
+        if not cache:
+            queries = [f"id={user.id}" for user in users] + [f"id={id}" for id in user_ids] + [f"login={login}" for login in user_logins]
+            fetched = [User(**user_json) for user_json in await self._get_pages("users", queries, priority=priority)]
+            self.user_cache.put(fetched)
+            return fetched
+
+        # Serve what we can from the cache, stale users are returned as is and refreshed in the background
+        found: dict[int, User] = {}
         queries = []
-        queries += [f"id={user.id}" for user in users]
-        queries += [f"id={id}" for id in user_ids]
-        queries += [f"login={login}" for login in user_logins]
-        users_response = []
-        for chunk in self.chunks(queries, 100):
-            join = '&'.join(chunk)
-            r = await self._request(f"{self.base}/users?{join}")
-            json_data = (await r.json())["data"]
-            for user_json in json_data:
-                users_response.append(User(**user_json))
-
-        return users_response
+        stale_ids = []
+        lookups = [(user.id, None) for user in users] + [(id, None) for id in user_ids] + [(None, login) for login in user_logins]
+        for user_id, login in lookups:
+            user, stale = self.user_cache.get(user_id=user_id, login=login)
+            if user is None:
+                queries.append(f"id={user_id}" if user_id is not None else f"login={login}")
+                continue
+            found[user.id] = user
+            if stale:
+                stale_ids.append(user.id)
+        self._refresh_users(stale_ids)
+        if queries:
+            fetched = [User(**user_json) for user_json in await self._get_pages("users", queries, priority=priority)]
+            self.user_cache.put(fetched)
+            found.update({user.id: user for user in fetched})
+        return list(found.values())
+
+    def _refresh_users(self, user_ids: List[int]):
+        if not user_ids:
+            return
+        self._stale_user_ids.update(user_ids)
+        if self._user_refresh_task is None or self._user_refresh_task.done():
+            self._user_refresh_task = self.bot.loop.create_task(self._refresh_stale_users())
+
+    async def _refresh_stale_users(self):
+        await asyncio.sleep(USER_REFRESH_DELAY)
+        user_ids, self._stale_user_ids = list(self._stale_user_ids), set()
+        try:
+            refreshed = await self.get_users(user_ids=user_ids, priority=RequestPriority.background, cache=False)
+        except Exception as e:
+            self.bot.log.warning(f"[Twitch] Failed to refresh {len(user_ids)} cached users: {type(e).__name__}: {e}")
+            return
+        # Users helix no longer returns are dropped, rather than served stale until they expire
+        refreshed_ids = {user.id for user in refreshed}
+        for user_id in user_ids:
+            if user_id not in refreshed_ids:
+                self.user_cache.invalidate(user_id)
+        self.bot.log.debug(f"[Twitch] Refreshed {len(refreshed)} cached users")
 
     async def get_user(self, user: Optional[PartialUser] = None, user_id: Optional[int] = None, user_login: Optional[str] = None) -> Optional[User]:
         if user is not None:
-            r = await self._request(f"{self.base}/users?id={user.id}")
+            users = await self.get_users(user_ids=[user.id])
         elif user_id is not None:
-            r = await self._request(f"{self.base}/users?id={user_id}")
+            users = await self.get_users(user_ids=[user_id])
         elif user_login is not None:
-            r = await self._request(f"{self.base}/users?login={user_login}")
+            users = await self.get_users(user_logins=[user_login])
         else:
             raise BadRequest
-        j: dict = await r.json()
-        if j.get("data", []) == []:
+        if users == []:
             return None
-        json_data = j["data"][0]
-        return User(**json_data)
+        return users[0]
     
     async def get_user_follow_count(self, user: Optional[PartialUser] = None, user_id: Optional[int] = None) -> Optional[str]:
         if user is not None:
@@ -112,23 +212,15 @@ class http_twitch:
         j: dict = await r.json()
         return j.get("total", None)
 
-    async def get_streams(self, users: List[Union[User, PartialUser]] = [], user_ids: List[int] = [], user_logins: List[str] = [], origin: AlertOrigin = AlertOrigin.unavailable) -> List[Stream]:
+    async def get_streams(self, users: List[Union[User, PartialUser]] = [], user_ids: List[int] = [], user_logins: List[str] = [], origin: AlertOrigin = AlertOrigin.unavailable, priority: RequestPriority = RequestPriority.interactive) -> List[Stream]:
         queries = []
         queries += [f"user_id={user.id}" for user in users]
         queries += [f"user_id={id}" for id in user_ids]
         queries += [f"user_login={login}" for login in user_logins]
-        streams = []
         if queries == []:
             raise BadRequest
-        for chunk in self.chunks(queries, 20):
-            join = '&'.join(chunk)
-            r = await self._request(f"{self.base}/streams?{join}")
-            j = await r.json()
-            for stream in j.get("data", []):
-                s = Stream(**stream)
-                s.origin = origin
-                streams.append(s)
-        return streams
+        # first must be set to the page size, as helix otherwise only returns 20 streams per request
+        return [Stream(**stream, origin=origin) for stream in await self._get_pages("streams", queries, set_first=True, priority=priority)]
 
     async def get_stream(self, user: Union[PartialUser, User], origin: AlertOrigin = AlertOrigin.unavailable) -> Union[Stream, None]:
         r = await self._request(f"{self.base}/streams?user_login={user}")
@@ -140,21 +232,44 @@ class http_twitch:
         s.origin = origin
         return s
 
-    async def get_subscription(self, id: str) -> Union[Subscription, None]:
-        r = await self._request(f"{self.base}/eventsub/subscriptions")
-        rj = await r.json()
-        for sub in rj.get("data", []):
-            if sub["id"] == id:
-                return Subscription(**sub)
+    async def iter_subscriptions(self, type: Optional[SubscriptionType] = None, status: Optional[SubscriptionStatus] = None, user_id: Optional[int] = None, priority: RequestPriority = RequestPriority.interactive) -> AsyncIterator[Subscription]:
+        """Yield every subscription, following the pagination cursor.
+        Helix only accepts one filter per request, so the most selective one given is sent and the rest are applied here"""
+        if user_id is not None:
+            filters = {"user_id": str(user_id)}
+        elif type is not None:
+            filters = {"type": type.value}
+        elif status is not None:
+            filters = {"status": status.value}
+        else:
+            filters = {}
+        cursor = None
+        while True:
+            query = urlencode({**filters, "after": cursor} if cursor else filters)
+            r = await self._request(f"{self.base}/eventsub/subscriptions{'?' + query if query else ''}", priority=priority)
+            rj = await r.json()
+            for sub in rj.get("data", []):
+                subscription = Subscription(**sub)
+                if type is not None and "type" not in filters and subscription.type != type:
+                    continue
+                if status is not None and "status" not in filters and subscription.status != status:
+                    continue
+                yield subscription
+            cursor = rj.get("pagination", {}).get("cursor", None)
+            if not cursor:
+                break
+
+    async def get_subscription(self, id: str, priority: RequestPriority = RequestPriority.interactive) -> Union[Subscription, None]:
+        async for subscription in self.iter_subscriptions(priority=priority):
+            if subscription.id == id:
+                return subscription
         return None
 
-    async def get_subscriptions(self) -> List[Subscription]:
-        r = await self._request(f"{self.base}/eventsub/subscriptions")
-        rj = await r.json()
-        subs = []
-        for sub in rj.get("data", []):
-            subs.append(Subscription(**sub))
-        return subs
+    async def get_subscriptions(self, type: Optional[SubscriptionType] = None, status: Optional[SubscriptionStatus] = None, user_id: Optional[int] = None, priority: RequestPriority = RequestPriority.interactive) -> List[Subscription]:
+        return [subscription async for subscription in self.iter_subscriptions(type=type, status=status, user_id=user_id, priority=priority)]
+
+    async def get_subscription_index(self, type: Optional[SubscriptionType] = None, status: Optional[SubscriptionStatus] = None, user_id: Optional[int] = None, priority: RequestPriority = RequestPriority.background) -> SubscriptionIndex:
+        return SubscriptionIndex([subscription async for subscription in self.iter_subscriptions(type=type, status=status, user_id=user_id, priority=priority)])
 
     def get_event(self, data) -> Optional[SubscriptionEvent]:
         event_type = SubscriptionType(data["subscription"]["type"])
@@ -162,7 +277,7 @@ class http_twitch:
             return TitleEvent(**data)
         return None
 
-    async def create_subscription(self, subscription_type: SubscriptionType, streamer: Union[User, PartialUser], secret: str, alert_type: AlertType = AlertType.status) -> Subscription:
+    async def create_subscription(self, subscription_type: SubscriptionType, streamer: Union[User, PartialUser], secret: str, alert_type: AlertType = AlertType.status, priority: RequestPriority = RequestPriority.interactive) -> Subscription:
         response = await self._request(f"{self.base}/eventsub/subscriptions",
                                        json={
                                            "type": subscription_type.value,
@@ -175,7 +290,7 @@ class http_twitch:
                                                "callback": f"{self.callback_url}/{alert_type.value}/{streamer.user_id}",
                                                "secret": secret
                                            }
-                                       }, method="post")
+                                       }, method="post", priority=priority)
 
         if response.status not in [202, 409]:
             raise SubscriptionError(
@@ -189,22 +304,57 @@ class http_twitch:
                 f"There was an error creating the {subscription_type.value} subscription: `{str(j)}`")
         subscription = Subscription(**json_data)
 
-        # Wait for subscription confirmation
-        def check(sub_id):
-            return sub_id == subscription.id
-        try:
-            await self.bot.wait_for("subscription_confirmation", check=check, timeout=8)
-        except asyncio.TimeoutError:
-            await self.delete_subscription(subscription.id)
+        # Wait for subscription confirmation, which may have already arrived
+        if not await self.subscriptions.wait(subscription.id):
+            await self.delete_subscription(subscription.id, priority=priority)
             raise SubscriptionError(
                 "Did not receive subscription confirmation! Please try again later")
 
         return subscription
 
-    async def delete_subscription(self, subscription: Union[Subscription, str]) -> ClientResponse:
+    async def create_subscriptions(self, subscriptions: List[tuple[SubscriptionType, Union[User, PartialUser], str, AlertType]], priority: RequestPriority = RequestPriority.interactive) -> List[Union[Subscription, Exception]]:
+        """Create many subscriptions at once from (type, streamer, secret, alert type) tuples.
+        Returns the subscription or the exception raised for each, in the same order"""
+        return await self.subscriptions.run_batch([
+            lambda s=s: self.create_subscription(s[0], streamer=s[1], secret=s[2], alert_type=s[3], priority=priority) for s in subscriptions])
+
+    async def create_websocket_subscription(self, subscription_type: SubscriptionType, broadcaster_id: Union[int, str], session_id: str) -> Subscription:
+        """Bind a subscription to an eventsub websocket session. No confirmation is sent for these"""
+        if not self.user_access_token:
+            raise SubscriptionError("Websocket subscriptions require a user access token")
+        response = await self.session.request(method="post", url=self.eventsub_url, headers=self.user_headers,
+                                              json={
+                                                  "type": subscription_type.value,
+                                                  "version": "1",
+                                                  "condition": {
+                                                      "broadcaster_user_id": str(broadcaster_id)
+                                                  },
+                                                  "transport": {
+                                                      "method": "websocket",
+                                                      "session_id": session_id
+                                                  }
+                                              })
+        j = await response.json()
+        if response.status == 429:
+            # Returned once the session has too many subscriptions or the token's max_total_cost is used up
+            raise SubscriptionLimitExceeded(
+                f"Websocket subscription limit reached creating {subscription_type.value} for {broadcaster_id}. {j.get('message', '')}")
+        if response.status != 202:
+            raise SubscriptionError(
+                f"There was an error creating the {subscription_type.value} websocket subscription. Error code: {response.status}. {j.get('message', '')}")
+        self.websocket_total_cost = j.get("total_cost", self.websocket_total_cost)
+        self.websocket_max_total_cost = j.get("max_total_cost", self.websocket_max_total_cost)
+        return Subscription(**j["data"][0])
+
+    async def delete_websocket_subscription(self, subscription: Union[Subscription, str]) -> ClientResponse:
+        if isinstance(subscription, Subscription):
+            subscription = subscription.id
+        return await self.session.request(method="delete", url=f"{self.eventsub_url}?id={subscription}", headers=self.user_headers)
+
+    async def delete_subscription(self, subscription: Union[Subscription, str], priority: RequestPriority = RequestPriority.interactive) -> ClientResponse:
         if isinstance(subscription, Subscription):
             subscription = subscription.id
-        return await self._request(f"{self.base}/eventsub/subscriptions?id={subscription}", method="delete")
+        return await self._request(f"{self.base}/eventsub/subscriptions?id={subscription}", method="delete", priority=priority)
 
     async def get_videos(self, user: Union[User, PartialUser]) -> list[Video]:
         r = await self._request(f"{self.base}/videos?user_id={user.id}")
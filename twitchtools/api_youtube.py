@@ -7,16 +7,28 @@ from aiohttp import ClientSession
 from aiohttp.client_reqrep import ClientResponse
 from bs4 import BeautifulSoup
 
-from .enums import AlertOrigin, YoutubeVideoType
+from .enums import AlertOrigin, YoutubeCallback, YoutubeVideoType
 from .exceptions import *
+from .feed import parse_feed
+from .quota import QuotaLedger
+from .singleflight import SingleFlight
+from .subscription_manager import SubscriptionManager
 from .subscription import YoutubeSubscription
 from .user import PartialYoutubeUser, YoutubeUser
 from .video import YoutubeVideo
+from .video_cache import VideoCache
 
 if TYPE_CHECKING:
     from main import TwitchCallBackBot
 
 LEASE_SECONDS = 828000
+# Maximum channels having their feeds fetched at the same time
+FEED_CONCURRENCY = 10
+# Maximum videos requests of 50 IDs running at the same time
+VIDEO_CONCURRENCY = 5
+# Every part needed to build a YoutubeVideo. Quota is charged per request rather than per part,
+# so bulk lookups request all of them for the stream lookups that usually follow
+VIDEO_PARTS = ["liveStreamingDetails", "status", "snippet", "contentDetails"]
 
 
 class http_youtube:
@@ -27,6 +39,12 @@ class http_youtube:
         self.api_key: str = yt_api_key
         self.callback_url: str = callback_url
         self.bot.add_listener(self._make_session, 'on_connect')
+        # Channel ID: (ETag, Last-Modified, video IDs) of the last RSS feed response
+        self._feed_cache: dict[str, tuple[Optional[str], Optional[str], list[str]]] = {}
+        self.singleflight = SingleFlight()
+        self.subscriptions = SubscriptionManager(bot, "youtube_subscription_confirmation")
+        self.quota = QuotaLedger(kwargs.get("yt_quota_limit", 10000))
+        self.video_cache = VideoCache()
 
     async def _make_session(self):
         self.session: ClientSession = ClientSession()
@@ -39,9 +57,19 @@ class http_youtube:
         if not kwargs.get("no_key", False):
             url = url+f"&key={self.api_key}"
         kwargs.pop("no_key", None)
+        # Identical concurrent lookups share one request
+        if method.lower() == "get" and not kwargs:
+            return await self.singleflight.do(url, lambda: self._send_request(url, method))
+        return await self._send_request(url, method, **kwargs)
+
+    async def _send_request(self, url, method="get", **kwargs):
+        if url.startswith(self.base):
+            self.quota.record(url[len(self.base):].strip("/").split("?")[0])
         response = await self.session.request(method=method, url=url, **kwargs)
         if response.status == 401:  # Refresh access token
             self.bot.log.critical("Invalid access token!")
+        # Read the body now so every caller sharing this response can read it
+        await response.read()
         return response
 
     def chunks(self, lst, n):
@@ -92,36 +120,42 @@ class http_youtube:
         #  For resubscriptions an ID already exists, reuse it
         subscription_id = subscription_id or self.bot.random_string_generator(
             21)
-        response = await self._request(self.pubsuburi,
-                                       data={
-                                           "hub.callback": f"{self.callback_url}/youtube/{channel.id}",
-                                           "hub.mode": "subscribe",
-                                           "hub.verify": "async",
-                                           "hub.lease_seconds": str(LEASE_SECONDS),
-                                           "hub.topic": f"https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel.id}",
-                                           "hub.secret": secret,
-                                           "hub.verify_token": f"{secret}:{subscription_id}"
-                                       }, method="post", no_key=True)
+        # The hub can verify before responding, so listen for the confirmation first
+        self.subscriptions.expect(subscription_id)
+        try:
+            response = await self._request(self.pubsuburi,
+                                           data={
+                                               "hub.callback": f"{self.callback_url}/youtube/{channel.id}",
+                                               "hub.mode": "subscribe",
+                                               "hub.verify": "async",
+                                               "hub.lease_seconds": str(LEASE_SECONDS),
+                                               "hub.topic": f"https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel.id}",
+                                               "hub.secret": secret,
+                                               "hub.verify_token": f"{secret}:{subscription_id}"
+                                           }, method="post", no_key=True)
+        except Exception:
+            self.subscriptions.forget(subscription_id)
+            raise
         if response.status not in [202, 204]:
+            self.subscriptions.forget(subscription_id)
             raise SubscriptionError(
                 f"There was an error subscribing to the pubsub. Please try again later. Error code: {response.status}")
 
         subscription = YoutubeSubscription(subscription_id, channel, secret)
 
         # Wait for subscription confirmation
-        def check(verify_token):
-            if verify_token == subscription.id:
-                return True
-            self.bot.log.warning(f"Bad verify token received for {channel.display_name}")
-            return False
-        try:
-            await self.bot.wait_for("youtube_subscription_confirmation", check=check, timeout=8)
-        except asyncio.TimeoutError:
+        if not await self.subscriptions.wait(subscription.id):
             await self.delete_subscription(subscription)
             raise SubscriptionError(
                 "Did not receive subscription confirmation! Please try again later")
         return subscription
 
+    async def create_subscriptions(self, subscriptions: list[tuple[PartialYoutubeUser, str, str]]) -> list[Union[YoutubeSubscription, Exception]]:
+        """Create many subscriptions at once from (channel, secret, subscription id) tuples.
+        Returns the subscription or the exception raised for each, in the same order"""
+        return await self.subscriptions.run_batch([
+            lambda s=s: self.create_subscription(s[0], s[1], s[2]) for s in subscriptions])
+
     async def delete_subscription(self, subscription: YoutubeSubscription) -> ClientResponse:
         return await self._request(self.pubsuburi,
                                    data={
@@ -191,83 +225,59 @@ class http_youtube:
 
     async def has_video_ended(self, video_id: str) -> Union[str, bool]:
         """Returns the end date if the provided stream has ended, otherwise returns false"""
-        stream = await self._request(f"{self.base}/videos?id={video_id}&part=liveStreamingDetails")
-        stream_json = await stream.json()
         # Check if video is a stream first
-        if stream_json.get("items", []) != []:
-            if self.is_stream(stream_json["items"][0]) and self.has_stream_ended(stream_json["items"][0]):
-                return stream_json["items"][0]["liveStreamingDetails"]["actualEndTime"]
+        if item := (await self.get_video_items([video_id], VIDEO_PARTS)).get(video_id, None):
+            if self.is_stream(item) and self.has_stream_ended(item):
+                return item["liveStreamingDetails"]["actualEndTime"]
         return False
 
     async def have_videos_ended(self, video_ids: list[str]) -> list[str]:
+        items = await self.get_video_items(video_ids, VIDEO_PARTS)
         ended_videos = []
-        all_ids = []
-        for chunk in self.chunks(video_ids, 50):
-            stream = await self._request(f"{self.base}/videos?id={','.join(chunk)}&part=liveStreamingDetails,status")
-            stream_json = await stream.json()
-            for item in stream_json.get("items", []):
-                if self.is_stream(item) and self.has_stream_ended(item):
-                    ended_videos.append(item["id"])
-                all_ids.append(item["id"])
         for id in video_ids:
-            if id not in all_ids:
+            # Videos that no longer exist have ended too
+            item = items.get(id, None)
+            if item is None or (self.is_stream(item) and self.has_stream_ended(item)):
                 ended_videos.append(id)
         return ended_videos
 
-    async def get_stream(self, video_id: str, origin: AlertOrigin = AlertOrigin.callback) -> YoutubeVideo:
-        stream = await self._request(f"{self.base}/videos?id={video_id}&part=liveStreamingDetails,status")
-        stream_json = await stream.json()
+    async def get_stream(self, video_id: str, origin: AlertOrigin = AlertOrigin.callback, fresh: bool = False) -> YoutubeVideo:
+        """fresh skips the video cache, for when the video is known to have changed"""
+        item = (await self.get_video_items([video_id], VIDEO_PARTS, fresh=fresh)).get(video_id, None)
         # Check if video is a stream first
-        if stream_json.get("items", []) != []:
-            item = stream_json["items"][0]
-            video_type = self.get_video_type(item)
-            # self.bot.log.info(f"Scheduled Stream: {self.is_scheduled_stream(item)}")
-            if video_type == YoutubeVideoType.video:
-                raise VideoNotStream(video_id, video_type=video_type.value)
-            if self.has_stream_ended(item):
-                raise VideoStreamEnded(video_id)
-        else:
+        if item is None:
             raise VideoNotFound(video_id)
-        # Fetch more info if stream is live
-        snippet_content = await self._request(f"{self.base}/videos?id={video_id}&part=snippet,contentDetails")
-        snippet_content_json = await snippet_content.json()
+        video_type = self.get_video_type(item)
+        # self.bot.log.info(f"Scheduled Stream: {self.is_scheduled_stream(item)}")
+        if video_type == YoutubeVideoType.video:
+            raise VideoNotStream(video_id, video_type=video_type.value)
+        if self.has_stream_ended(item):
+            raise VideoStreamEnded(video_id)
         # Pass requests to video class
         return YoutubeVideo(video_id,
-                            snippet_content_json["items"][0]["snippet"],
-                            snippet_content_json["items"][0]["contentDetails"],
+                            item["snippet"],
+                            item["contentDetails"],
                             item["status"],
                             item["liveStreamingDetails"], video_type=video_type, origin=origin)
     
-    async def get_video(self, video_id: str, origin: AlertOrigin = AlertOrigin.unavailable) -> Optional[YoutubeVideo]:
-        stream = await self._request(f"{self.base}/videos?id={video_id}&part=liveStreamingDetails,status")
-        stream_json = await stream.json()
-        # Check if video is a stream first
-        if stream_json.get("items", []) != []:
-            item = stream_json["items"][0]
-            video_type = self.get_video_type(item)
-        else:
+    async def get_video(self, video_id: str, origin: AlertOrigin = AlertOrigin.unavailable, fresh: bool = False) -> Optional[YoutubeVideo]:
+        item = (await self.get_video_items([video_id], VIDEO_PARTS, fresh=fresh)).get(video_id, None)
+        if item is None:
             raise VideoNotFound(video_id)
-        # Fetch more info if stream is live
-        snippet_content = await self._request(f"{self.base}/videos?id={video_id}&part=snippet,contentDetails")
-        snippet_content_json = await snippet_content.json()
+        video_type = self.get_video_type(item)
         # Pass requests to video class
         return YoutubeVideo(video_id,
-                            snippet_content_json["items"][0]["snippet"],
-                            snippet_content_json["items"][0]["contentDetails"],
+                            item["snippet"],
+                            item["contentDetails"],
                             item["status"],
-                            item["liveStreamingDetails"], video_type=video_type, origin=origin)
+                            item.get("liveStreamingDetails", {}), video_type=video_type, origin=origin)
 
     async def parse_video_xml(self, channel: PartialYoutubeUser, request_content: str) -> Optional[YoutubeVideo]:
-        soup = BeautifulSoup(request_content, features="xml")
+        feed = parse_feed(request_content)
 
-        display_name = soup.find_all('name')[0].text
-        try:
-            try:
-                id = soup.find_all("yt:videoid")[0].text
-            except IndexError:
-                id = soup.find_all("yt:videoId")[0].text
-        except IndexError:  # This is a video deletion/unpublish message, ignore
-            deleted_video_id = soup.feed.link['href'].split('watch?v=')[-1] # type: ignore
+        display_name = feed.author_name or channel.display_name
+        if feed.deleted:  # This is a video deletion/unpublish message
+            deleted_video_id = feed.deleted[0].video_id
             if channel_cache := await self.bot.db.get_yt_channel_cache(channel):
                 if channel_cache.is_live and channel_cache.video_id == deleted_video_id:
                     channel.origin = AlertOrigin.callback
@@ -275,7 +285,10 @@ class http_youtube:
             self.bot.log.info(
                 f"[Youtube] {display_name} deleted video {deleted_video_id}")
             return
-        #channel_id = soup.find_all("yt:channelid")[0].text
+        if not feed.entries:
+            self.bot.log.warning(f"[Youtube] Notification for {display_name} contained no videos")
+            return
+        id = feed.entries[0].video_id
 
         last_vid = await self.bot.db.get_last_yt_vid(channel) or {}
         last_vid_id: str = last_vid.get("video_id", "")
@@ -286,14 +299,14 @@ class http_youtube:
             self.bot.log.info(
                 f"[Youtube] {display_name} updated latest video {id}")
             try:
-                return await self.get_stream(id)
+                return await self.get_stream(id, fresh=True)
             except (VideoNotFound, VideoNotStream, VideoStreamEnded) as e:
                 self.bot.log.info(f"[Youtube] {display_name}: {str(e)}")
                 return
 
         # Check video exists
         try:
-            video = await self.get_stream(id)
+            video = await self.get_stream(id, fresh=True)
         except (VideoNotFound, VideoNotStream, VideoStreamEnded) as e:
             self.bot.log.info(f"[Youtube] {display_name}: {str(e)}")
             return
@@ -310,26 +323,46 @@ class http_youtube:
 
         return video
 
-    async def is_channel_live(self, channel: PartialYoutubeUser) -> Optional[str]:
-        if ids := (await self.get_recent_video_ids([channel])).get(channel, None):
-            stream = await self._request(f"{self.base}/videos?id={','.join(ids)}&part=liveStreamingDetails,status")
-            stream_json = await stream.json()
+    async def is_channel_live(self, channel: PartialYoutubeUser, callback: Optional[YoutubeCallback] = None) -> Optional[str]:
+        callback = callback or await self.bot.db.get_yt_callback(channel)
+        if callback is None:
+            self.bot.log.warning(f"[Youtube] Failed to get callback info for {channel.display_name}")
+            return None
+        if ids := (await self.get_recent_video_ids({channel: callback})).get(channel, None):
+            items = await self.get_video_items(ids, VIDEO_PARTS)
             # Check if video is a stream and return ID if so
-            for item in stream_json["items"]:
-                if self.is_stream(item) and not self.has_stream_ended(item):
-                    return item["id"]
+            for id in ids:
+                if (item := items.get(id, None)) and self.is_stream(item) and not self.has_stream_ended(item):
+                    return id
         return None
 
-    async def get_recent_video_ids(self, channels: list[PartialYoutubeUser]) -> dict[PartialYoutubeUser, list[str]]:
-        ids_dict: dict[PartialYoutubeUser, list[str]] = {}
-        for channel in channels:
-            if callback := await self.bot.db.get_yt_callback(channel):
-                r = await self.bot.aSession.get(f"https://www.youtube.com/feeds/videos.xml?channel_id={channel.id}")
-                soup = BeautifulSoup(await r.read(), features="xml")
-                # Read the most recent 2 entries and extract the video IDs
-                ids_search = soup.find_all("yt:videoid")
-                ids_search += soup.find_all("yt:videoId")
-                ids_dict[channel] = [id.text for id in ids_search]
+    async def get_feed_video_ids(self, channel: PartialYoutubeUser) -> list[str]:
+        """Read the video IDs from the channels RSS feed. No API cost.
+        Conditional requests are used, so an unchanged feed returns the previous IDs without being parsed again"""
+        headers = {}
+        if cached := self._feed_cache.get(channel.id, None):
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        async with self.bot.aSession.get(f"https://www.youtube.com/feeds/videos.xml?channel_id={channel.id}", headers=headers) as r:
+            if r.status == 304 and cached:
+                return list(cached[2])
+            if r.status != 200:
+                # Error pages aren't feeds. The channel's feed is skipped this time, and its cached feed kept
+                self.bot.log.warning(f"[Youtube] Failed to fetch feed for {channel.display_name}: Status code {r.status}")
+                return []
+            ids = parse_feed(await r.read()).video_ids
+            self._feed_cache[channel.id] = (r.headers.get("ETag", None), r.headers.get("Last-Modified", None), ids)
+        return list(ids)
+
+    async def get_recent_video_ids(self, callbacks: dict[PartialYoutubeUser, YoutubeCallback]) -> dict[PartialYoutubeUser, list[str]]:
+        semaphore = asyncio.Semaphore(FEED_CONCURRENCY)
+
+        async def fetch_channel(channel: PartialYoutubeUser, callback: YoutubeCallback) -> list[str]:
+            async with semaphore:
+                ids = await self.get_feed_video_ids(channel)
                 if playlist_id := callback.get("uploads_playlist_id", None):
                     try:
                         r = await self._request(f"{self.base}/playlistItems?playlistId={playlist_id}&part=contentDetails")
@@ -337,31 +370,78 @@ class http_youtube:
                         api_ids = [item["contentDetails"]["videoId"]
                                 for item in rj.get("items", [])]
                         for id in api_ids:
-                            if id not in ids_dict[channel]:
-                                ids_dict[channel].append(id)
+                            if id not in ids:
+                                ids.append(id)
                     except Exception as e:
                         self.bot.log.error(
                             f"Exception fetching uploads playlist for {channel.display_name}: {str(e)}")
-            else:
-                self.bot.log.warning(f"[Youtube] Failed to get callback info for {channel.display_name}")
+                return ids
+
+        channels = list(callbacks.keys())
+        results = await asyncio.gather(*[fetch_channel(c, callbacks[c]) for c in channels], return_exceptions=True)
+        ids_dict: dict[PartialYoutubeUser, list[str]] = {}
+        for channel, result in zip(channels, results):
+            if isinstance(result, Exception):
+                self.bot.log.error(f"[Youtube] Failed to fetch recent videos for {channel.display_name}: {str(result)}")
+                continue
+            ids_dict[channel] = result
         return ids_dict
 
-    async def are_videos_live(self, video_ids: dict[PartialYoutubeUser, list[str]]) -> dict[PartialYoutubeUser, str]:
-        live_channels = {}
-        all_ids = []
-        for ids in video_ids.values():
-            all_ids += ids
-        for chunk in self.chunks(all_ids, 50):
-            stream = await self._request(f"{self.base}/videos?id={','.join(chunk)}&part=liveStreamingDetails,status")
-            stream_json = await stream.json()
-            # Check if video is a stream and return ID if so
-            channel = None
-            for item in stream_json["items"]:
-                video_type = self.get_video_type(item)
-                if video_type != YoutubeVideoType.video and not self.has_stream_ended(item):
-                    for c, v in video_ids.items():
-                        if item["id"] in v:
-                            channel = c
-                    if channel:
-                        live_channels[channel] = item["id"]
+    async def get_video_items(self, video_ids: list[str], parts: list[str], fresh: bool = False) -> dict[str, dict]:
+        """Fetch video items with the given parts for any amount of IDs, keyed by video ID. Videos Youtube doesn't return are left out.
+        Only parts that aren't cached are requested, in chunks of 50 IDs requested concurrently"""
+        if fresh:
+            for id in video_ids:
+                self.video_cache.invalidate(id)
+        video_ids = [id for id in dict.fromkeys(video_ids) if not self.video_cache.is_missing(id)]
+        to_fetch: list[str] = []
+        fetch_parts: set[str] = set()
+        for id in video_ids:
+            if missing := self.video_cache.missing_parts(id, parts):
+                to_fetch.append(id)
+                fetch_parts |= missing
+
+        if to_fetch:
+            semaphore = asyncio.Semaphore(VIDEO_CONCURRENCY)
+            part = ','.join(sorted(fetch_parts))
+
+            async def fetch_chunk(chunk: list[str]) -> list[dict]:
+                async with semaphore:
+                    r = await self._request(f"{self.base}/videos?id={','.join(chunk)}&part={part}")
+                    return (await r.json()).get("items", [])
+            chunks = await asyncio.gather(*[fetch_chunk(chunk) for chunk in self.chunks(to_fetch, 50)])
+            returned = set()
+            for item in [item for chunk in chunks for item in chunk]:
+                self.video_cache.put(item, fetch_parts)
+                returned.add(item["id"])
+            for id in to_fetch:
+                if id not in returned:
+                    self.video_cache.put_missing(id)
+
+        items = {}
+        for id in video_ids:
+            if (item := self.video_cache.get(id, parts)) is not None:
+                items[id] = item
+        return items
+
+    async def are_videos_live(self, video_ids: dict[PartialYoutubeUser, list[str]]) -> dict[PartialYoutubeUser, list[str]]:
+        """Returns every live or upcoming video per channel, in the same order they were provided. Channels without any are left out"""
+        # Reverse index to find the channel of each returned video
+        video_channels: dict[str, PartialYoutubeUser] = {}
+        for channel, ids in video_ids.items():
+            for id in ids:
+                video_channels.setdefault(id, channel)
+        if video_channels == {}:
+            return {}
+
+        live_ids = set()
+        for item in (await self.get_video_items(list(video_channels.keys()), VIDEO_PARTS)).values():
+            video_type = self.get_video_type(item)
+            if video_type != YoutubeVideoType.video and not self.has_stream_ended(item):
+                live_ids.add(item["id"])
+
+        live_channels: dict[PartialYoutubeUser, list[str]] = {}
+        for id in video_channels.keys():
+            if id in live_ids:
+                live_channels.setdefault(video_channels[id], []).append(id)
         return live_channels
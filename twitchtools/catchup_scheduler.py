@@ -0,0 +1,86 @@
+from enum import Enum
+from time import time
+
+
+class CatchupTier(Enum):
+    live = "live"
+    recent = "recent"
+    idle = "idle"
+    dormant = "dormant"
+
+
+# Channels that went live within this long are recent, then idle, and dormant after that
+RECENT_WINDOW = 7 * 86400
+IDLE_WINDOW = 30 * 86400
+# A push event within this long shows notifications are arriving for the channel, so it is polled less
+PUSH_WINDOW = 3600
+PUSH_RELAX = 2
+
+# Seconds between catchups of a channel in each tier
+TWITCH_INTERVALS = {
+    CatchupTier.live: 900,
+    CatchupTier.recent: 1800,
+    CatchupTier.idle: 3600,
+    CatchupTier.dormant: 10800
+}
+# Youtube stream ends are only detected by catchup, so live channels are checked often
+YOUTUBE_INTERVALS = {
+    CatchupTier.live: 300,
+    CatchupTier.recent: 600,
+    CatchupTier.idle: 1800,
+    CatchupTier.dormant: 7200
+}
+
+
+class CatchupScheduler:
+    """Decides which channels are due a catchup, from their live state, when they were last live and when a push event was last received for them.
+
+    Poll and push times are only kept in memory, so every channel is due on the first run after startup"""
+
+    def __init__(self, intervals: dict[CatchupTier, int]):
+        self.intervals = intervals
+        # Channel ID: time
+        self.last_poll: dict[str, float] = {}
+        self.last_push: dict[str, float] = {}
+        self.polled = 0
+        self.skipped = 0
+
+    def record_push(self, channel_id: str):
+        self.last_push[str(channel_id)] = time()
+
+    def record_poll(self, channel_ids: list[str]):
+        now = time()
+        for channel_id in channel_ids:
+            self.last_poll[str(channel_id)] = now
+
+    def tier(self, cache: dict) -> CatchupTier:
+        if cache.get("is_live", False):
+            return CatchupTier.live
+        since_live = time() - cache.get("alert_cooldown", 0)
+        if since_live < RECENT_WINDOW:
+            return CatchupTier.recent
+        if since_live < IDLE_WINDOW:
+            return CatchupTier.idle
+        return CatchupTier.dormant
+
+    def interval(self, channel_id: str, cache: dict) -> float:
+        tier = self.tier(cache)
+        interval = self.intervals[tier]
+        # Live channels rely on catchup to notice ends, so they are never relaxed
+        if tier != CatchupTier.live and time() - self.last_push.get(str(channel_id), 0) < PUSH_WINDOW:
+            interval *= PUSH_RELAX
+        return interval
+
+    def due(self, caches: dict[str, dict]) -> list[str]:
+        """The channel IDs due a catchup, given each channel's cache with is_live and alert_cooldown"""
+        now = time()
+        due = [channel_id for channel_id, cache in caches.items()
+               if now - self.last_poll.get(str(channel_id), 0) >= self.interval(channel_id, cache)]
+        self.polled += len(due)
+        self.skipped += len(caches) - len(due)
+        return due
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"tracked": len(self.last_poll), "polled": self.polled, "skipped": self.skipped}
+
@@ -0,0 +1,64 @@
+from collections import deque
+from time import time
+from typing import Deque, Iterable, Optional, Union
+
+
+class NotificationCache:
+    """Bounded record of recently seen eventsub message ids.
+
+    Entries expire after max_age seconds (Twitch retries failed deliveries for up to 10 minutes)
+    or once more than maxlen ids have been seen, whichever comes first."""
+
+    def __init__(self, maxlen: int = 4096, max_age: int = 600):
+        self.maxlen = maxlen
+        self.max_age = max_age
+        self._ids: set[str] = set()
+        self._ring: Deque[tuple[str, float]] = deque()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self._ring)
+
+    def __contains__(self, message_id: str) -> bool:
+        self.prune()
+        if message_id in self._ids:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, message_id: str, timestamp: Optional[float] = None):
+        if message_id in self._ids:
+            return
+        self._ids.add(message_id)
+        self._ring.append((message_id, timestamp if timestamp is not None else time()))
+        while len(self._ring) > self.maxlen:
+            self._ids.discard(self._ring.popleft()[0])
+        self.dirty = True
+
+    def prune(self):
+        cutoff = time() - self.max_age
+        while self._ring and self._ring[0][1] < cutoff:
+            self._ids.discard(self._ring.popleft()[0])
+            self.dirty = True
+
+    def load(self, entries: Iterable[Union[str, list, tuple]]):
+        """Restore entries saved with dump. Plain ids from the old format are treated as just seen"""
+        now = time()
+        for entry in entries:
+            if isinstance(entry, str):
+                self.add(entry, now)
+            else:
+                self.add(entry[0], entry[1])
+        self.prune()
+        self.dirty = False
+
+    def dump(self) -> list[list]:
+        self.prune()
+        return [[message_id, timestamp] for message_id, timestamp in self._ring]
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._ring), "hits": self.hits, "misses": self.misses}
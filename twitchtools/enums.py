@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 from typing import Optional, TypedDict, Union
 
 
@@ -8,6 +8,12 @@ class AlertOrigin(Enum):
     unavailable = "unavailable"
 
 
+class RequestPriority(IntEnum):
+    # Lower values are sent first when waiting on the ratelimit
+    interactive = 0
+    background = 1
+
+
 class BroadcasterType(Enum):
     partner = "partner"
     affiliate = "affiliate"
@@ -28,6 +34,7 @@ class Live(Enum):
 
 class SubscriptionMethod(Enum):
     webhook = "webhook"
+    websocket = "websocket"
 
 
 class SubscriptionStatus(Enum):
@@ -37,6 +44,13 @@ class SubscriptionStatus(Enum):
     failures_exceeded = "notification_failures_exceeded"
     authorization_revoked = "authorization_revoked"
     user_removed = "user_removed"
+    websocket_disconnected = "websocket_disconnected"
+    websocket_failed_ping_pong = "websocket_failed_ping_pong"
+    websocket_received_inbound_traffic = "websocket_received_inbound_traffic"
+    websocket_connection_unused = "websocket_connection_unused"
+    websocket_internal_error = "websocket_internal_error"
+    websocket_network_timeout = "websocket_network_timeout"
+    websocket_network_error = "websocket_network_error"
 
 
 class SubscriptionType(Enum):
@@ -304,6 +318,7 @@ class Callback(Enum):
     offline_id: str
     title_id: str
     subscription_id: Optional[str]
+    guild_ids: list[str]
 
 
 class YoutubeCallbackAlertInfo(Enum):
@@ -323,6 +338,7 @@ class YoutubeCallback(Enum):
     uploads_playlist_id: str
     subscription_id: str
     expiry_time: int
+    guild_ids: list[str]
 
 
 class TitleCallbackAlertInfo(Enum):
@@ -335,6 +351,7 @@ class TitleCallback(Enum):
     alert_roles: dict[str, TitleCallbackAlertInfo]
     subscription_id: Optional[str]
     secret: Optional[str]
+    guild_ids: list[str]
 
 
 class ChannelCache(Enum):
@@ -20,6 +20,11 @@ class SubscriptionError(TwitchToolsException):
         super().__init__(message or "There was an error handling the eventsub subscription")
 
 
+class SubscriptionLimitExceeded(SubscriptionError):
+    def __init__(self, message: str = ""):
+        super().__init__(message or "The eventsub subscription limit has been reached")
+
+
 class RateLimitExceeded(TwitchToolsException):
     def __init__(self, display_name: str, when: int):
         super().__init__(
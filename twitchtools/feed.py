@@ -0,0 +1,113 @@
+from datetime import datetime
+from io import BytesIO
+from typing import Optional, Union
+
+from dateutil import parser
+from lxml import etree
+
+ATOM_NS = "http://www.w3.org/2005/Atom"
+YT_NS = "http://www.youtube.com/xml/schemas/2015"
+TOMBSTONE_NS = "http://purl.org/atompub/tombstone/1.0"
+
+# Only these elements are handed back by the parser, everything else is skipped
+_TAGS = [f"{{{ATOM_NS}}}entry", f"{{{ATOM_NS}}}name", f"{{{ATOM_NS}}}published", f"{{{ATOM_NS}}}updated", f"{{{ATOM_NS}}}link",
+         f"{{{YT_NS}}}videoId", f"{{{YT_NS}}}channelId", f"{{{YT_NS}}}videoid", f"{{{YT_NS}}}channelid",
+         f"{{{TOMBSTONE_NS}}}deleted-entry"]
+
+
+def _parse_date(text: Optional[str]) -> Optional[datetime]:
+    return parser.parse(text) if text else None
+
+
+class FeedEntry:
+    def __init__(self, video_id: str, channel_id: Optional[str], published: Optional[str], updated: Optional[str]):
+        self.video_id: str = video_id
+        self.id: str = video_id
+        self.channel_id: Optional[str] = channel_id
+        self.published: Optional[str] = published
+        self.updated: Optional[str] = updated
+
+    # Dates are only parsed when used, most callers only need the IDs
+    @property
+    def published_at(self) -> Optional[datetime]:
+        return _parse_date(self.published)
+
+    @property
+    def updated_at(self) -> Optional[datetime]:
+        return _parse_date(self.updated)
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} video_id={self.video_id} channel_id={self.channel_id}>"
+
+
+class DeletedEntry:
+    def __init__(self, video_id: str, deleted: Optional[str]):
+        self.video_id: str = video_id
+        self.id: str = video_id
+        self.deleted: Optional[str] = deleted
+
+    @property
+    def deleted_at(self) -> Optional[datetime]:
+        return _parse_date(self.deleted)
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} video_id={self.video_id}>"
+
+
+class YoutubeFeed:
+    def __init__(self):
+        self.author_name: Optional[str] = None
+        self.entries: list[FeedEntry] = []
+        self.deleted: list[DeletedEntry] = []
+
+    @property
+    def video_ids(self) -> list[str]:
+        return [entry.video_id for entry in self.entries]
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} author={self.author_name!r} entries={len(self.entries)} deleted={len(self.deleted)}>"
+
+
+def parse_feed(content: Union[str, bytes]) -> YoutubeFeed:
+    """Parse a YouTube Atom feed, either a push notification or a channel RSS feed.
+
+    Only the video/channel IDs and timestamps are read, without building a full document tree."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    feed = YoutubeFeed()
+    entry: Optional[dict] = None
+    deleted: Optional[dict] = None
+
+    context = etree.iterparse(BytesIO(content), events=("start", "end"), tag=_TAGS,
+                              resolve_entities=False, no_network=True, recover=True)
+    for event, element in context:
+        tag = etree.QName(element).localname.lower()
+        if event == "start":
+            if tag == "entry":
+                entry = {}
+            elif tag == "deleted-entry":
+                deleted = {"ref": element.get("ref", ""), "when": element.get("when", None)}
+            continue
+
+        if tag == "name":
+            # The first name is either the channel (poll feeds), or the uploader of the entry (push notifications)
+            if feed.author_name is None:
+                feed.author_name = element.text
+        elif tag == "entry":
+            if entry and entry.get("videoid"):
+                feed.entries.append(FeedEntry(entry["videoid"], entry.get("channelid"), entry.get("published"), entry.get("updated")))
+            entry = None
+        elif tag == "deleted-entry":
+            video_id = deleted["ref"].split(":")[-1] if deleted["ref"] else deleted.get("link", "").split("watch?v=")[-1]
+            if video_id:
+                feed.deleted.append(DeletedEntry(video_id, deleted["when"]))
+            deleted = None
+        elif tag == "link":
+            if deleted is not None:
+                deleted["link"] = element.get("href", "")
+        elif entry is not None:
+            entry[tag] = element.text
+        # Elements are no longer needed once read
+        if entry is None and deleted is None:
+            element.clear()
+    return feed
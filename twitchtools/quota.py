@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from time import time
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+# Youtube quota resets at midnight pacific time
+RESET_TIMEZONE = ZoneInfo("America/Los_Angeles")
+# Unit cost of each Youtube Data API endpoint
+# https://developers.google.com/youtube/v3/determine_quota_cost
+ENDPOINT_COSTS = {
+    "videos": 1,
+    "channels": 1,
+    "playlistItems": 1,
+    "playlists": 1,
+    "search": 100
+}
+
+
+class QuotaLedger:
+    """Records the unit cost of each Youtube Data API call made today, and projects usage to the daily reset.
+
+    Spend is only tracked from startup, calls made before a restart aren't known about"""
+
+    def __init__(self, daily_limit: int = 10000):
+        self.daily_limit = daily_limit
+        self.spent = 0
+        self.calls: dict[str, int] = {}
+        self._tracking_since = time()
+        self._reset_at = self._next_reset()
+
+    def _next_reset(self) -> float:
+        now = datetime.now(RESET_TIMEZONE)
+        midnight = datetime(now.year, now.month, now.day, tzinfo=RESET_TIMEZONE) + timedelta(days=1)
+        return midnight.timestamp()
+
+    def _roll_over(self):
+        if time() >= self._reset_at:
+            self.spent = 0
+            self.calls = {}
+            self._tracking_since = time()
+            self._reset_at = self._next_reset()
+
+    def record(self, endpoint: str, cost: Optional[int] = None):
+        self._roll_over()
+        cost = cost if cost is not None else ENDPOINT_COSTS.get(endpoint, 1)
+        self.spent += cost
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    @property
+    def remaining(self) -> int:
+        self._roll_over()
+        return max(self.daily_limit - self.spent, 0)
+
+    @property
+    def seconds_until_reset(self) -> float:
+        self._roll_over()
+        return max(self._reset_at - time(), 0)
+
+    @property
+    def projected(self) -> int:
+        """Total spend by the reset if calls continue at the current rate"""
+        self._roll_over()
+        elapsed = max(time() - self._tracking_since, 60)
+        return round(self.spent + self.spent / elapsed * self.seconds_until_reset)
+
+    def required_interval(self, cost: int) -> float:
+        """Minimum seconds between runs of a job costing this many units, to stay within the remaining budget"""
+        if cost <= 0:
+            return 0
+        if self.remaining <= 0:
+            return float("inf")
+        return cost * self.seconds_until_reset / self.remaining
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"spent": self.spent, "limit": self.daily_limit, "projected": self.projected, "reset_in": round(self.seconds_until_reset)}
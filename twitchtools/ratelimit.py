@@ -1,7 +1,12 @@
+import asyncio
 from asyncio import iscoroutinefunction
 from functools import wraps
+from heapq import heappop, heappush
+from itertools import count
 from time import time
+from typing import Mapping, Optional
 
+from twitchtools.enums import RequestPriority
 from twitchtools.exceptions import RateLimitExceeded
 
 
@@ -39,3 +44,77 @@ class Ratelimit:
         if self._requests_in_period >= self.calls: # If requests are above what they should be
             raise RateLimitExceeded(self.display_name, self.reset_time)
         self._requests_in_period += 1 # Otherwise just iterate requests
+
+
+class HelixRatelimiter:
+    """Token bucket kept in sync with the Ratelimit-* headers helix sends with every response.
+
+    Requests wait for a token when the bucket is empty, and are woken in priority order.
+    The last few tokens of each period are kept for interactive requests, so bulk work can't starve commands."""
+
+    def __init__(self, limit: int = 800, reserve: int = 20):
+        self.limit = limit
+        self.remaining = limit
+        self.reserve = reserve
+        self.reset_at: float = 0
+        self.waited = 0  # Requests that had to wait for a token
+        self.ratelimited = 0  # 429s received
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._waiters)
+
+    def _has_token(self, priority: RequestPriority) -> bool:
+        if time() >= self.reset_at:  # Bucket has been refilled since the last response, helix refills every minute
+            self.remaining = self.limit
+            self.reset_at = time() + 60
+        floor = 0 if priority == RequestPriority.interactive else self.reserve
+        return self.remaining > floor
+
+    async def acquire(self, priority: RequestPriority = RequestPriority.interactive):
+        if not self._waiters and self._has_token(priority):
+            self.remaining -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heappush(self._waiters, (priority, next(self._counter), future))
+        self.waited += 1
+        self._release()
+        await future
+
+    def _release(self):
+        """Hand tokens to waiters in priority order, and schedule a wakeup for the reset if any are left"""
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():  # Cancelled while waiting
+                heappop(self._waiters)
+                continue
+            if not self._has_token(priority):
+                break
+            heappop(self._waiters)
+            self.remaining -= 1
+            future.set_result(None)
+        if self._waiters and self._wakeup is None:
+            self._wakeup = asyncio.get_running_loop().call_later(max(self.reset_at - time(), 0.05), self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._release()
+
+    def update(self, headers: Mapping[str, str]):
+        try:
+            self.limit = int(headers["Ratelimit-Limit"])
+            self.remaining = int(headers["Ratelimit-Remaining"])
+            self.reset_at = float(headers["Ratelimit-Reset"])
+        except (KeyError, ValueError):  # Not a helix response
+            return
+        self._release()
+
+    def retry_after(self, headers: Mapping[str, str]) -> float:
+        """Empty the bucket after a 429, returning how long to wait before retrying"""
+        self.ratelimited += 1
+        self.update(headers)
+        self.remaining = 0
+        return max(self.reset_at - time(), 0.05)
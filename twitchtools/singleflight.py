@@ -0,0 +1,30 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent callers with the same key share its result.
+
+    The call runs as its own task, so a caller being cancelled doesn't cancel it for everyone else."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key, None)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._calls.pop(key) if self._calls.get(key) is t else None)
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._calls)}
@@ -35,6 +35,8 @@ class Stream:
         self.tags: list[str] = tags
         self.is_mature: bool = bool(is_mature)
         self.origin: AlertOrigin = origin
+        # Set by catchup, which loads every streamer's channel cache at once
+        self.channel_cache: Optional[dict] = None
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} streamer={self.user} game={self.game} stream_id={self.id}>"
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Iterable, Iterator, Optional
 
 from dateutil import parser
 
@@ -22,12 +23,58 @@ class Subscription:
         self.broadcaster_user_id: int = int(condition["broadcaster_user_id"])
         self.created_at: datetime = parser.parse(created_at)
         self.method: SubscriptionMethod = SubscriptionMethod(transport["method"])
-        self.callback: str = transport["callback"]
+        # Webhook subscriptions have a callback, websocket subscriptions a session id
+        self.callback: Optional[str] = transport.get("callback", None)
+        self.session_id: Optional[str] = transport.get("session_id", None)
         self.cost: int = int(cost)
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} id={self.id} broadcaster_id={self.broadcaster_user_id} callback={self.callback}>"
 
+class SubscriptionIndex:
+    """Subscriptions indexed by id, type and broadcaster id, for comparing against what should exist"""
+    def __init__(self, subscriptions: Iterable[Subscription] = []):
+        self.by_id: dict[str, Subscription] = {}
+        self.by_type: dict[SubscriptionType, dict[str, Subscription]] = {}
+        self.by_broadcaster: dict[int, dict[str, Subscription]] = {}
+        for subscription in subscriptions:
+            self.add(subscription)
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self) -> Iterator[Subscription]:
+        return iter(list(self.by_id.values()))
+
+    def __contains__(self, subscription_id: str) -> bool:
+        return subscription_id in self.by_id
+
+    def add(self, subscription: Subscription):
+        self.by_id[subscription.id] = subscription
+        self.by_type.setdefault(subscription.type, {})[subscription.id] = subscription
+        self.by_broadcaster.setdefault(subscription.broadcaster_user_id, {})[subscription.id] = subscription
+
+    def remove(self, subscription_id: str) -> Optional[Subscription]:
+        subscription = self.by_id.pop(subscription_id, None)
+        if subscription is not None:
+            self.by_type[subscription.type].pop(subscription_id, None)
+            self.by_broadcaster[subscription.broadcaster_user_id].pop(subscription_id, None)
+        return subscription
+
+    def get(self, subscription_id: str) -> Optional[Subscription]:
+        return self.by_id.get(subscription_id, None)
+
+    def find(self, type: Optional[SubscriptionType] = None, broadcaster_id: Optional[int] = None) -> list[Subscription]:
+        if broadcaster_id is not None:
+            subscriptions = self.by_broadcaster.get(int(broadcaster_id), {}).values()
+            return [s for s in subscriptions if type is None or s.type == type]
+        if type is not None:
+            return list(self.by_type.get(type, {}).values())
+        return list(self.by_id.values())
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} subscriptions={len(self.by_id)}>"
+
 class SubscriptionEvent(Subscription):
     def __init__(self, **kwargs):
         self._subscription = kwargs["subscription"]
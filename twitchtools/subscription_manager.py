@@ -0,0 +1,83 @@
+import asyncio
+from time import time
+from typing import TYPE_CHECKING, Awaitable, Callable, TypeVar, Union
+
+if TYPE_CHECKING:
+    from main import TwitchCallBackBot
+
+T = TypeVar("T")
+
+
+class SubscriptionManager:
+    """Matches subscription confirmations dispatched by the webserver to the creations waiting on them.
+
+    Any number of creations can be waiting at once. Confirmations can arrive before the creation
+    knows its subscription id, so unmatched confirmations are kept for a short while."""
+
+    def __init__(self, bot, event: str, timeout: float = 8, concurrency: int = 10, early_ttl: float = 60):
+        self.bot: TwitchCallBackBot = bot
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.early_ttl = early_ttl
+        self._pending: dict[str, asyncio.Future] = {}
+        self._early: dict[str, float] = {}
+        self.confirmed = 0
+        self.timed_out = 0
+        self.bot.add_listener(self._on_confirmation, f"on_{event}")
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def _on_confirmation(self, key: str):
+        self.confirm(key)
+
+    def confirm(self, key: str):
+        future = self._pending.get(key, None)
+        if future is not None:
+            if not future.done():
+                future.set_result(None)
+            return
+        cutoff = time() - self.early_ttl
+        self._early = {k: t for k, t in self._early.items() if t > cutoff}
+        self._early[key] = time()
+
+    def expect(self, key: str) -> asyncio.Future:
+        """Start listening for a confirmation, before the request that triggers it is sent if the key is known"""
+        if key not in self._pending:
+            self._pending[key] = asyncio.get_running_loop().create_future()
+            if self._early.pop(key, None) is not None:
+                self._pending[key].set_result(None)
+        return self._pending[key]
+
+    def forget(self, key: str):
+        """Stop listening for a confirmation that will never come, such as when the request failed"""
+        future = self._pending.pop(key, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    async def wait(self, key: str) -> bool:
+        """Wait for the confirmation of a subscription, returning False if it timed out"""
+        future = self.expect(key)
+        try:
+            await asyncio.wait_for(future, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            return False
+        finally:
+            self._pending.pop(key, None)
+        self.confirmed += 1
+        return True
+
+    async def run_batch(self, creations: list[Callable[[], Awaitable[T]]]) -> list[Union[T, Exception]]:
+        """Run many creations at once, returning each result or the exception it raised, in order"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(creation: Callable[[], Awaitable[T]]) -> T:
+            async with semaphore:
+                return await creation()
+        return await asyncio.gather(*[run(creation) for creation in creations], return_exceptions=True)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"pending": len(self._pending), "confirmed": self.confirmed, "timed_out": self.timed_out}
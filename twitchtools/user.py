@@ -16,6 +16,8 @@ class PartialUser:
         self.username: str = user_login
         self.display_name: str = display_name
         self.origin: Optional[AlertOrigin] = origin
+        # Set by catchup, which loads every streamer's channel cache at once
+        self.channel_cache: Optional[dict] = None
 
     def __str__(self) -> str:
         return self.login
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from copy import copy
+from time import time
+from typing import Iterable, Optional, Union
+
+from .user import User
+
+
+class UserCache:
+    """Bounded LRU of helix users, indexed by both id and login.
+
+    Entries older than ttl seconds are stale: they are still returned, but should be refreshed in the background.
+    Entries older than max_age seconds are dropped. Lookups return copies, as callers set attributes like origin on users"""
+
+    def __init__(self, maxsize: int = 2048, ttl: int = 3600, max_age: int = 86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_age = max_age
+        self._users: OrderedDict[int, tuple[User, float]] = OrderedDict()
+        self._logins: dict[str, int] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def _remove(self, user_id: int):
+        user, _ = self._users.pop(user_id)
+        if self._logins.get(user.login) == user_id:
+            del self._logins[user.login]
+
+    def get(self, user_id: Optional[Union[int, str]] = None, login: Optional[str] = None) -> tuple[Optional[User], bool]:
+        """Returns the cached user and whether it is stale. Misses return (None, False)"""
+        if user_id is None and login is not None:
+            user_id = self._logins.get(login.lower(), None)
+        if user_id is None or int(user_id) not in self._users:
+            self.misses += 1
+            return None, False
+        user_id = int(user_id)
+        user, fetched_at = self._users[user_id]
+        age = time() - fetched_at
+        if age > self.max_age:
+            self._remove(user_id)
+            self.misses += 1
+            return None, False
+        self._users.move_to_end(user_id)
+        stale = age > self.ttl
+        if stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return copy(user), stale
+
+    def put(self, users: Iterable[User]):
+        now = time()
+        for user in users:
+            if user.id in self._users:
+                self._remove(user.id)
+            # Kept unmodified, so origin set by the caller on the returned user doesn't leak into other lookups
+            self._users[user.id] = (copy(user), now)
+            self._logins[user.login] = user.id
+        while len(self._users) > self.maxsize:
+            self._remove(next(iter(self._users)))
+
+    def invalidate(self, user_id: Union[int, str]):
+        if int(user_id) in self._users:
+            self._remove(int(user_id))
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._users), "hits": self.hits, "stale": self.stale_hits, "misses": self.misses}
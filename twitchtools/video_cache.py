@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from time import time
+from typing import Iterable, Optional
+
+# How long each part of a video is kept. Live state changes quickly, titles and durations don't
+PART_TTLS = {
+    "liveStreamingDetails": 30,
+    "status": 30,
+    "snippet": 300,
+    "contentDetails": 300
+}
+# Video IDs Youtube didn't return are remembered for this long
+MISSING_TTL = 60
+
+
+class VideoCache:
+    """Parts of recently fetched Youtube videos, keyed by video ID, so each part is only requested when it has expired.
+
+    Parts absent from a response (liveStreamingDetails on regular videos) are cached as absent"""
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        # Video ID: Part: (Value, fetch time)
+        self._videos: OrderedDict[str, dict[str, tuple[Optional[dict], float]]] = OrderedDict()
+        self._missing: dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def is_missing(self, video_id: str) -> bool:
+        if (missing_at := self._missing.get(video_id, None)) is None:
+            return False
+        if time() - missing_at > MISSING_TTL:
+            del self._missing[video_id]
+            return False
+        return True
+
+    def missing_parts(self, video_id: str, parts: Iterable[str]) -> set[str]:
+        cached = self._videos.get(video_id, {})
+        now = time()
+        missing = {part for part in parts if part not in cached or now - cached[part][1] > PART_TTLS.get(part, 30)}
+        if missing:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return missing
+
+    def get(self, video_id: str, parts: Iterable[str]) -> Optional[dict]:
+        """The video item with the requested parts, in the same shape as the API returns. Parts are not checked for expiry"""
+        if (cached := self._videos.get(video_id, None)) is None:
+            return None
+        self._videos.move_to_end(video_id)
+        item = {"id": video_id}
+        for part in parts:
+            if part not in cached:
+                return None
+            if cached[part][0] is not None:
+                item[part] = cached[part][0]
+        return item
+
+    def put(self, item: dict, parts: Iterable[str]):
+        now = time()
+        cached = self._videos.setdefault(item["id"], {})
+        for part in parts:
+            cached[part] = (item.get(part, None), now)
+        self._videos.move_to_end(item["id"])
+        self._missing.pop(item["id"], None)
+        while len(self._videos) > self.maxsize:
+            self._videos.popitem(last=False)
+
+    def put_missing(self, video_id: str):
+        self._videos.pop(video_id, None)
+        self._missing[video_id] = time()
+
+    def invalidate(self, video_id: str):
+        self._videos.pop(video_id, None)
+        self._missing.pop(video_id, None)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._videos), "hits": self.hits, "misses": self.misses}